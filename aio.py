@@ -0,0 +1,259 @@
+import asyncio
+import os
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from functools import lru_cache
+
+import asyncpg
+from psycopg2.extensions import parse_dsn
+
+import metrics
+from blood_units import (ALLOCATE_UNITS_SQL, EXPIRE_STOCK_SQL, LOCK_ALL_STOCK_SQL, LOCK_STOCK_SQL,
+                         STOCK_SQL)
+from db_config import DB_SETTINGS, POOL_MIN, POOL_TIMEOUT
+from db_router import parse_lsn, router
+from fulfillment import (LOCK_REQUEST_SQL, MARK_FULFILLED_SQL, MAX_RETRIES, RETRY_BACKOFF,
+                         FulfillmentError, units_for)
+from logs import get_logger
+from slow_queries import SLOW_QUERY_MS, slow_log
+
+# asyncpg side of the async deployment mode (asgi.py): one pool for the primary and one per
+# DB_REPLICAS entry, per worker process and event loop. Statements are the psycopg2 ones
+# (%s placeholders) converted to $n once, so both modes run the same SQL; replica health and
+# lag still come from the router's check thread.
+ASYNC_POOL_MAX = int(os.environ.get('DB_ASYNC_POOL_MAX', os.environ.get('DB_POOL_MAX', '10')))
+
+RETRYABLE_ERRORS = (asyncpg.exceptions.SerializationError, asyncpg.exceptions.DeadlockDetectedError)
+CONNECT_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.exceptions.PostgresConnectionError)
+
+log = get_logger('aio')
+
+_pool = None
+_replica_pools = {}  # Replica.name -> asyncpg pool
+
+_PLACEHOLDER = re.compile(r"%(%|s)")
+
+
+@lru_cache(maxsize=512)
+def pg(query):
+    # psycopg2 paramstyle -> asyncpg: %s becomes $1, $2, ... and %% becomes %
+    numbers = iter(range(1, query.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda m: '%' if m.group(1) == '%' else f"${next(numbers)}", query)
+
+
+def _encode_date(value):
+    return value if isinstance(value, str) else value.isoformat()
+
+
+async def _init_connection(conn):
+    # Dates go over as text so '2024-05-01' strings from JSON bodies bind the way they do with
+    # psycopg2 (Postgres parses them) instead of failing asyncpg's binary encoder
+    await conn.set_type_codec('date', schema='pg_catalog', format='text',
+                              encoder=_encode_date, decoder=date.fromisoformat)
+
+
+def _connect_kwargs(dsn=None):
+    if dsn is None:
+        settings = dict(DB_SETTINGS)
+        settings['timeout'] = settings.pop('connect_timeout')
+        return settings
+    params = parse_dsn(dsn)
+    kwargs = {key: params[key] for key in ('host', 'port', 'user', 'password') if key in params}
+    if 'dbname' in params:
+        kwargs['database'] = params['dbname']
+    kwargs['timeout'] = DB_SETTINGS['connect_timeout']
+    return kwargs
+
+
+async def open_pools():
+    global _pool
+    if _pool is not None:
+        return
+    _pool = await asyncpg.create_pool(min_size=POOL_MIN, max_size=ASYNC_POOL_MAX, init=_init_connection,
+                                      **_connect_kwargs())
+    for replica in router.replicas:
+        # Lazily connected: a replica that is down at startup only costs it its reads
+        _replica_pools[replica.name] = asyncpg.create_pool(min_size=0, max_size=ASYNC_POOL_MAX,
+                                                           init=_init_connection,
+                                                           **_connect_kwargs(replica.dsn))
+    for replica_pool in _replica_pools.values():
+        await replica_pool
+    log.info("Async pools open", extra={"max_size": ASYNC_POOL_MAX, "replicas": len(_replica_pools)})
+
+
+async def close_pools():
+    global _pool
+    pools = list(_replica_pools.values()) + ([_pool] if _pool is not None else [])
+    _pool = None
+    _replica_pools.clear()
+    await asyncio.gather(*(pool.close() for pool in pools), return_exceptions=True)
+
+
+def get_pool():
+    if _pool is None:
+        raise RuntimeError("Async pools are not open (aio.open_pools() runs in the ASGI lifespan)")
+    return _pool
+
+
+@asynccontextmanager
+async def connection():
+    # A primary connection, like get_db()
+    pool = get_pool()
+    conn = await pool.acquire(timeout=POOL_TIMEOUT)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+@asynccontextmanager
+async def read_connection(min_lsn=None):
+    # Like get_read_db(): a healthy, caught-up replica when DB_REPLICAS is set, else the primary
+    replica = router.choose(min_lsn)
+    pool = _replica_pools.get(replica.name) if replica is not None else None
+    conn = None
+    if pool is not None:
+        try:
+            conn = await pool.acquire(timeout=POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass  # Busy, not down
+        except CONNECT_ERRORS:
+            # Unreachable: no more reads until the next health check passes
+            replica.healthy = False
+            replica.errors += 1
+        if conn is None:
+            router.primary_reads += 1
+    if conn is None:
+        pool = get_pool()
+        conn = await pool.acquire(timeout=POOL_TIMEOUT)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def _observe(query, args, elapsed, rows):
+    # Same accounting as metrics.TimedCursorMixin. Slow statements are logged and aggregated, but
+    # not EXPLAINed: the sampler binds parameters with a psycopg2 cursor, which there isn't here.
+    stats = metrics.current()
+    if stats is not None:
+        stats.add_query(elapsed, rows)
+    if 0 < SLOW_QUERY_MS <= elapsed * 1000:
+        slow_log.record(None, query, args, elapsed, stats.route if stats is not None else None)
+
+
+async def fetch(conn, query, *args):
+    started = time.perf_counter()
+    rows = []
+    try:
+        rows = await conn.fetch(pg(query), *args)
+        return rows
+    finally:
+        _observe(query, args, time.perf_counter() - started, len(rows))
+
+
+async def fetchrow(conn, query, *args):
+    started = time.perf_counter()
+    row = None
+    try:
+        row = await conn.fetchrow(pg(query), *args)
+        return row
+    finally:
+        _observe(query, args, time.perf_counter() - started, int(row is not None))
+
+
+async def execute(conn, query, *args):
+    started = time.perf_counter()
+    try:
+        return await conn.execute(pg(query), *args)
+    finally:
+        _observe(query, args, time.perf_counter() - started, 0)
+
+
+async def stream_rows(query, args, batch_size, min_lsn=None):
+    # Async generator: yields None once the query is running, then lists of up to batch_size rows.
+    # A cursor needs a transaction; closing the generator rolls it back and releases the connection.
+    async with read_connection(min_lsn) as conn:
+        async with conn.transaction(readonly=True):
+            started = time.perf_counter()
+            try:
+                cursor = await conn.cursor(pg(query), *args)
+            finally:
+                _observe(query, args, time.perf_counter() - started, 0)
+            yield None
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    return
+                yield rows
+
+
+async def run_in_transaction(conn, work, retries=MAX_RETRIES):
+    # fulfillment.run_in_transaction for asyncpg: await work(conn) in a transaction, retried on
+    # serialization failures/deadlocks
+    for attempt in range(retries + 1):
+        try:
+            async with conn.transaction():
+                return await work(conn)
+        except RETRYABLE_ERRORS:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+async def current_lsn(conn):
+    # Primary's WAL position after a write, for read-your-writes
+    return parse_lsn(await conn.fetchval("SELECT pg_current_wal_lsn()::text;"))
+
+
+# Async twins of blood_units.lock_stock/allocate_units and fulfillment.fulfill_request/deduct_stock
+async def lock_stock(conn, blood_types=None):
+    with metrics.lock_wait('inventory'):
+        if blood_types is None:
+            rows = await fetch(conn, LOCK_ALL_STOCK_SQL)
+        else:
+            rows = await fetch(conn, LOCK_STOCK_SQL, list(blood_types))
+    locked = [row[0] for row in rows]
+    if locked:
+        await execute(conn, EXPIRE_STOCK_SQL, locked)
+    return {row[0]: row[1] for row in await fetch(conn, STOCK_SQL, locked)}
+
+
+async def allocate_units(conn, demands):
+    if not demands:
+        return {}
+    request_ids, blood_types, units = zip(*demands)
+    rows = await fetch(conn, ALLOCATE_UNITS_SQL, list(request_ids), list(blood_types), list(units),
+                       sorted(set(blood_types)))
+    taken = {}
+    for (blood_type,) in rows:
+        taken[blood_type] = taken.get(blood_type, 0) + 1
+    return taken
+
+
+async def fulfill_request(conn, request_id, allocated_units=0):
+    with metrics.lock_wait('request'):
+        req = await fetchrow(conn, LOCK_REQUEST_SQL, request_id)
+    if not req:
+        raise FulfillmentError("Request not found", 404)
+    blood_group, required_units, status, recipient_id = req
+    if status != 'Pending':
+        raise FulfillmentError(f"Request {request_id} is already {status}", 409)
+
+    units_to_deduct = units_for(allocated_units, required_units)
+    remaining = await deduct_stock(conn, blood_group, units_to_deduct, request_id)
+
+    await execute(conn, MARK_FULFILLED_SQL, request_id)
+    return {"request_id": request_id, "recipient_id": recipient_id, "blood_group": blood_group,
+            "units": units_to_deduct, "remaining": remaining}
+
+
+async def deduct_stock(conn, blood_type, units, request_id=None):
+    available = (await lock_stock(conn, [blood_type])).get(blood_type, 0)
+    if available < units:
+        raise FulfillmentError("Insufficient stock")
+    await allocate_units(conn, [(request_id, blood_type, units)])
+    return available - units
@@ -0,0 +1,142 @@
+import os
+
+from psycopg2.extras import execute_values
+
+from blood_units import allocate_units, lock_stock
+
+BLOOD_GROUPS = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+# Red cell compatibility: donor type -> recipient types it can be given to
+CAN_DONATE_TO = {
+    'O-': ['O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+'],
+    'O+': ['O+', 'A+', 'B+', 'AB+'],
+    'A-': ['A-', 'A+', 'AB-', 'AB+'],
+    'A+': ['A+', 'AB+'],
+    'B-': ['B-', 'B+', 'AB-', 'AB+'],
+    'B+': ['B+', 'AB+'],
+    'AB-': ['AB-', 'AB+'],
+    'AB+': ['AB+'],
+}
+# Recipient type -> compatible donor types, most preferred first: the exact type, then the type that
+# can serve the fewest other groups (so O- is always last), Rh+ before Rh- on ties
+DONORS_FOR = {
+    recipient: sorted((donor for donor, recipients in CAN_DONATE_TO.items() if recipient in recipients),
+                      key=lambda donor: (donor != recipient, len(CAN_DONATE_TO[donor]), donor.endswith('-')))
+    for recipient in BLOOD_GROUPS
+}
+UNIVERSAL_DONOR = 'O-'
+# O- units kept back from routine (non-Emergency) requests of other blood groups
+UNIVERSAL_RESERVE = int(os.environ.get('ALLOCATION_UNIVERSAL_RESERVE', '5'))
+
+
+def plan(requests, stock, reserve=UNIVERSAL_RESERVE):
+    # requests: (request_id, date, required_units, request_type, blood_group, recipient_id) tuples
+    # stock: {blood_type: units}, not modified
+    # Returns (allocations, remaining stock); an allocation is (request_id, {donor_type: units}).
+    #
+    # Emergency requests are served before routine ones. Within each of those tiers, requests are
+    # first served from their own blood group (oldest first), and only then do the leftovers draw
+    # on compatible substitutes, in DONORS_FOR order. That keeps an old AB+ request from taking
+    # O- stock that a newer O- request in the same tier could only have been served from.
+    # Each request is all-or-nothing but may be split across donor types.
+    stock = {blood_type: units for blood_type, units in stock.items() if units > 0}
+    allocations = []
+    tiers = ([], [])
+    for row in requests:
+        if row[2] and row[2] > 0 and row[4] in DONORS_FOR:
+            tiers[row[3] != 'Emergency'].append(row)
+    for routine, tier in enumerate(tiers):
+        tier.sort(key=lambda row: (row[1] is None, row[1] or 0, row[0]))
+        leftover = []
+        for row in tier:
+            request_id, _, units, _, group, _ = row
+            if stock.get(group, 0) >= units:
+                stock[group] -= units
+                allocations.append((request_id, {group: units}))
+            else:
+                leftover.append(row)
+        for request_id, _, units, _, group, _ in leftover:
+            available = []
+            for donor in DONORS_FOR[group]:
+                usable = stock.get(donor, 0)
+                if routine and donor == UNIVERSAL_DONOR and group != UNIVERSAL_DONOR:
+                    usable -= reserve
+                if usable > 0:
+                    available.append((donor, usable))
+            if sum(usable for _, usable in available) < units:
+                continue
+            sources = {}
+            needed = units
+            for donor, usable in available:
+                take = min(usable, needed)
+                sources[donor] = take
+                stock[donor] -= take
+                needed -= take
+                if not needed:
+                    break
+            allocations.append((request_id, sources))
+    return allocations, stock
+
+
+def allocate(cur, blood_group=None, region=None, dry_run=True, reserve=UNIVERSAL_RESERVE,
+             method='Compatibility Allocation'):
+    # Plans (and unless dry_run, applies in the caller's transaction) compatibility-aware allocations
+    # for all pending requests, optionally only those of one blood group / region.
+    lock = "" if dry_run else " FOR UPDATE"
+    query = """
+        SELECT request_id, date, required_units, request_type, blood_group, recipient_id FROM requests
+        WHERE status = 'Pending'
+    """
+    params = []
+    if blood_group:
+        query += " AND blood_group = %s"
+        params.append(blood_group)
+    if region:
+        query += " AND recipient_region = %s"
+        params.append(region)
+    # Same lock order as fulfill_request: requests (by request_id), then inventory (by blood_type)
+    cur.execute(query + " ORDER BY request_id" + lock + ";", params)
+    rows = cur.fetchall()
+    if dry_run:
+        cur.execute("SELECT blood_type, units FROM inventory_master ORDER BY blood_type;")
+        stock = dict(cur.fetchall())
+    else:
+        stock = lock_stock(cur)
+
+    allocations, remaining = plan(rows, stock, reserve)
+
+    by_id = {row[0]: row for row in rows}
+    deducted = {}
+    planned = []
+    demands = []  # In plan (priority) order, for FEFO
+    for request_id, sources in allocations:
+        _, _, units, request_type, group, recipient_id = by_id[request_id]
+        for donor, take in sources.items():
+            deducted[donor] = deducted.get(donor, 0) + take
+            demands.append((request_id, donor, take))
+        planned.append({"request_id": request_id, "recipient_id": recipient_id, "blood_group": group,
+                        "request_type": request_type, "units": units, "sources": sources})
+    planned.sort(key=lambda a: a['request_id'])
+
+    if planned and not dry_run:
+        allocate_units(cur, demands)
+        cur.execute("UPDATE requests SET status = 'Fulfilled' WHERE request_id = ANY(%s);",
+                    ([a['request_id'] for a in planned],))
+        # One transaction row per donor type used, so substitutions stay traceable
+        execute_values(cur, """
+            INSERT INTO transactions (date, units_allocated, method, request_id, donation_id) VALUES %s;
+        """, [(take, method if donor == a['blood_group'] else f"{method} ({donor})", a['request_id'])
+              for a in planned for donor, take in a['sources'].items()],
+            template="(CURRENT_DATE, %s, %s, %s, NULL)")
+
+    return {
+        "dry_run": dry_run,
+        "pending": len(rows),
+        "fulfilled": len(planned),
+        "unfulfilled": len(rows) - len(planned),
+        "units_allocated": sum(deducted.values()),
+        "substituted_units": sum(take for a in planned for donor, take in a['sources'].items()
+                                 if donor != a['blood_group']),
+        "stock_before": {bt: stock[bt] for bt in sorted(stock)},
+        "stock_after": {bt: remaining.get(bt, stock[bt]) for bt in sorted(stock)},
+        "allocations": planned,
+    }
@@ -4,9 +4,27 @@
 # I've added it below, integrated into your existing app.py structure.
 # Also, ensure your database has the required views/tables (see notes at the end).
 
-from flask import Flask, jsonify, request, render_template, redirect, session, url_for, abort
-from db_config import get_db_connection  # Assume this returns a psycopg2 connection
-import bcrypt
+from flask import Flask, Response, jsonify, request, render_template, redirect, session, url_for, abort, has_request_context, g
+from db_config import get_db_connection, get_pool
+from db_router import router
+from regions import DEFAULT_REGION, REGIONS, fan_out, merge_sorted
+from cache import TTLCache, caches, invalidate, invalidate_local
+from cache_bus import bus
+import events
+import metrics
+import migrate
+from logs import get_logger
+from slow_queries import slow_log
+from allocation import BLOOD_GROUPS, UNIVERSAL_RESERVE, allocate
+import appointment_slots
+import donor_eligibility
+from appointment_slots import SlotError
+from blood_units import SHELF_LIFE_DAYS, UNIT_STATUSES, UnitError, expiry_job, receive_units, set_stock
+from bulk_import import BulkImportError, run_import
+from exports import ExportError, stream_csv, write_parquet
+from forecast import FORECAST_INTERVAL, LOW_STOCK_UNITS, forecast_job, with_stock
+from fulfillment import MAX_BATCH_SIZE, FulfillmentError, fulfill_batch, fulfill_request, run_in_transaction
+import passwords
 from flask_cors import CORS
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
@@ -15,9 +33,15 @@ from functools import wraps
 from datetime import datetime
 from flask import render_template
 from flask import send_file
+import hashlib
+import json
+import logging
 import os
+import queue
 
 app = Flask(__name__)
+log = get_logger('app')
+
 def strftime_filter(value, format_spec='%Y-%m-%d'):
     if value is None:
         return ""
@@ -27,14 +51,70 @@ app.jinja_env.filters['strftime'] = strftime_filter
 app.secret_key = os.environ.get('SECRET_KEY', 'my_secret_key')  # Use env var in prod
 CORS(app)
 
-# DB Context Manager (reduces boilerplate)
+# Apply pending schema migrations as each worker starts (or run `python migrate.py up` on deploy)
+if os.environ.get('DB_MIGRATE_ON_START', '0').lower() in ('1', 'true', 'yes'):
+    migration_conn = get_db_connection()
+    try:
+        migrate.upgrade(migration_conn)
+    finally:
+        migration_conn.close()
+
+# Admin overview counters, invalidated by the write routes that change them
+stats_cache = TTLCache('stats', ttl=float(os.environ.get('STATS_CACHE_TTL', '30')))
+# Stock levels (~8 rows), invalidated by inventory updates and fulfillments
+inventory_cache = TTLCache('inventory', ttl=float(os.environ.get('INVENTORY_CACHE_TTL', '5')))
+
+# DB Context Manager (reduces boilerplate): borrows a pooled connection and returns it afterwards
 @contextmanager
 def get_db():
-    conn = get_db_connection()
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        if router.enabled and has_request_context() and request.method not in ('GET', 'HEAD'):
+            # Read-your-writes: this session's reads stay on the primary until a replica replays this
+            session['write_lsn'] = router.current_lsn(conn)
+    finally:
+        pool.putconn(conn)
+
+# Read-only queries: a healthy, caught-up replica (round-robin) when DB_REPLICAS is set, else the primary
+@contextmanager
+def get_read_db():
+    pool, conn = router.getconn(session.get('write_lsn'))
     try:
         yield conn
     finally:
-        conn.close()
+        pool.putconn(conn)
+
+# Streaming (NDJSON) mode for bulk list endpoints: ?stream=1 or Accept: application/x-ndjson
+STREAM_ITERSIZE = int(os.environ.get('STREAM_ITERSIZE', '2000'))
+
+def wants_stream():
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+def stream_ndjson(query, params, to_dict):
+    # Server-side (named) cursor: rows arrive in batches of STREAM_ITERSIZE, memory stays constant
+    def generate():
+        with get_read_db() as conn:
+            cur = conn.cursor(name='ndjson_stream')
+            cur.itersize = STREAM_ITERSIZE
+            try:
+                cur.execute(query, params)
+                yield ''  # Query accepted; rows follow
+                for row in cur:
+                    yield app.json.dumps(to_dict(row)) + '\n'
+            finally:
+                conn.rollback()  # Ends the read transaction and drops the server-side cursor
+
+    rows = generate()
+    try:
+        next(rows)  # Run the query now so errors still produce a proper 500
+    except Exception as e:
+        rows.close()
+        abort(500, f"Database error: {str(e)}")
+    return Response(rows, mimetype='application/x-ndjson')
 
 def login_required(role=None):
     def decorator(f):
@@ -62,25 +142,72 @@ def login_required(role=None):
         #return decorated_function
     #return decorator-- ###
     
+# Per-request metrics for /metrics; registered first so the other hooks are timed too
+@app.before_request
+def start_request_metrics():
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    g.request_stats = metrics.start_request(request.method, route)
+
+@app.after_request
+def record_request_metrics(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+
+    def finish():
+        # On close, so streamed bodies (NDJSON, CSV exports) are timed to the last byte
+        duration = stats.finish(response.status_code)
+        metrics.end_request()
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Request served", extra={
+                "method": stats.method, "route": stats.route, "status": response.status_code,
+                "duration_ms": round(duration * 1000, 3), "db_ms": round(stats.db_time * 1000, 3),
+                "queries": stats.queries, "rows": stats.rows, "lock_wait_ms": round(stats.lock_wait * 1000, 3)})
+
+    response.call_on_close(finish)
+    return response
+
+@app.before_request
+def start_cache_bus():
+    bus.start()  # No-op after the first request in each worker process
+    expiry_job.start()
+    forecast_job.start()
+    router.start()
+
+def on_units_expired(remaining):
+    invalidate('stats', 'inventory')
+    events.publish([{"type": "inventory_changed", "data": {"blood_type": bt, "units": units}}
+                    for bt, units in remaining.items()])
+
+expiry_job.on_expired = on_units_expired
+# New thresholds change this worker's low-stock count and inventory thresholds (each worker loads
+# the shared forecast snapshot itself)
+forecast_job.on_refresh = lambda snapshot: invalidate_local('stats', 'inventory')
+
+DEMO_SESSION = {'user_id': 1, 'name': "Demo User", 'role': "Admin", 'region': "North"}  # Also used by asgi.py
+
 @app.before_request
 def auto_login_demo():
-    session['user_id'] = 1
-    session['name'] = "Demo User"
-    session['role'] = "Admin"
-    session['region'] = "North"
+    session.update(DEMO_SESSION)
 # -------------------------
 # 🩸 USERS CRUD (Standardized to lowercase schema)
 # -------------------------
+USER_COLUMNS = ['user_id', 'name', 'contact_no', 'blood_group', 'role', 'email', 'region']
+
+def user_row(row):
+    return dict(zip(USER_COLUMNS, row))
+
 @app.route('/users', methods=['GET'])
 def get_users():
-    with get_db() as conn:
+    query = 'SELECT * FROM users ORDER BY user_id;'
+    if wants_stream():
+        return stream_ndjson(query, [], user_row)
+    with get_read_db() as conn:
         cur = conn.cursor()
         try:
-            cur.execute('SELECT * FROM users ORDER BY user_id;')
+            cur.execute(query)
             users = cur.fetchall()
-            columns = ['user_id', 'name', 'contact_no', 'blood_group', 'role', 'email', 'region']
-
-            results = [dict(zip(columns, row)) for row in users]
+            results = [user_row(row) for row in users]
             return jsonify(results)
         except Exception as e:
             abort(500, f"Database error: {str(e)}")
@@ -93,7 +220,7 @@ def add_user():
     if not all(k in data for k in ['name', 'contact_no', 'blood_group', 'role', 'email', 'password']):
         abort(400, "Missing required fields")
     
-    hashed_pw = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_pw = passwords.hash_password(data['password'])  # Runs on the hashing executor, not this thread
     with get_db() as conn:
         cur = conn.cursor()
         try:
@@ -102,6 +229,7 @@ def add_user():
                 VALUES (%s, %s, %s, %s, %s, %s) RETURNING user_id;
             """, (data['name'], data['contact_no'], data['blood_group'], data['role'], data['email'], hashed_pw))
             user_id = cur.fetchone()[0]
+            invalidate('stats', cur=cur)
             conn.commit()
             return jsonify({"message": "User added successfully", "user_id": user_id}), 201
         except Exception as e:
@@ -119,6 +247,7 @@ def delete_user(user_id):
             cur.execute("DELETE FROM users WHERE user_id = %s;", (user_id,))
             if cur.rowcount == 0:
                 abort(404, "User not found")
+            invalidate('stats', cur=cur)
             conn.commit()
             return jsonify({"message": "User deleted successfully"})
         except Exception as e:
@@ -130,22 +259,28 @@ def delete_user(user_id):
 # -------------------------
 # 💉 DONATIONS CRUD
 # -------------------------
+DONATION_COLUMNS = ['donation_id', 'date', 'quantity', 'status', 'donor_id']
+
+def donation_row(row):
+    return dict(zip(DONATION_COLUMNS, row))
+
 @app.route('/donations', methods=['GET'])
 def get_donations():
     donor_id = request.args.get('donor_id')  # Get query param, e.g., ?donor_id=123
-    with get_db() as conn:
+    query = "SELECT donation_id, date, quantity, status, donor_id FROM donations WHERE 1=1"
+    params = []
+    if donor_id:
+        query += " AND donor_id = %s"
+        params.append(donor_id)
+    query += " ORDER BY date DESC;"  # Most recent first
+    if wants_stream():
+        return stream_ndjson(query, params, donation_row)
+    with get_read_db() as conn:
         cur = conn.cursor()
         try:
-            query = "SELECT donation_id, date, quantity, status, donor_id FROM donations WHERE 1=1"
-            params = []
-            if donor_id:
-                query += " AND donor_id = %s"
-                params.append(donor_id)
-            query += " ORDER BY date DESC;"  # Most recent first
             cur.execute(query, params)
             donations = cur.fetchall()
-            columns = ['donation_id', 'date', 'quantity', 'status', 'donor_id']
-            results = [dict(zip(columns, row)) for row in donations]
+            results = [donation_row(row) for row in donations]
             return jsonify(results)
         except Exception as e:
             abort(500, f"Database error: {str(e)}")
@@ -167,6 +302,7 @@ def add_donation():
                 VALUES (%s, %s, %s, %s) RETURNING donation_id;
             """, (data['date'], data['quantity'], data['status'], session['user_id']))
             donation_id = cur.fetchone()[0]
+            invalidate('stats', cur=cur)
             conn.commit()
             return jsonify({"message": "Donation recorded", "donation_id": donation_id}), 201
         except Exception as e:
@@ -179,70 +315,92 @@ def add_donation():
 
 # -------------------------
 # Update /requests GET (lowercase schema, no quotes)
+def request_row(row):
+    # Convert date to string for JSON serialization
+    req_date = str(row[1]) if row[1] else None  # row[1] = date
+    blood_group = row[6] if len(row) > 6 and row[6] else None  # blood_group (handle if missing)
+    return {
+        'request_id': row[0],
+        'date': req_date,
+        'required_units': row[2],
+        'status': row[3],
+        'recipient_id': row[4],
+        'request_type': row[5],
+        'blood_group': blood_group
+    }
+
+def requests_query(recipient_id, region):
+    # (query, params) for GET /requests; shared with asgi.py
+    query = """
+        SELECT request_id, date, required_units, status, recipient_id, 
+               request_type, blood_group 
+        FROM requests WHERE 1=1
+    """
+    params = []
+    if recipient_id:
+        query += ' AND recipient_id = %s'
+        params.append(recipient_id)
+        if region:
+            query += ' AND recipient_region = %s'  # Only the recipient's own partition is scanned
+            params.append(region)
+    query += ' ORDER BY date DESC;'  # Most recent first
+    return query, params
+
 @app.route('/requests', methods=['GET'])
 def get_requests():
     recipient_id = request.args.get('recipient_id')  # e.g., ?recipient_id=2
-    with get_db() as conn:
+    query, params = requests_query(recipient_id, own_region(recipient_id))
+    if wants_stream():
+        return stream_ndjson(query, params, request_row)
+    with get_read_db() as conn:
         cur = conn.cursor()
         try:
-            query = """
-                SELECT request_id, date, required_units, status, recipient_id, 
-                       request_type, blood_group 
-                FROM requests WHERE 1=1
-            """
-            params = []
-            if recipient_id:
-                query += ' AND recipient_id = %s'
-                params.append(recipient_id)
-            query += ' ORDER BY date DESC;'  # Most recent first
             cur.execute(query, params)
             requests_data = cur.fetchall()
-            results = []
-            for row in requests_data:
-                # Convert date to string for JSON serialization
-                req_date = str(row[1]) if row[1] else None  # row[1] = date
-                blood_group = row[6] if len(row) > 6 and row[6] else None  # blood_group (handle if missing)
-                results.append({
-                    'request_id': row[0],
-                    'date': req_date,
-                    'required_units': row[2],
-                    'status': row[3],
-                    'recipient_id': row[4],
-                    'request_type': row[5],
-                    'blood_group': blood_group
-                })
-            print(f"DEBUG: Fetched {len(results)} requests for recipient_id={recipient_id or 'all'}")  # Terminal debug
+            results = [request_row(row) for row in requests_data]
+            log.debug("Fetched requests", extra={"count": len(results), "recipient_id": recipient_id})
             return jsonify(results)
         except Exception as e:
-            print(f"ERROR in /requests GET: {e}")  # Terminal debug
+            log.error("Listing requests failed", extra={"error": str(e)})
             abort(500, f"Database error: {str(e)}")
         finally:
             cur.close()
 
 # Update /requests POST (lowercase schema, no quotes)
+INSERT_REQUEST_SQL = """
+    INSERT INTO requests (date, required_units, status, recipient_id, recipient_region, request_type, blood_group)
+    VALUES (%s, %s, 'Pending', %s, %s, %s, %s) RETURNING request_id;
+"""
+
 @app.route('/requests', methods=['POST'])
 @login_required(role='Recipient')  # Or add manual session check if no decorator
 def add_request():
     data = request.json
     required_fields = ['date', 'required_units', 'request_type', 'blood_group']
     data['recipient_region'] = session.get('region')  # From user session (fetch on login)
+    if data['recipient_region'] not in REGIONS:
+        data['recipient_region'] = DEFAULT_REGION  # Every row must land in a region partition
     if not all(k in data for k in required_fields):
         return jsonify({"error": "Missing required fields: date, required_units, request_type, blood_group"}), 400
     
     with get_db() as conn:
         cur = conn.cursor()
         try:
-            cur.execute("""
-    INSERT INTO requests (date, required_units, status, recipient_id, recipient_region, request_type, blood_group)
-    VALUES (%s, %s, 'Pending', %s, %s, %s, %s) RETURNING request_id;
-""", (data['date'], data['required_units'], session['user_id'], data['recipient_region'], data['request_type'], data['blood_group']))
+            cur.execute(INSERT_REQUEST_SQL, (data['date'], data['required_units'], session['user_id'], data['recipient_region'], data['request_type'], data['blood_group']))
             request_id = cur.fetchone()[0]
+            invalidate('stats', cur=cur)
+            events.publish_event('request_created', {
+                'request_id': request_id, 'date': data['date'], 'required_units': data['required_units'],
+                'status': 'Pending', 'recipient_id': session['user_id'],
+                'request_type': data['request_type'], 'blood_group': data['blood_group'],
+                'recipient_region': data['recipient_region']
+            }, cur)
             conn.commit()
-            print(f"DEBUG: Created request {request_id} for user {session['user_id']}")  # Terminal debug
+            log.debug("Created request", extra={"request_id": request_id, "user_id": session['user_id']})
             return jsonify({"message": "Request added successfully", "request_id": request_id}), 201
         except Exception as e:
             conn.rollback()
-            print(f"ERROR in /requests POST: {e}")
+            log.error("Creating request failed", extra={"error": str(e)})
             return jsonify({"error": f"Database error: {str(e)}"}), 500
         finally:
             cur.close()
@@ -250,14 +408,20 @@ def add_request():
 
 
 # ---------------- HOSPITALS ----------------
+def hospital_row(d):
+    return {"org_id": d[0], "name": d[1], "contact": d[2], "location": d[3]}
+
 @app.route('/hospitals', methods=['GET'])
 def get_hospitals():
-    with get_db() as conn:
+    query = "SELECT org_id, name, contact, location FROM hospitals;"
+    if wants_stream():
+        return stream_ndjson(query, [], hospital_row)
+    with get_read_db() as conn:
         cur = conn.cursor()
         try:
-            cur.execute("SELECT org_id, name, contact, location FROM hospitals;")
+            cur.execute(query)
             data = cur.fetchall()
-            hospitals = [{"org_id": d[0], "name": d[1], "contact": d[2], "location": d[3]} for d in data]
+            hospitals = [hospital_row(d) for d in data]
             return jsonify(hospitals)
         except Exception as e:
             abort(500, f"Database error: {str(e)}")
@@ -290,7 +454,7 @@ def add_hospital():
 def get_appointments():
     user_id = request.args.get('user_id') or session.get('user_id') # Optional filter
     appointments = []
-    with get_db() as conn:
+    with get_read_db() as conn:
         cur = conn.cursor()
         try:
             query = "SELECT appointment_id, date, time_slot, status, user_id FROM appointments WHERE 1=1"
@@ -313,11 +477,12 @@ def get_appointments():
                 })
             return render_template('appointments.html', appointments=appointments)
         except Exception as e:
-            print(f"Full DB error: {e}")
+            log.error("Listing appointments failed", extra={"error": str(e)})
             abort(500, f"Database error: {str(e)}")
         finally:
             cur.close()
 
+# Books one place in a slot (optional "center_id", a hospital); 409 when the slot is full
 @app.route('/appointments', methods=['POST'])
 @login_required(role='Donor')
 def add_appointment():
@@ -328,26 +493,53 @@ def add_appointment():
     with get_db() as conn:
         cur = conn.cursor()
         try:
-            cur.execute("INSERT INTO appointments (date, time_slot, status, user_id) VALUES (%s, %s, 'Pending', %s) RETURNING appointment_id",
-                        (data['date'], data['time_slot'], session['user_id']))
-            new_id = cur.fetchone()[0]
+            center_id = appointment_slots.parse_center(cur, data.get('center_id'))
+            new_id = appointment_slots.book(cur, session['user_id'], appointment_slots.parse_date(data['date']),
+                                            appointment_slots.parse_slot(data['time_slot']), center_id)
             conn.commit()
-            return jsonify({"message": "Appointment added", "appointment_id": new_id}), 201
+            return jsonify({"message": "Appointment added", "appointment_id": new_id, "center_id": center_id}), 201
+        except SlotError as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), e.status
         except Exception as e:
             conn.rollback()
             abort(500, f"Database error: {str(e)}")
         finally:
             cur.close()
 
+# Free places per slot from the precomputed slot counts - ?from=YYYY-MM-DD&to=&center_id=
+# (defaults: the next two weeks at the default center)
+@app.route('/appointments/availability', methods=['GET'])
+def appointment_availability():
+    with get_read_db() as conn:
+        cur = conn.cursor()
+        try:
+            center_id = appointment_slots.parse_center(cur, request.args.get('center_id'))
+            start, end = appointment_slots.default_range(request.args.get('from'), request.args.get('to'))
+            slots = appointment_slots.availability(cur, center_id, start, end)
+            return jsonify({"center_id": center_id, "from": str(start), "to": str(end), "slots": slots})
+        except SlotError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            abort(500, f"Database error: {str(e)}")
+        finally:
+            cur.close()
+
 # ---------------- TRANSACTIONS ----------------
+def transaction_row(d):
+    return {"transaction_id": d[0], "date": str(d[1]), "units_allocated": d[2], "method": d[3], "request_id": d[4], "donation_id": d[5]}
+
 @app.route('/transactions', methods=['GET'])
 def get_transactions():
-    with get_db() as conn:
+    query = "SELECT transaction_id, date, units_allocated, method, request_id, donation_id FROM transactions;"
+    if wants_stream():
+        return stream_ndjson(query, [], transaction_row)
+    with get_read_db() as conn:
         cur = conn.cursor()
         try:
-            cur.execute("SELECT transaction_id, date, units_allocated, method, request_id, donation_id FROM transactions;")
+            cur.execute(query)
             data = cur.fetchall()
-            transactions = [{"transaction_id": d[0], "date": str(d[1]), "units_allocated": d[2], "method": d[3], "request_id": d[4], "donation_id": d[5]} for d in data]
+            transactions = [transaction_row(d) for d in data]
             return jsonify(transactions)
         except Exception as e:
             abort(500, f"Database error: {str(e)}")
@@ -376,146 +568,441 @@ def add_transaction():
             cur.close()
             
 # New route: GET /inventory (view stock)
+# Served from a short-TTL cache (invalidated by inventory writes); ETag lets pollers get 304s
 @app.route('/inventory', methods=['GET'])
 def get_inventory():
-    with get_db() as conn:
+    try:
+        body, etag = inventory_cache.get_or_load('all', load_inventory)
+    except Exception as e:
+        abort(500, f"Database error: {str(e)}")
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # Browsers revalidate with If-None-Match every time
+    return response.make_conditional(request)
+
+# Cached loaders stay on the primary: a fill from a lagging replica right after an invalidation
+# would serve the old numbers to everyone (the writer included) for a whole TTL
+INVENTORY_SQL = 'SELECT blood_type, units FROM inventory_replica ORDER BY blood_type;'
+
+def inventory_body(rows):
+    # (JSON body, ETag) as cached by both serving modes. reorder_threshold is the one behind
+    # /admin/stats low_stock, so dashboards flag the same types when they apply live updates.
+    reorder = dict(zip(*forecast_job.thresholds()))
+    inventory = [{"blood_type": row[0], "units": row[1], "reorder_threshold": reorder.get(row[0], LOW_STOCK_UNITS)}
+                 for row in rows]
+    body = app.json.dumps(inventory)
+    return body, hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+@contextmanager
+def primary_db(conn=None):
+    # conn when the caller already holds a primary connection, else one from the pool
+    if conn is not None:
+        yield conn
+    else:
+        with get_db() as conn:
+            yield conn
+
+def load_inventory(conn=None):
+    with primary_db(conn) as conn:
         cur = conn.cursor()
         try:
-            cur.execute('SELECT blood_type, units FROM inventory_replica ORDER BY blood_type;')
-            data = cur.fetchall()
-            inventory = [{"blood_type": row[0], "units": row[1]} for row in data]
-            return jsonify(inventory)
-        except Exception as e:
-            abort(500, f"Database error: {str(e)}")
+            cur.execute(INVENTORY_SQL)
+            return inventory_body(cur.fetchall())
         finally:
             cur.close()
 
+# Live feed (Server-Sent Events): request_created / request_fulfilled / request_deleted / inventory_changed
+# ?recipient_id= limits request events to one recipient's requests
+SSE_HEARTBEAT = 15  # Seconds; keeps proxies from closing idle streams
+SSE_BUSY_RETRY = 30000  # Milliseconds before a client turned away at events.MAX_SUBSCRIBERS tries again
+
+@app.route('/events', methods=['GET'])
+def event_stream():
+    recipient_id = request.args.get('recipient_id', type=int)
+    subscription = events.subscribe()
+    if subscription is None:
+        # Full: end the stream at once with a longer retry. EventSource gives up for good on a
+        # non-200 response, but reconnects after `retry` when a 200 stream ends.
+        return Response(f'retry: {SSE_BUSY_RETRY}\n\n', mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'Retry-After': str(SSE_BUSY_RETRY // 1000)})
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    batch = subscription.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                for event in batch:
+                    data = event['data']
+                    if recipient_id and event['type'].startswith('request_') and data.get('recipient_id') != recipient_id:
+                        continue
+                    yield f"event: {event['type']}\ndata: {json.dumps(data, default=str)}\n\n"
+                    if event['type'] == 'resync':
+                        return  # We fell behind; the client reconnects and reloads
+        finally:
+            events.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 #----Admin routes
  # Admin Stats (Overview Cards)
 @app.route('/admin/stats', methods=['GET'])
 @login_required(role='Admin')  # Or manual check
 def admin_stats():
-    with get_db() as conn:
+    try:
+        return jsonify(stats_cache.get_or_load('overview', load_admin_stats))
+    except Exception as e:
+        abort(500, f"Database error: {str(e)}")
+
+# All counters in one round trip (users/requests come from the partitioned views). Low stock
+# is below each type's forecast reorder threshold: params (blood types, thresholds, fallback)
+ADMIN_STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM all_users) AS total_users,
+        (SELECT COUNT(*) FROM all_requests WHERE status = 'Pending') AS pending_requests,
+        (SELECT COUNT(*) FROM donations) AS total_donations,
+        (SELECT COUNT(*) FROM inventory_replica i
+         LEFT JOIN unnest(%s::text[], %s::int[]) AS t(blood_type, threshold) ON t.blood_type = i.blood_type
+         WHERE i.units < COALESCE(t.threshold, %s)) AS low_stock;
+"""
+
+def admin_stats_params():
+    return forecast_job.thresholds() + (LOW_STOCK_UNITS,)
+
+def load_admin_stats(conn=None):
+    with primary_db(conn) as conn:
         cur = conn.cursor()
         try:
-            # Total users (transparent from partitioned view)
-            cur.execute("SELECT COUNT(*) FROM all_users;")
-            total_users = cur.fetchone()[0]
-            
-            # Pending requests
-            cur.execute("SELECT COUNT(*) FROM all_requests WHERE status = 'Pending';")
-            pending_requests = cur.fetchone()[0]
-            
-            # Total donations (assume donations table exists; adjust query)
-            cur.execute("SELECT COUNT(*) FROM donations;")  # Or SUM(quantity) if needed
-            total_donations = cur.fetchone()[0]
-            
-            # Low stock (units < 10)
-            cur.execute("SELECT COUNT(*) FROM inventory_replica WHERE units < 10;")
-            low_stock = cur.fetchone()[0]
-            
-            return jsonify({
+            cur.execute(ADMIN_STATS_SQL, admin_stats_params())
+            total_users, pending_requests, total_donations, low_stock = cur.fetchone()
+            return {
                 "total_users": total_users,
                 "pending_requests": pending_requests,
                 "total_donations": total_donations,
                 "low_stock": low_stock
-            })
-        except Exception as e:
-            abort(500, f"Database error: {str(e)}")
+            }
         finally:
             cur.close()
 
-# All Users (From Fragmented View)
+# Demand/supply forecast per blood type (and region) with current stock, days of supply and the
+# reorder thresholds behind low_stock; recomputed in the background, see forecast.py
+@app.route('/admin/forecast', methods=['GET'])
+@login_required(role='Admin')
+def admin_forecast():
+    snapshot = forecast_job.latest()
+    if snapshot is None:
+        # Never computed on a request; low_stock uses the fixed threshold meanwhile
+        message = ("Forecast disabled (FORECAST_INTERVAL=0)" if FORECAST_INTERVAL <= 0
+                   else "Forecast not computed yet; try again shortly")
+        return jsonify({"error": message, "job": forecast_job.stats()}), 503
+    try:
+        with get_read_db() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(INVENTORY_SQL)
+                stock = dict(cur.fetchall())
+            finally:
+                cur.close()
+    except Exception as e:
+        abort(500, f"Database error: {str(e)}")
+    return jsonify(dict(with_stock(snapshot, stock), job=forecast_job.stats()))
+
+# Keyset pagination helpers for the admin list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Helpers take the query args explicitly when called outside a Flask request (asgi.py)
+def parse_limit(args=None):
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE  # Same as request.args.get(..., type=int)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, MAX_PAGE_SIZE)
+
+def add_filters(query, params, filters, args=None):
+    # filters: {column: query-arg name}; only applied when the arg is present
+    args = request.args if args is None else args
+    for column, arg in filters.items():
+        value = args.get(arg)
+        if value:
+            query += f" AND {column} = %s"
+            params.append(value)
+    return query
+
+def want_total(args=None):
+    args = request.args if args is None else args
+    return args.get('count', '').lower() in ('1', 'true', 'yes')
+
+def parse_regions(args=None):
+    # ?region= narrows an admin view to one partition; otherwise every region is queried
+    args = request.args if args is None else args
+    region = args.get('region')
+    if not region:
+        return REGIONS
+    if region not in REGIONS:
+        raise ValueError(f"region must be one of: {', '.join(REGIONS)}")
+    return [region]
+
+def own_region(user_id, user_session=None):
+    # The session user's region partition when the query is for their own rows, else None
+    user_session = session if user_session is None else user_session
+    region = user_session.get('region')
+    if region in REGIONS and user_id is not None and str(user_id) == str(user_session.get('user_id')):
+        return region
+    return None
+
+def fan_out_reads(regions, page):
+    # Admin views: one connection per region partition, queried in parallel
+    return fan_out(router.read_pool(session.get('write_lsn')), regions, page)
+
+# All Users (From Fragmented View) - ?after=<user_id>&limit=&role=&region=&blood_group=&count=1
+# One query per region partition, run in parallel and merge-sorted on user_id
 @app.route('/admin/users', methods=['GET'])
 @login_required(role='Admin')
 def admin_users():
-    with get_db() as conn:
+    try:
+        return jsonify(users_page(request.args, fan_out_reads))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        abort(500, f"Database error: {str(e)}")
+
+def users_page(args, run_pages):
+    # run_pages(regions, page) calls page(conn, region) per region; ValueError means bad args
+    limit = parse_limit(args)
+    after = args.get('after', type=int)
+    regions = parse_regions(args)
+
+    base_params = []
+    where = add_filters(" WHERE region = %s", base_params, {'role': 'role', 'blood_group': 'blood_group'}, args)
+    count = want_total(args)
+
+    def page(conn, region):
         cur = conn.cursor(cursor_factory=RealDictCursor)  # Named access
         try:
-            cur.execute("SELECT user_id, name, email, role, region, blood_group FROM all_users ORDER BY user_id;")
-            users = cur.fetchall()
-            return jsonify([dict(user) for user in users])  # List of dicts
-        except Exception as e:
-            abort(500, f"Database error: {str(e)}")
+            params = [region] + base_params
+            total = None
+            if count:
+                cur.execute("SELECT COUNT(*) AS total FROM all_users" + where + ";", params)
+                total = cur.fetchone()['total']
+            query = "SELECT user_id, name, email, role, region, blood_group FROM all_users" + where
+            if after is not None:
+                query += " AND user_id > %s"
+                params.append(after)
+            query += " ORDER BY user_id LIMIT %s;"
+            params.append(limit + 1)  # One extra row tells us whether there is a next page
+            cur.execute(query, params)
+            return cur.fetchall(), total
         finally:
             cur.close()
 
-# All Requests (From Fragmented View)
+    pages = run_pages(regions, page)
+    users = merge_sorted([rows for rows, _ in pages], key=lambda u: u['user_id'], limit=limit + 1)
+    has_more = len(users) > limit
+    users = users[:limit]
+    return {
+        "items": [dict(user) for user in users],
+        "next_after": str(users[-1]['user_id']) if has_more else None,
+        "total": sum(total for _, total in pages) if count else None
+    }
+
+def parse_request_cursor(after):
+    # after=<date>,<request_id> as returned in next_after (empty date for requests without one)
+    try:
+        after_date, after_id = after.split(',')
+        return datetime.strptime(after_date, '%Y-%m-%d').date() if after_date else None, int(after_id)
+    except ValueError:
+        raise ValueError("after must look like YYYY-MM-DD,<request_id>")
+
+# All Requests (From Fragmented View) - ?after=<date,id>&limit=&status=&blood_group=&region=&count=1
+# One query per region partition, run in parallel and merge-sorted on (date, request_id) DESC
 @app.route('/admin/requests', methods=['GET'])
 @login_required(role='Admin')
 def admin_requests():
-    with get_db() as conn:
+    try:
+        return jsonify(requests_page(request.args, fan_out_reads))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        abort(500, f"Database error: {str(e)}")
+
+def requests_page(args, run_pages):
+    # Same contract as users_page
+    limit = parse_limit(args)
+    after = args.get('after')
+    cursor = parse_request_cursor(after) if after else None
+    regions = parse_regions(args)
+
+    base_params = []
+    where = add_filters(" WHERE recipient_region = %s", base_params,
+                        {'status': 'status', 'blood_group': 'blood_group'}, args)
+    count = want_total(args)
+
+    def page(conn, region):
         cur = conn.cursor(cursor_factory=RealDictCursor)
         try:
-            cur.execute("""
-                SELECT request_id, date, blood_group, required_units, status, request_type, recipient_id 
-                FROM all_requests ORDER BY date DESC;
-            """)
-            requests = cur.fetchall()
-            return jsonify([dict(req) for req in requests])
-        except Exception as e:
-            abort(500, f"Database error: {str(e)}")
+            params = [region] + base_params
+            total = None
+            if count:
+                cur.execute("SELECT COUNT(*) AS total FROM all_requests" + where + ";", params)
+                total = cur.fetchone()['total']
+            cur.execute(*admin_requests_page_query(where, params, cursor, limit))
+            return cur.fetchall(), total
         finally:
             cur.close()
 
-# Fulfill Request (Concurrency Demo: Lock + Deduct Inventory)
+    return merge_request_pages(run_pages(regions, page), limit, count)
+
+def admin_requests_page_query(where, params, cursor, limit):
+    # (query, params) for one region's page; params are the WHERE clause's. Shared with asgi.py
+    params = list(params)
+    query = """
+        SELECT request_id, date, blood_group, required_units, status, request_type, recipient_id,
+               recipient_region
+        FROM all_requests""" + where
+    if cursor and cursor[0] is None:
+        # Still among the undated requests, which sort first
+        query += " AND (date IS NOT NULL OR request_id < %s)"
+        params.append(cursor[1])
+    elif cursor:
+        query += " AND date IS NOT NULL AND (date, request_id) < (%s, %s)"
+        params.extend(cursor)
+    query += " ORDER BY date DESC, request_id DESC LIMIT %s;"
+    params.append(limit + 1)  # One extra row tells us whether there is a next page
+    return query, params
+
+def merge_request_pages(pages, limit, count):
+    # pages: [(rows, total)] per region, rows as dicts
+    # Same order as the SQL: DESC puts NULL dates first
+    requests = merge_sorted([rows for rows, _ in pages], reverse=True, limit=limit + 1,
+                            key=lambda r: (r['date'] is None, r['date'] or date.min, r['request_id']))
+    has_more = len(requests) > limit
+    requests = requests[:limit]
+    next_after = None
+    if has_more:
+        last = requests[-1]
+        next_after = f"{last['date'].isoformat() if last['date'] else ''},{last['request_id']}"
+    return {
+        "items": [dict(req) for req in requests],
+        "next_after": next_after,
+        "total": sum(total for _, total in pages) if count else None
+    }
+
+# Fulfill Request (Concurrency: row locks on the request + inventory rows only, retried on conflicts)
 @app.route('/admin/fulfill/<int:request_id>', methods=['POST'])
 @login_required(role='Admin')
 def admin_fulfill_request(request_id):
     data = request.json or {}
     allocated_units = data.get('allocated_units', 0)  # From modal
+
+    def work(cur):
+        result = fulfill_request(cur, request_id, allocated_units)
+        invalidate('stats', 'inventory', cur=cur)
+        events.publish([
+            {"type": "request_fulfilled", "data": {"request_id": request_id, "recipient_id": result['recipient_id']}},
+            {"type": "inventory_changed", "data": {"blood_type": result['blood_group'], "units": result['remaining']}}
+        ], cur)
+        return result
+
     with get_db() as conn:
-        cur = conn.cursor()
         try:
-            # Start transaction with locking (concurrency control)
-            cur.execute("BEGIN;")
-            cur.execute("LOCK TABLE inventory_master IN EXCLUSIVE MODE;")
-            cur.execute("LOCK TABLE requests IN EXCLUSIVE MODE;")
-            
-            
-            # Get request details
-            cur.execute("""
-                SELECT blood_group, required_units, recipient_id FROM all_requests 
-                WHERE request_id = %s FOR UPDATE;
-            """, (request_id,))
-            req = cur.fetchone()
-            if not req:
-            # Continuation of your app.py from the incomplete line: "conn" (after "if not req:")
-# This completes the /admin/fulfill/<int:request_id> route and adds the rest of the file, including the new DELETE route for requests.
-
-                conn.rollback()
-                return jsonify({"error": "Request not found"}), 404
-            
-            blood_group, required_units, recipient_id = req
-            units_to_deduct = allocated_units or required_units  # Use provided or full
-            
-            # Check stock
-            cur.execute("SELECT units FROM inventory_master WHERE blood_type = %s FOR UPDATE;", (blood_group,))
-            stock_row = cur.fetchone()
-            if not stock_row or stock_row[0] < units_to_deduct:
-                conn.rollback()
-                return jsonify({"error": "Insufficient stock"}), 400
-            
-            # Deduct stock (replication transparency: Update master)
-            cur.execute("""
-                UPDATE inventory_master SET units = units - %s, last_updated = CURRENT_TIMESTAMP 
-                WHERE blood_type = %s;
-            """, (units_to_deduct, blood_group))
-            
-            # Update request status
-            cur.execute("""
-                UPDATE requests SET status = 'Fulfilled' WHERE request_id = %s;
-            """, (request_id,))
-            
-            conn.commit()
-            print(f"DEBUG: Fulfilled request {request_id}: Deducted {units_to_deduct} from {blood_group}")
-            return jsonify({"message": f"Request {request_id} fulfilled. Deducted {units_to_deduct} units from {blood_group} stock."})
+            result = run_in_transaction(conn, work)
+        except FulfillmentError as e:
+            return jsonify({"error": str(e)}), e.status
         except Exception as e:
-            conn.rollback()
-            print(f"ERROR fulfilling request: {e}")
+            log.error("Fulfillment failed", extra={"request_id": request_id, "error": str(e)})
             return jsonify({"error": f"Database error: {str(e)}"}), 500
-        finally:
-            cur.close()
+    blood_group, units_to_deduct = result['blood_group'], result['units']
+    log.debug("Fulfilled request", extra={"request_id": request_id, "units": units_to_deduct, "blood_group": blood_group})
+    return jsonify({"message": f"Request {request_id} fulfilled. Deducted {units_to_deduct} units from {blood_group} stock."})
+
+# Batch Fulfill: {"request_ids": [...]} or {"blood_group": "O+", "region": "North"} (all pending)
+# Allocates in one transaction, Emergency requests first, then oldest; returns a per-request result
+@app.route('/admin/fulfill/batch', methods=['POST'])
+@login_required(role='Admin')
+def admin_fulfill_batch():
+    data = request.json or {}
+    request_ids = data.get('request_ids')
+    if request_ids is not None:
+        if not isinstance(request_ids, list) or not all(isinstance(i, int) for i in request_ids):
+            return jsonify({"error": "request_ids must be a list of integers"}), 400
+        if len(request_ids) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"At most {MAX_BATCH_SIZE} requests per batch"}), 400
+    elif not data.get('blood_group') and not data.get('region'):
+        return jsonify({"error": "Provide request_ids, or blood_group and/or region"}), 400
+
+
+    def work(cur):
+        results, deducted, remaining, truncated = fulfill_batch(
+            cur, request_ids=request_ids, blood_group=data.get('blood_group'), region=data.get('region'),
+            method=data.get('method', 'Batch Allocation'))
+        if deducted:
+            invalidate('stats', 'inventory', cur=cur)
+            events.publish(
+                [{"type": "request_fulfilled", "data": {"request_id": r['request_id'], "recipient_id": r['recipient_id']}}
+                 for r in results if r['status'] == 'fulfilled'] +
+                [{"type": "inventory_changed", "data": {"blood_type": bt, "units": units}}
+                 for bt, units in remaining.items()], cur)
+        return results, deducted, truncated
+
+    with get_db() as conn:
+        try:
+            results, deducted, truncated = run_in_transaction(conn, work)
+        except Exception as e:
+            log.error("Batch fulfillment failed", extra={"error": str(e)})
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+    fulfilled = sum(1 for r in results if r['status'] == 'fulfilled')
+    return jsonify({
+        "message": f"Fulfilled {fulfilled} of {len(results)} requests.",
+        "fulfilled": fulfilled,
+        "deducted": deducted,
+        "truncated": truncated,  # More requests matched the filters than one batch takes
+        "results": results
+    })
+
+# Compatibility-aware allocation over all pending requests (O- can serve an A+ shortage, etc.)
+# Body: {"dry_run": true (default) | false, "blood_group", "region", "reserve", "details": true}
+@app.route('/admin/allocation/plan', methods=['POST'])
+@login_required(role='Admin')
+def admin_allocation_plan():
+    data = request.json or {}
+    dry_run = data.get('dry_run', True) is not False
+    blood_group = data.get('blood_group')
+    if blood_group and blood_group not in BLOOD_GROUPS:
+        return jsonify({"error": "Invalid blood_group"}), 400
+    reserve = data.get('reserve', UNIVERSAL_RESERVE)
+    if not isinstance(reserve, int) or reserve < 0:
+        return jsonify({"error": "reserve must be a non-negative integer"}), 400
+
+
+    def work(cur):
+        result = allocate(cur, blood_group=blood_group, region=data.get('region'), dry_run=dry_run, reserve=reserve,
+                          method=data.get('method', 'Compatibility Allocation'))
+        if not dry_run and result['fulfilled']:
+            invalidate('stats', 'inventory', cur=cur)
+            events.publish(
+                [{"type": "request_fulfilled", "data": {"request_id": a['request_id'], "recipient_id": a['recipient_id']}}
+                 for a in result['allocations']] +
+                [{"type": "inventory_changed", "data": {"blood_type": bt, "units": units}}
+                 for bt, units in result['stock_after'].items() if units != result['stock_before'][bt]], cur)
+        return result
+
+    with get_db() as conn:
+        try:
+            result = run_in_transaction(conn, work)
+        except Exception as e:
+            log.error("Allocation plan failed", extra={"error": str(e)})
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+    if data.get('details', True) is False:
+        result.pop('allocations')
+    return jsonify(result)
 
 # Update Inventory (Write to Master)
 @app.route('/admin/inventory', methods=['POST'])
@@ -526,27 +1013,224 @@ def admin_update_inventory():
     new_units = data.get('new_units')
     if not blood_type or new_units is None:
         return jsonify({"error": "Missing blood_type or new_units"}), 400
+    if blood_type not in BLOOD_GROUPS:
+        return jsonify({"error": "Invalid blood_type"}), 400
+    try:
+        new_units = int(new_units)
+    except (TypeError, ValueError):
+        return jsonify({"error": "new_units must be an integer"}), 400
+    if new_units < 0:
+        return jsonify({"error": "new_units must not be negative"}), 400
     
     with get_db() as conn:
         cur = conn.cursor()
         try:
-            cur.execute("""
-                UPDATE inventory_master SET units = %s, last_updated = CURRENT_TIMESTAMP 
-                WHERE blood_type = %s;
-            """, (new_units, blood_type))
-            if cur.rowcount == 0:
-                # Insert if not exists
-                cur.execute("""
-                    INSERT INTO inventory_master (blood_type, units) VALUES (%s, %s);
-                """, (blood_type, new_units))
+            # Stock is tracked per unit: adds units collected today, or discards the first-expiring ones
+            set_stock(cur, blood_type, new_units)
+            invalidate('stats', 'inventory', cur=cur)
+            events.publish_event('inventory_changed', {"blood_type": blood_type, "units": new_units}, cur)
             conn.commit()
             return jsonify({"message": f"Updated {blood_type} to {new_units} units."})
+        except UnitError as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        finally:
+            cur.close()
+
+# Appointment capacity per center and slot - Body: {"capacity", "center_id", "time_slots": ["09:00", ...]}
+# (all slots when time_slots is left out)
+@app.route('/admin/appointments/capacity', methods=['PUT'])
+@login_required(role='Admin')
+def admin_appointment_capacity():
+    data = request.json or {}
+    with get_db() as conn:
+        cur = conn.cursor()
+        try:
+            center_id = appointment_slots.parse_center(cur, data.get('center_id'))
+            time_slots = [appointment_slots.parse_slot(slot) for slot in data.get('time_slots') or []]
+            capacity = appointment_slots.set_capacity(cur, center_id, data.get('capacity'), time_slots)
+            conn.commit()
+            return jsonify({"center_id": center_id, "capacity": capacity})
+        except SlotError as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        finally:
+            cur.close()
+
+# Shortage outreach: donors whose blood a blood_group recipient can take, in the region(s), who
+# may donate again; never-donated and longest-rested first. Paged with ?after=<next_after>&limit=
+@app.route('/admin/eligible_donors', methods=['GET'])
+@login_required(role='Admin')
+def admin_eligible_donors():
+    blood_group = request.args.get('blood_group')
+    if blood_group not in BLOOD_GROUPS:
+        return jsonify({"error": f"blood_group must be one of: {', '.join(BLOOD_GROUPS)}"}), 400
+    try:
+        limit = parse_limit()
+        regions = parse_regions()
+        after = request.args.get('after')
+        cursor = donor_eligibility.parse_cursor(after) if after else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with get_read_db() as conn:
+        cur = conn.cursor()
+        try:
+            return jsonify(donor_eligibility.eligible_donors(cur, blood_group, regions, limit, cursor,
+                                                             want_total()))
+        except Exception as e:
+            abort(500, f"Database error: {str(e)}")
+        finally:
+            cur.close()
+
+# Blood units (per bag, allocated first-expiring-first-out); inventory_master holds the counts
+# Body: {"units", "blood_type" | "donation_id", "component", "collected_on"}
+@app.route('/admin/units', methods=['POST'])
+@login_required(role='Admin')
+def admin_receive_units():
+    data = request.json or {}
+    count = data.get('units')
+    if not isinstance(count, int) or count <= 0:
+        return jsonify({"error": "units must be a positive integer"}), 400
+    component = data.get('component', 'Whole Blood')
+    with get_db() as conn:
+        cur = conn.cursor()
+        try:
+            blood_type = data.get('blood_type')
+            collected_on = data.get('collected_on')
+            donation_id = data.get('donation_id')
+            if donation_id is not None:
+                # Units from a recorded donation: donor's blood group, donation date
+                if not isinstance(donation_id, int) or isinstance(donation_id, bool):
+                    return jsonify({"error": "donation_id must be an integer"}), 400
+                cur.execute("""
+                    SELECT u.blood_group, d.date FROM donations d JOIN all_users u ON u.user_id = d.donor_id
+                    WHERE d.donation_id = %s;
+                """, (donation_id,))
+                donation = cur.fetchone()
+                if not donation:
+                    return jsonify({"error": "Donation not found"}), 404
+                if donation[0] is None:
+                    return jsonify({"error": f"The donor of donation {donation_id} has no blood group on record"}), 400
+                if blood_type and blood_type != donation[0]:
+                    return jsonify({"error": f"Donation {donation_id} is {donation[0]}, not {blood_type}"}), 400
+                blood_type = donation[0]
+                collected_on = collected_on or donation[1]
+            if blood_type not in BLOOD_GROUPS:
+                return jsonify({"error": "Invalid or missing blood_type"}), 400
+            unit_ids = receive_units(cur, blood_type, count, component=component, collected_on=collected_on,
+                                     donation_id=donation_id)
+            cur.execute("SELECT units FROM inventory_master WHERE blood_type = %s;", (blood_type,))
+            units = cur.fetchone()[0]
+            invalidate('stats', 'inventory', cur=cur)
+            events.publish_event('inventory_changed', {"blood_type": blood_type, "units": units}, cur)
+            conn.commit()
+            return jsonify({"message": f"Received {count} {component} unit(s) of {blood_type}.",
+                            "unit_ids": unit_ids, "units": units}), 201
+        except UnitError as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             conn.rollback()
             return jsonify({"error": f"Database error: {str(e)}"}), 500
         finally:
             cur.close()
 
+# Units in FEFO order: ?blood_type=&status=Available&expiring_within=<days>&limit=
+@app.route('/admin/units', methods=['GET'])
+@login_required(role='Admin')
+def admin_list_units():
+    status = request.args.get('status', 'Available')
+    if status not in UNIT_STATUSES:
+        return jsonify({"error": f"status must be one of: {', '.join(UNIT_STATUSES)}"}), 400
+    try:
+        limit = parse_limit()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    query = """
+        SELECT unit_id, blood_type, component, collected_on, expires_on, status, donation_id, request_id
+        FROM blood_units WHERE status = %s
+    """
+    params = [status]
+    query = add_filters(query, params, {'blood_type': 'blood_type'})
+    if request.args.get('expiring_within', '').isdigit():
+        query += " AND expires_on <= CURRENT_DATE + %s"
+        params.append(int(request.args['expiring_within']))
+    query += " ORDER BY blood_type, expires_on, unit_id LIMIT %s;"
+    params.append(limit)
+    with get_read_db() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cur.execute(query, params)
+            units = cur.fetchall()
+            for unit in units:
+                unit['collected_on'] = str(unit['collected_on'])
+                unit['expires_on'] = str(unit['expires_on'])
+            return jsonify({"items": units, "shelf_life_days": SHELF_LIFE_DAYS, "expiry_job": expiry_job.stats()})
+        except Exception as e:
+            abort(500, f"Database error: {str(e)}")
+        finally:
+            cur.close()
+
+# Bulk Import (COPY into a staging table, validated in SQL, valid rows merged)
+# Body: CSV with a header row, or NDJSON (Content-Type: application/x-ndjson or ?format=ndjson)
+@app.route('/admin/import/<kind>', methods=['POST'])
+@login_required(role='Admin')
+def admin_bulk_import(kind):
+    fmt = request.args.get('format') or ('ndjson' if request.mimetype == 'application/x-ndjson' else 'csv')
+    dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+    with get_db() as conn:
+        try:
+            result = run_import(conn, kind, request.stream, fmt=fmt, dry_run=dry_run)
+        except BulkImportError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            log.error("Bulk import failed", extra={"kind": kind, "error": str(e)})
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+    if result['imported']:
+        invalidate('stats')
+        if kind == 'inventory':
+            invalidate('inventory')
+            body, _ = inventory_cache.get_or_load('all', load_inventory)
+            events.publish([{"type": "inventory_changed", "data": item} for item in json.loads(body)])
+    return jsonify(result)
+
+# Bulk export for audit reports: /export/<table>?from=YYYY-MM-DD&to=YYYY-MM-DD&format=csv|parquet
+# A CSV that fails after it has started streaming ends in an exports.ERROR_MARKER line
+@app.route('/export/<table>', methods=['GET'])
+@login_required(role='Admin')
+def export_table(table):
+    fmt = request.args.get('format', 'csv')
+    try:
+        date_from = request.args.get('from') or None
+        date_to = request.args.get('to') or None
+        if date_from:
+            date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+        if date_to:
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"error": "from/to must be dates (YYYY-MM-DD)"}), 400
+    filename = '_'.join([table] + [str(d) for d in (date_from, date_to) if d])
+    try:
+        if fmt == 'csv':
+            return Response(stream_csv(router.read_pool(session.get('write_lsn')), table, date_from, date_to), mimetype='text/csv',
+                            headers={"Content-Disposition": f"attachment; filename={filename}.csv"})
+        if fmt == 'parquet':
+            out = write_parquet(router.read_pool(session.get('write_lsn')), table, date_from, date_to)
+            return send_file(out, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                             download_name=f"{filename}.parquet")
+        return jsonify({"error": "format must be csv or parquet"}), 400
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error("Export failed", extra={"table": table, "error": str(e)})
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+
 # Manage Privileges (Grant/Revoke SQL Execution)
 @app.route('/admin/privileges', methods=['POST'])
 @login_required(role='Admin')
@@ -565,7 +1249,7 @@ def admin_privileges():
             cmd = f"{action.upper()} {privilege} ON {table} TO {target_role};"
             cur.execute(cmd)
             conn.commit()
-            print(f"DEBUG: Executed privilege command: {cmd}")  # Log for demo
+            log.info("Executed privilege command", extra={"command": cmd})
             return jsonify({"message": f"Executed: {cmd}"})
         except Exception as e:
             conn.rollback()
@@ -573,6 +1257,58 @@ def admin_privileges():
         finally:
             cur.close()
 
+# Connection Pool Metrics (per worker process)
+@app.route('/admin/db_pool', methods=['GET'])
+@login_required(role='Admin')
+def admin_db_pool():
+    stats = get_pool().stats()
+    if router.enabled:
+        stats['routing'] = router.stats()
+    return jsonify(stats)
+
+# Slow-query report (per worker process): statements over SLOW_QUERY_MS grouped by normalized text,
+# costliest first, with a sampled EXPLAIN (ANALYZE, BUFFERS) plan; ?limit=N; DELETE clears it
+@app.route('/admin/slow_queries', methods=['GET', 'DELETE'])
+@login_required(role='Admin')
+def admin_slow_queries():
+    if request.method == 'DELETE':
+        slow_log.clear()
+        return jsonify({"message": "Slow-query log cleared"})
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    return jsonify(slow_log.report(limit))
+
+# Prometheus scrape endpoint (per worker process): request histograms plus pool and cache counters
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    pool = get_pool().stats()
+    cache_stats = {name: c.stats() for name, c in caches.items()}
+    extra = (
+        metrics.samples('bloodbank_db_pool_connections', 'Pooled connections by state', 'gauge',
+                        [({"state": "idle"}, pool['idle']), ({"state": "in_use"}, pool['in_use'])]) +
+        metrics.samples('bloodbank_db_pool_waits_total', 'Checkouts that had to wait', 'counter',
+                        [({}, pool['waits'])]) +
+        metrics.samples('bloodbank_db_pool_wait_seconds_total', 'Time spent waiting for a connection', 'counter',
+                        [({}, pool['wait_time'])]) +
+        metrics.samples('bloodbank_db_pool_timeouts_total', 'Checkouts that timed out', 'counter',
+                        [({}, pool['timeouts'])]) +
+        metrics.samples('bloodbank_cache_hits_total', 'In-process cache hits', 'counter',
+                        [({"cache": name}, s['hits']) for name, s in cache_stats.items()]) +
+        metrics.samples('bloodbank_cache_misses_total', 'In-process cache misses', 'counter',
+                        [({"cache": name}, s['misses']) for name, s in cache_stats.items()])
+    )
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+# In-process Cache Metrics (per worker process)
+@app.route('/admin/cache', methods=['GET'])
+@login_required(role='Admin')
+def admin_cache():
+    return jsonify({
+        "caches": {name: c.stats() for name, c in caches.items()},
+        "invalidation_bus": bus.stats()
+    })
+
 # Delete User
 @app.route('/admin/users/<int:user_id>', methods=['DELETE'])
 @login_required(role='Admin')
@@ -583,6 +1319,7 @@ def admin_delete_user(user_id):
             cur.execute("DELETE FROM users WHERE user_id = %s;", (user_id,))
             if cur.rowcount == 0:
                 return jsonify({"error": "User not found"}), 404
+            invalidate('stats', cur=cur)
             conn.commit()
             return jsonify({"message": f"User {user_id} deleted."})
         except Exception as e:
@@ -625,9 +1362,13 @@ def admin_delete_request(request_id):
     with get_db() as conn:
         cur = conn.cursor()
         try:
-            cur.execute("DELETE FROM requests WHERE request_id = %s;", (request_id,))
-            if cur.rowcount == 0:
+            cur.execute("DELETE FROM requests WHERE request_id = %s RETURNING recipient_id, status;", (request_id,))
+            deleted = cur.fetchone()
+            if not deleted:
                 return jsonify({"error": "Request not found"}), 404
+            invalidate('stats', cur=cur)
+            events.publish_event('request_deleted', {"request_id": request_id, "recipient_id": deleted[0], "status": deleted[1]},
+                                 cur)
             conn.commit()
             return jsonify({"message": f"Request {request_id} deleted."})
         except Exception as e:
@@ -672,12 +1413,22 @@ def login():
                             'password': user[6], 'region': user[7]
                         }
                     
-                    if bcrypt.checkpw(password.encode('utf-8'), user_dict['password'].encode('utf-8')):
+                    if passwords.check_password(password, user_dict['password']):
+                        if passwords.needs_rehash(user_dict['password']):
+                            # Stored hash uses an old cost factor; upgrade it while we have the plaintext
+                            try:
+                                cur.execute("UPDATE users SET password = %s WHERE user_id = %s;",
+                                            (passwords.hash_password(password), user_dict['user_id']))
+                                conn.commit()
+                            except Exception as e:
+                                conn.rollback()  # Not fatal: the old hash still works
+                                log.warning("Password rehash failed",
+                                            extra={"user_id": user_dict['user_id'], "error": str(e)})
                         session['user_id'] = user_dict['user_id']
                         session['name'] = user_dict['name']
                         session['role'] = user_dict['role']
                         session['region'] = user_dict['region'] or 'North'  # Default if NULL
-                        print(f"DEBUG: Login successful for {email}, region: {session['region']}")  # Optional log
+                        log.debug("Login successful", extra={"user_id": user_dict['user_id'], "region": session['region']})
                         return jsonify({
                             "message": "Login successful", 
                             "role": user_dict['role'],
@@ -688,7 +1439,7 @@ def login():
                 else:
                     return jsonify({"error": "Invalid credentials"}), 401
             except Exception as e:
-                print(f"Login DB Error: {e}")  # Log for debug
+                log.error("Login query failed", extra={"error": str(e)})
                 return jsonify({"error": "Server error. Please try again."}), 500
             finally:
                 cur.close()
@@ -708,7 +1459,7 @@ def register():
     # Default region if not provided (for demo)
     data['region'] = data.get('region', 'North')
     
-    hashed_pw = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_pw = passwords.hash_password(data['password'])  # Runs on the hashing executor, not this thread
     with get_db() as conn:
         cur = conn.cursor()
         try:
@@ -718,6 +1469,7 @@ def register():
             """, (data['name'], data['contact_no'], data['blood_group'], data['role'], 
                   data['email'], hashed_pw, data['region']))
             user_id = cur.fetchone()[0]
+            invalidate('stats', cur=cur)
             conn.commit()
             return jsonify({"message": "User registered", "user_id": user_id, "region": data['region']}), 201
         except Exception as e:
@@ -729,6 +1481,60 @@ def register_page():
     return render_template('register.html')
 
 
+# ---------------- DASHBOARD BOOTSTRAP ----------------
+# Everything a dashboard shows on first load in one response and from one pooled connection
+# (instead of a request, and a connection per region, for each panel). The per-region pages run
+# back to back on that connection: each is a LIMITed index scan, cheaper than a thread hop.
+def on_connection(conn):
+    # run_pages for users_page/requests_page
+    return lambda regions, page: [page(conn, region) for region in regions]
+
+def cache_fill_conn(conn):
+    # Cache fills stay on the primary (see load_inventory): reuse conn only when it is the primary
+    return None if router.enabled else conn
+
+def cached_inventory(conn=None):
+    body, _ = inventory_cache.get_or_load('all', lambda: load_inventory(conn))
+    return json.loads(body)
+
+# ?limit=&count=1 apply to both lists, like /admin/users and /admin/requests
+@app.route('/admin/bootstrap', methods=['GET'])
+@login_required(role='Admin')
+def admin_bootstrap():
+    with get_read_db() as conn:
+        try:
+            fill_conn = cache_fill_conn(conn)
+            payload = {
+                "stats": stats_cache.get_or_load('overview', lambda: load_admin_stats(fill_conn)),
+                "users": users_page(request.args, on_connection(conn)),
+                "requests": requests_page(request.args, on_connection(conn)),
+                "inventory": cached_inventory(fill_conn),
+            }
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            abort(500, f"Database error: {str(e)}")
+    return jsonify(payload)
+
+# ?recipient_id= (defaults to the session user)
+@app.route('/recipient/bootstrap', methods=['GET'])
+def recipient_bootstrap():
+    recipient_id = request.args.get('recipient_id') or session.get('user_id')
+    query, params = requests_query(recipient_id, own_region(recipient_id))
+    with get_read_db() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(query, params)
+            payload = {
+                "requests": [request_row(row) for row in cur.fetchall()],
+                "inventory": cached_inventory(cache_fill_conn(conn)),
+            }
+        except Exception as e:
+            abort(500, f"Database error: {str(e)}")
+        finally:
+            cur.close()
+    return jsonify(payload)
+
 @app.route('/dashboard')
 def dashboard():
     session['user_id'] = 1
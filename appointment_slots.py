@@ -0,0 +1,190 @@
+"""Donation appointment slots: per-center capacity and a precomputed bookings-per-slot count.
+
+Every (center, day, time slot) that has bookings has a row in appointment_slot_counts, so
+availability is a primary-key range scan over a few hundred rows rather than a count over
+appointments. Booking bumps that row with a conditional upsert (only while booked < capacity):
+the row lock serializes concurrent bookings of the same slot. A per-donor advisory lock
+serializes one donor's bookings, which may be for different centers' slots.
+Capacities come from appointment_capacity (per center and slot), else APPOINTMENT_SLOT_CAPACITY.
+Centers are hospitals (org_id); appointments without one belong to APPOINTMENT_DEFAULT_CENTER.
+
+Set up once (creates the tables and counts the existing appointments). That is migration 0004
+(which holds the schema), so this applies the pending migrations, like `python migrate.py up`:
+    python appointment_slots.py init
+Recount after appointments were written around book() (e.g. a bulk load):
+    python appointment_slots.py rebuild
+"""
+import argparse
+import os
+import sys
+import zlib
+from datetime import date, datetime, timedelta
+
+import migrate
+from db_config import get_db_connection
+
+# Bookable start times, the same every day
+SLOTS = [datetime.strptime(slot.strip(), '%H:%M').time()
+         for slot in os.environ.get('APPOINTMENT_SLOTS', '09:00,10:00,11:00,12:00,13:00,14:00,15:00,16:00').split(',')]
+DEFAULT_CAPACITY = int(os.environ.get('APPOINTMENT_SLOT_CAPACITY', '6'))  # Donors per slot and center
+DEFAULT_CENTER = int(os.environ.get('APPOINTMENT_DEFAULT_CENTER', '1'))
+MAX_AVAILABILITY_DAYS = 62
+DEFAULT_AVAILABILITY_DAYS = 14
+# pg_advisory_xact_lock(class, donor) key class for a donor's bookings (int4, like the donor id)
+DONOR_LOCK_CLASS = zlib.crc32(b'appointments_donor') & 0x7fffffff
+
+# Takes a place in the slot if there is one left. The ON CONFLICT branch re-checks the capacity
+# against the locked, latest row version, so concurrent bookings can't both take the last place.
+BOOK_SLOT_SQL = """
+    INSERT INTO appointment_slot_counts AS s (center_id, date, time_slot, booked)
+    SELECT %(center_id)s, %(date)s, %(time_slot)s, 1
+    WHERE COALESCE((SELECT capacity FROM appointment_capacity
+                    WHERE center_id = %(center_id)s AND time_slot = %(time_slot)s), %(default)s) > 0
+    ON CONFLICT (center_id, date, time_slot) DO UPDATE SET booked = s.booked + 1
+    WHERE s.booked < COALESCE((SELECT capacity FROM appointment_capacity c
+                               WHERE c.center_id = s.center_id AND c.time_slot = s.time_slot), %(default)s)
+    RETURNING booked;
+"""
+AVAILABILITY_SQL = """
+    SELECT d::date, t.time_slot, COALESCE(c.capacity, %(default)s), COALESCE(s.booked, 0)
+    FROM generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS d
+    CROSS JOIN unnest(%(slots)s::time[]) AS t(time_slot)
+    LEFT JOIN appointment_capacity c ON c.center_id = %(center_id)s AND c.time_slot = t.time_slot
+    LEFT JOIN (
+        SELECT date, time_slot, booked FROM appointment_slot_counts
+        WHERE center_id = %(center_id)s AND date BETWEEN %(start)s AND %(end)s
+    ) s ON s.date = d::date AND s.time_slot = t.time_slot
+    ORDER BY 1, 2;
+"""
+
+
+class SlotError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def rebuild_counts(cur):
+    # Recounts every slot from appointments; returns the number of slots with bookings
+    cur.execute("LOCK TABLE appointment_slot_counts IN EXCLUSIVE MODE;")  # Bookings wait; reads don't
+    cur.execute("DELETE FROM appointment_slot_counts;")
+    cur.execute("""
+        INSERT INTO appointment_slot_counts (center_id, date, time_slot, booked)
+        SELECT COALESCE(center_id, %s), date, time_slot, COUNT(*) FROM appointments
+        WHERE status <> 'Cancelled'
+        GROUP BY 1, 2, 3;
+    """, (DEFAULT_CENTER,))
+    return cur.rowcount
+
+
+def parse_date(value, field='date'):
+    try:
+        return value if isinstance(value, date) else date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise SlotError(f"{field} must be a date (YYYY-MM-DD)")
+
+
+def parse_slot(value):
+    try:
+        slot = datetime.strptime(value, '%H:%M:%S' if value.count(':') == 2 else '%H:%M').time()
+    except (AttributeError, TypeError, ValueError):
+        slot = None
+    if slot not in SLOTS:
+        raise SlotError(f"time_slot must be one of: {', '.join(s.strftime('%H:%M') for s in SLOTS)}")
+    return slot
+
+
+def parse_center(cur, value):
+    # The default center, or a hospital's org_id
+    if value in (None, ''):
+        return DEFAULT_CENTER
+    try:
+        center_id = int(value)
+    except (TypeError, ValueError):
+        raise SlotError("center_id must be an integer")
+    if center_id != DEFAULT_CENTER:
+        cur.execute("SELECT 1 FROM hospitals WHERE org_id = %s;", (center_id,))
+        if cur.fetchone() is None:
+            raise SlotError("Unknown center", 404)
+    return center_id
+
+
+def book(cur, user_id, day, time_slot, center_id=DEFAULT_CENTER):
+    # Books a place for user_id; the caller commits. Raises SlotError (409) when the slot is full
+    # or the donor already has an appointment at that time.
+    if day < date.today():
+        raise SlotError("date must not be in the past")
+    # Before the slot row, always: a double submit for two centers' slots locks different rows
+    cur.execute("SELECT pg_advisory_xact_lock(%s, %s);", (DONOR_LOCK_CLASS, user_id))
+    cur.execute(BOOK_SLOT_SQL, {"center_id": center_id, "date": day, "time_slot": time_slot,
+                                "default": DEFAULT_CAPACITY})
+    if cur.fetchone() is None:
+        raise SlotError("No places left in that slot", 409)
+    # Under the donor lock, so concurrent bookings can't both pass this check
+    cur.execute("""
+        SELECT 1 FROM appointments
+        WHERE user_id = %s AND date = %s AND time_slot = %s AND status <> 'Cancelled' LIMIT 1;
+    """, (user_id, day, time_slot))
+    if cur.fetchone() is not None:
+        raise SlotError("You already have an appointment at that time", 409)
+    cur.execute("""
+        INSERT INTO appointments (date, time_slot, status, user_id, center_id)
+        VALUES (%s, %s, 'Pending', %s, %s) RETURNING appointment_id;
+    """, (day, time_slot, user_id, center_id))
+    return cur.fetchone()[0]
+
+
+def availability(cur, center_id, start, end):
+    # Every slot from start to end (inclusive) with its capacity, bookings and places left
+    if end < start:
+        raise SlotError("to must not be before from")
+    if (end - start).days >= MAX_AVAILABILITY_DAYS:
+        raise SlotError(f"At most {MAX_AVAILABILITY_DAYS} days at a time")
+    cur.execute(AVAILABILITY_SQL, {"center_id": center_id, "start": start, "end": end, "slots": SLOTS,
+                                   "default": DEFAULT_CAPACITY})
+    return [{"date": str(day), "time_slot": str(slot), "capacity": capacity, "booked": booked,
+             "available": max(capacity - booked, 0)}
+            for day, slot, capacity, booked in cur.fetchall()]
+
+
+def default_range(start=None, end=None):
+    start = parse_date(start, 'from') if start else date.today()
+    end = parse_date(end, 'to') if end else start + timedelta(days=DEFAULT_AVAILABILITY_DAYS - 1)
+    return start, end
+
+
+def set_capacity(cur, center_id, capacity, time_slots=None):
+    # Per-center capacity for the given slots (default: all of them); applies to existing bookings'
+    # slots too, without cancelling anything already over the new limit
+    if not isinstance(capacity, int) or isinstance(capacity, bool) or capacity < 0:
+        raise SlotError("capacity must be a non-negative integer")
+    time_slots = time_slots or SLOTS
+    cur.execute("""
+        INSERT INTO appointment_capacity (center_id, time_slot, capacity)
+        SELECT %s, time_slot, %s FROM unnest(%s::time[]) AS time_slot
+        ON CONFLICT (center_id, time_slot) DO UPDATE SET capacity = EXCLUDED.capacity;
+    """, (center_id, capacity, list(time_slots)))
+    return {str(slot): capacity for slot in time_slots}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['init', 'rebuild'])
+    args = parser.parse_args()
+    conn = get_db_connection()
+    try:
+        if args.command == 'init':
+            applied = migrate.upgrade(conn)
+            print("appointment slots ready" + (f" (applied {', '.join(applied)})" if applied else ""))
+        else:
+            cur = conn.cursor()
+            print(f"Recounted {rebuild_counts(cur)} booked slots")
+            conn.commit()
+    except migrate.MigrationError as e:
+        sys.exit(f"Migration failed: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Async deployment mode: the hot routes on an asyncio event loop, everything else via Flask.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+GET /inventory, GET/POST /requests, GET /admin/requests, GET /admin/stats and
+POST /admin/fulfill/<id> run natively on asyncpg pools (aio.py), with the same SQL, caches,
+session cookie, events and /metrics accounting as the Flask routes. Every other route is the
+unchanged Flask app behind a WSGI adapter (its blocking calls run on the adapter's threads),
+so sync mode (`gunicorn app:app`) and async mode serve the same API and the same
+benchmark runs against both (benchmarks/load_test.py --url).
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+
+import aio
+import cache_bus
+import events
+import metrics
+from app import (ADMIN_STATS_SQL, DEMO_SESSION, INSERT_REQUEST_SQL, INVENTORY_SQL, STREAM_ITERSIZE,
+                 add_filters, admin_requests_page_query, admin_stats_params, inventory_body, inventory_cache,
+                 merge_request_pages, own_region, parse_limit, parse_regions, parse_request_cursor, request_row,
+                 requests_query, stats_cache, want_total)
+from app import app as flask_app
+from blood_units import expiry_job
+from cache import invalidate_local
+from cache_bus import bus
+from db_router import router
+from forecast import forecast_job
+from fulfillment import FulfillmentError
+from logs import get_logger
+from regions import DEFAULT_REGION, REGIONS
+
+log = get_logger('asgi')
+WSGI_THREADS = 10  # Adapter threads for the Flask routes, on top of those for /events
+
+
+# Flask's signed session cookie, so a session moves freely between native and Flask routes
+def load_session(request):
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if cookie:
+        try:
+            return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+        except Exception:
+            pass  # Bad signature or expired: start over, as Flask does
+    return {}
+
+
+def save_session(response, user_session):
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    config = flask_app.config
+    response.set_cookie(config['SESSION_COOKIE_NAME'], serializer.dumps(dict(user_session)),
+                        path=config['SESSION_COOKIE_PATH'] or config['APPLICATION_ROOT'],
+                        domain=config['SESSION_COOKIE_DOMAIN'], secure=config['SESSION_COOKIE_SECURE'],
+                        httponly=config['SESSION_COOKIE_HTTPONLY'],
+                        samesite=config['SESSION_COOKIE_SAMESITE'] or 'lax')
+
+
+def json_response(obj, status=200):
+    return Response(flask_app.json.dumps(obj), status_code=status, media_type='application/json')
+
+
+def error(message, status):
+    return json_response({"error": message}, status)
+
+
+def endpoint(route):
+    # Per-route wrapper doing what the Flask before/after_request hooks do: metrics (finished once
+    # the last byte is sent), the demo login, the session cookie and flask-cors' header
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            stats = metrics.start_request(request.method, route)
+            loaded = load_session(request)
+            user_session = dict(loaded, **DEMO_SESSION)
+            try:
+                response = await handler(request, user_session)
+            except Exception as e:
+                log.error("Unhandled error", extra={"route": route, "error": str(e)})
+                response = error(f"Internal error: {str(e)}", 500)
+            if user_session != loaded:
+                save_session(response, user_session)
+            if 'origin' in request.headers:
+                response.headers['Access-Control-Allow-Origin'] = '*'
+            response.background = BackgroundTask(finish_request, stats, response.status_code)
+            return response
+        return wrapper
+    return decorator
+
+
+def finish_request(stats, status):
+    duration = stats.finish(status)
+    metrics.end_request()
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Request served", extra={
+            "method": stats.method, "route": stats.route, "status": status,
+            "duration_ms": round(duration * 1000, 3), "db_ms": round(stats.db_time * 1000, 3),
+            "queries": stats.queries, "rows": stats.rows, "lock_wait_ms": round(stats.lock_wait * 1000, 3)})
+
+
+def wants_stream(request):
+    if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    accept = request.headers.get('accept', '')
+    return 'application/x-ndjson' in accept and 'application/json' not in accept
+
+
+async def stream_ndjson(query, params, to_dict, min_lsn):
+    rows = aio.stream_rows(query, params, STREAM_ITERSIZE, min_lsn)
+    try:
+        await rows.__anext__()  # Run the query now so errors still produce a proper 500
+    except Exception as e:
+        await rows.aclose()
+        return error(f"Database error: {str(e)}", 500)
+
+    async def generate():
+        try:
+            async for batch in rows:
+                yield ''.join(flask_app.json.dumps(to_dict(row)) + '\n' for row in batch)
+        finally:
+            await rows.aclose()
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+async def notify_write(conn, *cache_names, events_list=()):
+    # invalidate()/events.publish() with cur, for asyncpg: await it inside the write's transaction,
+    # so other workers (and this one's listener) are told on commit and never on rollback
+    invalidate_local(*cache_names)
+    if not bus.running:
+        events.publish(list(events_list))  # Local delivery only, no connection involved
+        return
+    notifications = [(cache_bus.CHANNEL, bus.payload(cache_names))] if cache_names else []
+    notifications += [(events.CHANNEL, payload) for payload in events.payloads(list(events_list))]
+    for channel, payload in notifications:
+        await aio.execute(conn, "SELECT pg_notify(%s, %s);", channel, payload)
+        bus.published += 1
+
+
+async def after_write(user_session, conn):
+    # After the commit: the primary's position, for read-your-writes
+    if router.enabled:
+        user_session['write_lsn'] = await aio.current_lsn(conn)
+
+
+@endpoint('/inventory')
+async def get_inventory(request, user_session):
+    async def load():
+        async with aio.connection() as conn:
+            return inventory_body(await aio.fetch(conn, INVENTORY_SQL))
+
+    try:
+        body, etag = await inventory_cache.get_or_load_async('all', load)
+    except Exception as e:
+        return error(f"Database error: {str(e)}", 500)
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+@endpoint('/requests')
+async def get_requests(request, user_session):
+    recipient_id = request.query_params.get('recipient_id')
+    if recipient_id:
+        try:
+            recipient_id = int(recipient_id)  # asyncpg binds typed values, psycopg2 sent text
+        except ValueError:
+            return error("recipient_id must be an integer", 400)
+    query, params = requests_query(recipient_id, own_region(recipient_id, user_session))
+    min_lsn = user_session.get('write_lsn')
+    if wants_stream(request):
+        return await stream_ndjson(query, params, request_row, min_lsn)
+    try:
+        async with aio.read_connection(min_lsn) as conn:
+            rows = await aio.fetch(conn, query, *params)
+    except Exception as e:
+        log.error("Listing requests failed", extra={"error": str(e)})
+        return error(f"Database error: {str(e)}", 500)
+    return json_response([request_row(row) for row in rows])
+
+
+@endpoint('/requests')
+async def add_request(request, user_session):
+    data = await request.json()
+    required_fields = ['date', 'required_units', 'request_type', 'blood_group']
+    data['recipient_region'] = user_session.get('region')
+    if data['recipient_region'] not in REGIONS:
+        data['recipient_region'] = DEFAULT_REGION
+    if not all(k in data for k in required_fields):
+        return error("Missing required fields: date, required_units, request_type, blood_group", 400)
+    try:
+        required_units = int(data['required_units'])
+    except (TypeError, ValueError):
+        return error("required_units must be an integer", 400)
+
+    try:
+        async with aio.connection() as conn:
+            async with conn.transaction():
+                request_id = await conn.fetchval(aio.pg(INSERT_REQUEST_SQL), data['date'], required_units,
+                                                 user_session['user_id'], data['recipient_region'],
+                                                 data['request_type'], data['blood_group'])
+                await notify_write(conn, 'stats', events_list=[{"type": "request_created", "data": {
+                    'request_id': request_id, 'date': data['date'], 'required_units': data['required_units'],
+                    'status': 'Pending', 'recipient_id': user_session['user_id'],
+                    'request_type': data['request_type'], 'blood_group': data['blood_group'],
+                    'recipient_region': data['recipient_region']
+                }}])
+            await after_write(user_session, conn)
+    except Exception as e:
+        log.error("Creating request failed", extra={"error": str(e)})
+        return error(f"Database error: {str(e)}", 500)
+    return json_response({"message": "Request added successfully", "request_id": request_id}, 201)
+
+
+@endpoint('/admin/stats')
+async def admin_stats(request, user_session):
+    async def load():
+        async with aio.connection() as conn:
+            total_users, pending_requests, total_donations, low_stock = await aio.fetchrow(conn, ADMIN_STATS_SQL,
+                                                                                          *admin_stats_params())
+        return {
+            "total_users": total_users,
+            "pending_requests": pending_requests,
+            "total_donations": total_donations,
+            "low_stock": low_stock
+        }
+
+    try:
+        return json_response(await stats_cache.get_or_load_async('overview', load))
+    except Exception as e:
+        return error(f"Database error: {str(e)}", 500)
+
+
+@endpoint('/admin/requests')
+async def admin_requests(request, user_session):
+    args = request.query_params
+    try:
+        limit = parse_limit(args)
+        after = args.get('after')
+        cursor = parse_request_cursor(after) if after else None
+        regions = parse_regions(args)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    base_params = []
+    where = add_filters(" WHERE recipient_region = %s", base_params,
+                        {'status': 'status', 'blood_group': 'blood_group'}, args)
+    count = want_total(args)
+    min_lsn = user_session.get('write_lsn')
+
+    async def page(region):
+        # One connection per region, queried concurrently, like regions.fan_out
+        async with aio.read_connection(min_lsn) as conn:
+            params = [region] + base_params
+            total = None
+            if count:
+                total = (await aio.fetchrow(conn, "SELECT COUNT(*) AS total FROM all_requests" + where + ";",
+                                            *params))['total']
+            query, params = admin_requests_page_query(where, params, cursor, limit)
+            return await aio.fetch(conn, query, *params), total
+
+    try:
+        pages = await asyncio.gather(*(page(region) for region in regions))
+    except Exception as e:
+        return error(f"Database error: {str(e)}", 500)
+    return json_response(merge_request_pages(pages, limit, count))
+
+
+@endpoint('/admin/fulfill/<int:request_id>')
+async def admin_fulfill_request(request, user_session):
+    request_id = request.path_params['request_id']
+    data = await request.json() if await request.body() else {}
+    allocated_units = (data or {}).get('allocated_units', 0)
+
+    async def work(conn):
+        result = await aio.fulfill_request(conn, request_id, allocated_units)
+        await notify_write(conn, 'stats', 'inventory', events_list=[
+            {"type": "request_fulfilled", "data": {"request_id": request_id, "recipient_id": result['recipient_id']}},
+            {"type": "inventory_changed", "data": {"blood_type": result['blood_group'], "units": result['remaining']}}
+        ])
+        return result
+
+    try:
+        async with aio.connection() as conn:
+            result = await aio.run_in_transaction(conn, work)
+            blood_group, units_to_deduct = result['blood_group'], result['units']
+            await after_write(user_session, conn)
+    except FulfillmentError as e:
+        return error(str(e), e.status)
+    except Exception as e:
+        log.error("Fulfillment failed", extra={"request_id": request_id, "error": str(e)})
+        return error(f"Database error: {str(e)}", 500)
+    return json_response({"message": f"Request {request_id} fulfilled. Deducted {units_to_deduct} units from {blood_group} stock."})
+
+
+@asynccontextmanager
+async def lifespan(_):
+    await aio.open_pools()
+    # Same per-worker background threads the Flask app starts on its first request
+    bus.start()
+    expiry_job.start()
+    forecast_job.start()
+    router.start()
+    try:
+        yield
+    finally:
+        await aio.close_pools()
+
+
+app = Starlette(routes=[
+    Route('/inventory', get_inventory, methods=['GET']),
+    Route('/requests', get_requests, methods=['GET']),
+    Route('/requests', add_request, methods=['POST']),
+    Route('/admin/stats', admin_stats, methods=['GET']),
+    Route('/admin/requests', admin_requests, methods=['GET']),
+    Route('/admin/fulfill/{request_id:int}', admin_fulfill_request, methods=['POST']),
+    # Everything else, unchanged. Open /events streams each hold one of the adapter's threads.
+    Mount('/', WSGIMiddleware(flask_app, workers=events.MAX_SUBSCRIBERS + WSGI_THREADS)),
+], lifespan=lifespan)
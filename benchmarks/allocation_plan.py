@@ -0,0 +1,126 @@
+"""Compatibility-aware allocation on a synthetic backlog: exact-type matching vs allocation.plan().
+
+Generates N pending requests (blood groups in roughly population frequencies, 10% Emergency) and a
+stock that covers only part of the demand, with a skewed mix so substitutes matter. Reports planning
+time, requests/units served and O- consumed. With --db the same backlog is also seeded into a scratch
+schema (bench_allocation) of the database configured via the DB_* env vars, and allocate() is timed
+as a dry run and for real:
+    python benchmarks/allocation_plan.py --requests 100000 --supply 0.7 --db
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+from psycopg2.extras import execute_values
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrate  # noqa: E402
+from allocation import BLOOD_GROUPS, UNIVERSAL_RESERVE, allocate, plan  # noqa: E402
+from blood_units import MAX_UNITS_PER_CALL, receive_units  # noqa: E402
+from db_config import get_db_connection  # noqa: E402
+from fulfillment import run_in_transaction  # noqa: E402
+
+SCHEMA = 'bench_allocation'
+FREQUENCIES = {'O+': 38, 'A+': 34, 'B+': 9, 'O-': 7, 'A-': 6, 'AB+': 3, 'B-': 2, 'AB-': 1}
+# Share of each type's demand that is in stock: scarce Rh- and B types, plenty of O and A+
+STOCK_SKEW = {'O+': 1.3, 'A+': 1.1, 'B+': 0.5, 'O-': 1.6, 'A-': 0.6, 'AB+': 0.4, 'B-': 0.3, 'AB-': 0.3}
+
+
+def backlog(num_requests, supply, seed):
+    rng = random.Random(seed)
+    groups = rng.choices(list(FREQUENCIES), weights=list(FREQUENCIES.values()), k=num_requests)
+    start = datetime.date(2025, 1, 1)
+    requests = [(i + 1, start + datetime.timedelta(days=rng.randrange(365)), rng.randint(1, 4),
+                 'Emergency' if rng.random() < 0.1 else 'Routine', group, i + 1)
+                for i, group in enumerate(groups)]
+    demand = {bt: 0 for bt in BLOOD_GROUPS}
+    for row in requests:
+        demand[row[4]] += row[2]
+    stock = {bt: int(demand[bt] * supply * STOCK_SKEW[bt]) for bt in BLOOD_GROUPS}
+    return requests, stock
+
+
+def exact_only(requests, stock):
+    # What fulfill_batch does: priority order, each request served from its own blood group only
+    stock = dict(stock)
+    served = []
+    for request_id, _, units, _, group, _ in sorted(
+            requests, key=lambda row: (row[3] != 'Emergency', row[1], row[0])):
+        if stock.get(group, 0) >= units:
+            stock[group] -= units
+            served.append((request_id, {group: units}))
+    return served, stock
+
+
+def summarize(name, requests, stock, allocations, remaining, elapsed):
+    units = {row[0]: row[2] for row in requests}
+    emergency = {row[0] for row in requests if row[3] == 'Emergency'}
+    served_units = sum(units[request_id] for request_id, _ in allocations)
+    print(f"{name:<14} {elapsed * 1000:8.1f} ms  requests {len(allocations):>7}/{len(requests)}  "
+          f"emergency {sum(1 for r, _ in allocations if r in emergency):>6}/{len(emergency)}  "
+          f"units {served_units:>7}/{sum(units.values())}  "
+          f"O- used {stock['O-'] - remaining.get('O-', 0):>6}/{stock['O-']}")
+
+
+def seed_db(requests, stock):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA};")
+    conn.commit()
+    migrate.upgrade(conn)  # The app's schema, built in the scratch schema by the real migrations
+    execute_values(cur, """
+        INSERT INTO requests (request_id, date, required_units, status, recipient_id, recipient_region,
+                              request_type, blood_group) VALUES %s;
+    """, [(r[0], r[1], r[2], r[5], r[3], r[4]) for r in requests],
+        template="(%s, %s, %s, 'Pending', %s, 'North', %s, %s)", page_size=5000)
+    for blood_type, units in stock.items():
+        for received in range(0, units, MAX_UNITS_PER_CALL):
+            receive_units(cur, blood_type, min(MAX_UNITS_PER_CALL, units - received))
+    conn.commit()
+    cur.close()
+    return conn
+
+
+def run_db(requests, stock, reserve):
+    conn = seed_db(requests, stock)
+    try:
+        for dry_run in (True, False):
+            started = time.perf_counter()
+            result = run_in_transaction(conn, lambda cur: allocate(cur, dry_run=dry_run, reserve=reserve))
+            elapsed = time.perf_counter() - started
+            print(f"allocate(dry_run={dry_run!s:<5}) {elapsed * 1000:8.1f} ms  fulfilled {result['fulfilled']}  "
+                  f"units {result['units_allocated']}  substituted {result['substituted_units']}")
+    finally:
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--supply', type=float, default=0.7, help="Stock as a fraction of total demand")
+    parser.add_argument('--reserve', type=int, default=UNIVERSAL_RESERVE, help="O- units kept for emergencies")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', action='store_true', help="Also time allocate() against Postgres")
+    args = parser.parse_args()
+
+    requests, stock = backlog(args.requests, args.supply, args.seed)
+    print(f"{args.requests} pending requests, stock {stock}")
+    started = time.perf_counter()
+    allocations, remaining = exact_only(requests, stock)
+    summarize('exact match', requests, stock, allocations, remaining, time.perf_counter() - started)
+    started = time.perf_counter()
+    allocations, remaining = plan(requests, stock, args.reserve)
+    summarize('compatibility', requests, stock, allocations, remaining, time.perf_counter() - started)
+    if args.db:
+        run_db(requests, stock, args.reserve)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Fulfillment throughput with N parallel admins: table-level EXCLUSIVE locks (old) vs row locks (current).
+
+Runs in a scratch schema (bench_fulfill) of the database configured via the DB_* env vars:
+    python benchmarks/fulfill_concurrency.py --admins 1,2,4,8,16 --requests 4000
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrate  # noqa: E402
+from blood_units import MAX_UNITS_PER_CALL, receive_units  # noqa: E402
+from db_config import get_db_connection  # noqa: E402
+from fulfillment import FulfillmentError, fulfill_request, run_in_transaction  # noqa: E402
+
+SCHEMA = 'bench_fulfill'
+BLOOD_TYPES = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+
+
+def connect():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"SET search_path TO {SCHEMA};")
+    conn.commit()
+    cur.close()
+    return conn
+
+
+def seed(num_requests):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA};")
+    conn.commit()
+    migrate.upgrade(conn)  # The app's schema, built in the scratch schema by the real migrations
+    cur.execute("""
+        INSERT INTO requests (required_units, status, blood_group)
+        SELECT 1 + (i %% 3), 'Pending', (ARRAY['A+','A-','B+','B-','AB+','AB-','O+','O-'])[1 + i %% 8]
+        FROM generate_series(1, %s) AS i;
+    """, (num_requests,))
+    for blood_type in BLOOD_TYPES:
+        for received in range(0, num_requests, MAX_UNITS_PER_CALL):
+            receive_units(cur, blood_type, min(MAX_UNITS_PER_CALL, num_requests - received))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def table_lock_fulfill(hold):
+    def work(cur):
+        cur.execute("LOCK TABLE inventory_master IN EXCLUSIVE MODE;")
+        cur.execute("LOCK TABLE requests IN EXCLUSIVE MODE;")
+        time.sleep(hold)
+        return fulfill_request(cur, work.request_id)
+    return work
+
+
+def row_lock_fulfill(hold):
+    def work(cur):
+        result = fulfill_request(cur, work.request_id)
+        time.sleep(hold)
+        return result
+    return work
+
+
+def run(strategy, admins, num_requests, hold):
+    seed(num_requests)
+    ids = list(range(1, num_requests + 1))
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+
+    def admin(worker_ids):
+        conn = connect()
+        work = strategy(hold)
+        for request_id in worker_ids:
+            work.request_id = request_id
+            started = time.perf_counter()
+            try:
+                run_in_transaction(conn, work)
+            except FulfillmentError:
+                with lock:
+                    failures[0] += 1
+            with lock:
+                latencies.append(time.perf_counter() - started)
+        conn.close()
+
+    threads = [threading.Thread(target=admin, args=(ids[i::admins],)) for i in range(admins)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    return num_requests / elapsed, p95 * 1000, failures[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--admins', default='1,2,4,8,16', help='Comma-separated parallel admin counts')
+    parser.add_argument('--requests', type=int, default=2000, help='Pending requests to fulfill per run')
+    parser.add_argument('--hold-ms', type=float, default=1.0,
+                        help='Extra time each transaction holds its locks (simulates app<->DB latency)')
+    args = parser.parse_args()
+
+    strategies = [('table locks', table_lock_fulfill), ('row locks', row_lock_fulfill)]
+    print(f"{'strategy':<12} {'admins':>6} {'req/s':>10} {'p95 ms':>8} {'failed':>7}")
+    for admins in [int(n) for n in args.admins.split(',')]:
+        for name, strategy in strategies:
+            throughput, p95, failed = run(strategy, admins, args.requests, args.hold_ms / 1000)
+            print(f"{name:<12} {admins:>6} {throughput:>10.1f} {p95:>8.2f} {failed:>7}")
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
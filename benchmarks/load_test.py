@@ -0,0 +1,489 @@
+"""Mixed-workload load test: per-route p50/p95/p99 latency and throughput.
+
+Seeds a dedicated database with realistic volumes (schema from migrations/), then runs donor,
+recipient and admin clients concurrently for --duration seconds: donors read their dashboard,
+donations, appointments and free slots; recipients post request bursts and poll their requests;
+admins page through requests and fulfill the pending backlog in parallel. Clients go through the
+Flask test client in-process, or over HTTP to a running server with --url (seed its database with
+--db first).
+
+Every route the dashboards and clients use is in the mix (see Workload). Left out on purpose:
+  GET /events                     a stream held open for minutes, so no latency to speak of
+  POST /admin/import/<kind>,      bulk loads and GRANT/REVOKE: operator tasks, not traffic
+  POST /admin/privileges
+  POST /users, DELETE /users/<id>, PUT/DELETE /admin/users/<id>, DELETE /admin/requests/<id>
+                                  would rewrite or delete the seeded rows the other clients read
+  PUT /admin/appointments/capacity  configuration; changes what POST /appointments returns
+  GET /admin/db_pool, /admin/slow_queries (and DELETE), /admin/cache
+                                  this process's own counters, for operators
+  GET /, /dashboard, /register, /login, /logout
+                                  static pages and redirects; /logout would drop the client's session
+
+    python benchmarks/load_test.py --ephemeral              # throwaway local Postgres (pip install pgserver)
+    python benchmarks/load_test.py --db bloodbank_load      # (re)creates that database on the DB_* server
+    python benchmarks/load_test.py --no-seed --url http://localhost:5000
+    python benchmarks/load_test.py --ephemeral --save report.json
+    python benchmarks/load_test.py --ephemeral --baseline report.json   # exit 1 on a p95 regression
+
+Sync vs async deployment (asgi.py), same workload against each server in turn; reseed in between,
+since admins drain the pending requests:
+
+    python benchmarks/load_test.py --db bloodbank_load --seed-only
+    DB_NAME=bloodbank_load gunicorn -b :5000 -k gthread --threads 16 app:app
+    python benchmarks/load_test.py --no-seed --url http://localhost:5000 --save sync.json
+    python benchmarks/load_test.py --db bloodbank_load --seed-only
+    DB_NAME=bloodbank_load uvicorn asgi:app --port 5000
+    python benchmarks/load_test.py --no-seed --url http://localhost:5000 --baseline sync.json
+
+Exits 1 when any request fails with a 5xx/exception, or a route's p95 regressed past --tolerance.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BLOOD_TYPES = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+PASSWORD = 'load-test-password'
+MIN_SAMPLES = 20  # Routes with fewer samples aren't compared against the baseline
+MIN_REGRESSION_MS = 2.0  # p95 differences below this are noise, whatever the ratio
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[max(0, int(len(values) * pct) - 1)] if values else 0
+
+
+# ---------------- database ----------------
+def start_ephemeral(pgdata):
+    # A private Postgres for this run, stopped and deleted at exit (no Docker needed)
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("--ephemeral needs pgserver: pip install pgserver")
+    from psycopg2.extensions import parse_dsn
+    server = pgserver.get_server(pgdata, cleanup_mode='delete')
+    params = parse_dsn(server.get_uri())
+    os.environ['DB_HOST'] = params.get('host', str(pgdata))
+    if params.get('port'):
+        os.environ['DB_PORT'] = params['port']
+    os.environ['DB_USER'] = params.get('user', 'postgres')
+    os.environ['DB_PASSWORD'] = params.get('password', '')
+    return server
+
+
+def create_database(name):
+    import psycopg2
+    from db_config import DB_SETTINGS
+    conn = psycopg2.connect(**dict(DB_SETTINGS, database='postgres'))
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{name}";')
+    cur.execute(f'CREATE DATABASE "{name}";')
+    conn.close()
+
+
+def seed(conn, users, donations, requests, appointments, units):
+    import migrate
+    import passwords
+    from appointment_slots import rebuild_counts
+    from blood_units import receive_units
+
+    migrate.upgrade(conn)
+    password_hash = passwords.hash_password(PASSWORD)  # One hash for everyone; login cost is bcrypt either way
+    cur = conn.cursor()
+    cur.execute("SELECT setseed(0.42);")  # Same data every run
+    # Every 50th user is an Admin, 3 in 5 are Donors, the rest Recipients; 60% North
+    cur.execute("""
+        INSERT INTO users (name, contact_no, blood_group, role, email, password, region)
+        SELECT 'Load User ' || i, '555' || lpad(i::text, 7, '0'),
+               (ARRAY['A+','A-','B+','B-','AB+','AB-','O+','O-'])[1 + (i * 7) %% 8],
+               CASE WHEN i %% 50 = 0 THEN 'Admin' WHEN i %% 5 < 3 THEN 'Donor' ELSE 'Recipient' END,
+               'user' || i || '@load.test', %s,
+               CASE WHEN i %% 5 < 3 THEN 'North' ELSE 'South' END
+        FROM generate_series(1, %s) AS i;
+    """, (password_hash, users))
+    cur.execute("""
+        INSERT INTO hospitals (name, contact, location)
+        SELECT 'Hospital ' || i, '555' || lpad(i::text, 7, '0'), 'City ' || (i % 10)
+        FROM generate_series(1, 50) AS i;
+    """)
+    cur.execute("""
+        WITH donors AS (SELECT array_agg(user_id ORDER BY user_id) AS ids FROM users WHERE role = 'Donor')
+        INSERT INTO donations (date, quantity, status, donor_id)
+        SELECT CURRENT_DATE - (random() * 730)::int, 1 + (random() * 2)::int,
+               CASE WHEN random() < 0.9 THEN 'Completed' ELSE 'Pending' END,
+               ids[1 + (random() * (cardinality(ids) - 1))::int]
+        FROM donors, generate_series(1, %s);
+    """, (donations,))
+    # The newest fifth of the requests is still Pending: the backlog the admin clients work through
+    cur.execute("""
+        WITH recipients AS (
+            SELECT array_agg(user_id ORDER BY user_id) AS ids, array_agg(region ORDER BY user_id) AS regions
+            FROM users WHERE role = 'Recipient'
+        ), picks AS (
+            SELECT i, 1 + (random() * (cardinality(ids) - 1))::int AS k FROM recipients, generate_series(1, %(n)s) AS i
+        )
+        INSERT INTO requests (date, required_units, status, recipient_id, recipient_region, request_type, blood_group)
+        SELECT CURRENT_DATE - ((%(n)s - i) * 730 / %(n)s), 1 + (random() * 3)::int,
+               CASE WHEN i > %(n)s * 0.8 THEN 'Pending' ELSE 'Fulfilled' END,
+               ids[k], regions[k], CASE WHEN random() < 0.1 THEN 'Emergency' ELSE 'Scheduled' END,
+               (ARRAY['A+','A-','B+','B-','AB+','AB-','O+','O-'])[1 + (random() * 7)::int]
+        FROM picks, recipients
+        ORDER BY i;
+    """, {"n": requests})
+    cur.execute("""
+        INSERT INTO transactions (date, units_allocated, method, request_id, donation_id)
+        SELECT date, required_units, 'Manual Allocation', request_id, NULL FROM requests WHERE status = 'Fulfilled';
+    """)
+    cur.execute("""
+        WITH donors AS (SELECT array_agg(user_id ORDER BY user_id) AS ids FROM users WHERE role = 'Donor')
+        INSERT INTO appointments (date, time_slot, status, user_id)
+        SELECT CURRENT_DATE + (random() * 60 - 30)::int, make_time(9 + (random() * 7)::int, 0, 0),
+               CASE WHEN random() < 0.7 THEN 'Confirmed' ELSE 'Pending' END,
+               ids[1 + (random() * (cardinality(ids) - 1))::int]
+        FROM donors, generate_series(1, %s);
+    """, (appointments,))
+    rebuild_counts(cur)  # Inserted around the booking path, so count them once
+    for blood_type in BLOOD_TYPES:
+        receive_units(cur, blood_type, units)
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("ANALYZE;")
+    conn.autocommit = False
+    cur.close()
+
+
+def load_ids(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM users WHERE role = 'Donor' ORDER BY user_id;")
+    donors = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT user_id FROM users WHERE role = 'Recipient' ORDER BY user_id;")
+    recipients = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT request_id FROM requests WHERE status = 'Pending' ORDER BY request_id;")
+    pending = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT email FROM users WHERE role = 'Donor' ORDER BY user_id LIMIT 1;")
+    login_email = cur.fetchone()[0]
+    conn.rollback()
+    cur.close()
+    return donors, recipients, pending, login_email
+
+
+# ---------------- clients ----------------
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        response.close()  # Ends streamed bodies and runs the app's close hooks, as a server would
+        return response.status_code
+
+
+class HttpClient:
+    # One keep-alive connection per client thread
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.prefix = parsed.path.rstrip('/')
+        connection = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.conn = connection(parsed.netloc, timeout=60)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, self.prefix + path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            self.conn.close()  # Reconnects on the next request
+            raise
+
+
+class Workload:
+    # Each role's actions with relative weights; an action returns (route label, method, path, body)
+    # or None when it has nothing to do (e.g. the pending backlog is used up)
+    def __init__(self, donors, recipients, pending, login_email):
+        self.donors = donors
+        self.recipients = recipients
+        self.pending = pending
+        self.login_email = login_email
+        self.lock = threading.Lock()
+        self.signups = itertools.count(1)
+        today = date.today()
+        self.roles = {
+            'donor': [
+                (3, lambda rng: ('GET /donations?donor_id', 'GET', f'/donations?donor_id={rng.choice(self.donors)}', None)),
+                (2, lambda rng: ('GET /appointments?user_id', 'GET',
+                                 f'/appointments?user_id={rng.choice(self.donors)}', None)),
+                (3, lambda rng: ('GET /inventory', 'GET', '/inventory', None)),
+                (1, lambda rng: ('GET /donor_dashboard', 'GET', '/donor_dashboard', None)),
+                (1, lambda rng: ('GET /hospitals', 'GET', '/hospitals', None)),
+                (1, lambda rng: ('POST /donations', 'POST', '/donations',
+                                 {'date': str(today), 'quantity': 1, 'status': 'Pending'})),
+                (2, lambda rng: ('GET /appointments/availability', 'GET', '/appointments/availability', None)),
+                (1, lambda rng: ('POST /appointments', 'POST', '/appointments',
+                                 {'date': str(today + timedelta(days=rng.randint(1, 30))),
+                                  'time_slot': f'{rng.randint(9, 16):02d}:00'})),
+                (1, lambda rng: ('POST /login', 'POST', '/login', {'email': self.login_email, 'password': PASSWORD})),
+            ],
+            'recipient': [
+                (4, lambda rng: ('POST /requests', 'POST', '/requests', {
+                    'date': str(today), 'required_units': rng.randint(1, 4), 'blood_group': rng.choice(BLOOD_TYPES),
+                    'request_type': 'Emergency' if rng.random() < 0.1 else 'Scheduled'})),
+                (3, lambda rng: ('GET /requests?recipient_id', 'GET',
+                                 f'/requests?recipient_id={rng.choice(self.recipients)}', None)),
+                (2, lambda rng: ('GET /inventory', 'GET', '/inventory', None)),
+                (1, lambda rng: ('GET /recipient_dashboard', 'GET', '/recipient_dashboard', None)),
+                (1, lambda rng: ('GET /recipient/bootstrap', 'GET',
+                                 f'/recipient/bootstrap?recipient_id={rng.choice(self.recipients)}', None)),
+                (1, self.register),
+            ],
+            'admin': [
+                (4, self.fulfill),
+                (3, lambda rng: ('GET /admin/requests', 'GET', '/admin/requests?limit=50', None)),
+                (2, lambda rng: ('GET /admin/requests?status=Pending', 'GET',
+                                 '/admin/requests?status=Pending&limit=50', None)),
+                (2, lambda rng: ('GET /admin/stats', 'GET', '/admin/stats', None)),
+                (1, lambda rng: ('GET /admin/forecast', 'GET', '/admin/forecast', None)),
+                (1, lambda rng: ('GET /admin/users', 'GET', '/admin/users?limit=50', None)),
+                (1, lambda rng: ('GET /admin/units', 'GET', f'/admin/units?blood_type={urllib.parse.quote(rng.choice(BLOOD_TYPES))}', None)),
+                (1, lambda rng: ('GET /admin_dashboard', 'GET', '/admin_dashboard', None)),
+                (1, lambda rng: ('GET /admin/eligible_donors', 'GET',
+                                 f'/admin/eligible_donors?blood_group={urllib.parse.quote(rng.choice(BLOOD_TYPES))}'
+                                 '&limit=50', None)),
+                (1, lambda rng: ('GET /admin/bootstrap', 'GET', '/admin/bootstrap?limit=25&count=1', None)),
+                (1, lambda rng: ('POST /admin/allocation/plan', 'POST', '/admin/allocation/plan', {'details': False})),
+                (1, lambda rng: ('GET /export/transactions', 'GET',
+                                 f'/export/transactions?from={today - timedelta(days=7)}&to={today}', None)),
+                (1, self.fulfill_batch),
+                (1, lambda rng: ('POST /admin/units', 'POST', '/admin/units',
+                                 {'blood_type': rng.choice(BLOOD_TYPES), 'units': rng.randint(1, 10)})),
+                (1, lambda rng: ('POST /admin/inventory', 'POST', '/admin/inventory',
+                                 {'blood_type': rng.choice(BLOOD_TYPES), 'new_units': rng.randint(4000, 6000)})),
+                (1, lambda rng: ('GET /users?stream', 'GET', '/users?stream=1', None)),
+                (1, lambda rng: ('GET /transactions?stream', 'GET', '/transactions?stream=1', None)),
+                (1, lambda rng: ('POST /transactions', 'POST', '/transactions', {
+                    'date': str(today), 'units_allocated': 1, 'method': 'Manual Allocation',
+                    'request_id': None, 'donation_id': None})),
+                (1, lambda rng: ('POST /hospitals', 'POST', '/hospitals', {
+                    'name': f'Load Hospital {rng.randint(1, 10 ** 6)}', 'contact': '5550000000', 'location': 'City 1'})),
+                (1, lambda rng: ('GET /metrics', 'GET', '/metrics', None)),  # What a Prometheus scrape costs
+            ],
+        }
+
+    def fulfill(self, rng):
+        with self.lock:
+            if not self.pending:
+                return None
+            request_id = self.pending.pop(rng.randrange(len(self.pending)))
+        return ('POST /admin/fulfill/<id>', 'POST', f'/admin/fulfill/{request_id}', {})
+
+    def fulfill_batch(self, rng):
+        with self.lock:
+            if not self.pending:
+                return None
+            request_ids = [self.pending.pop(rng.randrange(len(self.pending)))
+                           for _ in range(min(10, len(self.pending)))]
+        return ('POST /admin/fulfill/batch', 'POST', '/admin/fulfill/batch', {'request_ids': request_ids})
+
+    def register(self, rng):
+        # A new recipient each time: the email is unique per run and process
+        n = next(self.signups)
+        return ('POST /register', 'POST', '/register', {
+            'name': f'Signup {n}', 'contact_no': '5550000000', 'blood_group': rng.choice(BLOOD_TYPES),
+            'role': 'Recipient', 'email': f'signup{n}.{os.getpid()}.{int(time.time())}@load.test',
+            'password': PASSWORD, 'region': rng.choice(['North', 'South'])})
+
+    def choose(self, role, rng):
+        actions = self.roles[role]
+        weights = [weight for weight, _ in actions]
+        return rng.choices(actions, weights)[0][1](rng)
+
+
+def run(make_client, workload, clients, duration, warmup):
+    samples = {}  # route label -> [latency...]
+    statuses = {}  # route label -> {status: count}
+    failures = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    def client(role, seed):
+        rng = random.Random(seed)
+        http = make_client()
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            action = workload.choose(role, rng)
+            if action is None:
+                continue
+            label, method, path, body = action
+            before = time.perf_counter()
+            try:
+                status = http.request(method, path, body)
+            except Exception as e:
+                status = None
+                error = str(e)
+            elapsed = time.perf_counter() - before
+            if before < measure_from:
+                continue
+            with lock:
+                samples.setdefault(label, []).append(elapsed)
+                counts = statuses.setdefault(label, {})
+                counts[status] = counts.get(status, 0) + 1
+                if status is None or status >= 500:
+                    failures.append((label, path, status if status is not None else error))
+
+    threads = []
+    for role, count in clients.items():
+        threads.extend(threading.Thread(target=client, args=(role, f'{role}-{i}')) for i in range(count))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = max(time.perf_counter() - measure_from, 1e-9)
+
+    routes = {}
+    for label, latencies in samples.items():
+        routes[label] = {
+            "count": len(latencies),
+            "rps": round(len(latencies) / elapsed, 2),
+            "errors": sum(n for status, n in statuses[label].items() if status is None or status >= 500),
+            "statuses": {str(status): n for status, n in sorted(statuses[label].items(), key=lambda s: str(s[0]))},
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(max(latencies) * 1000, 2),
+        }
+    total = sum(route['count'] for route in routes.values())
+    return {"duration": round(elapsed, 2), "clients": clients, "total_requests": total,
+            "rps": round(total / elapsed, 2), "routes": routes}, failures
+
+
+def print_report(report):
+    print(f"{'route':<36} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'5xx':>5}")
+    for label, route in sorted(report['routes'].items()):
+        print(f"{label:<36} {route['count']:>7} {route['rps']:>8.1f} {route['p50_ms']:>8.2f} {route['p95_ms']:>8.2f} "
+              f"{route['p99_ms']:>8.2f} {route['max_ms']:>8.2f} {route['errors']:>5}")
+    print(f"{'total':<36} {report['total_requests']:>7} {report['rps']:>8.1f}")
+
+
+def regressions(report, baseline, tolerance):
+    found = []
+    for label, route in sorted(report['routes'].items()):
+        before = baseline['routes'].get(label)
+        if before is None or min(route['count'], before['count']) < MIN_SAMPLES:
+            continue
+        limit = before['p95_ms'] * (1 + tolerance)
+        if route['p95_ms'] > limit and route['p95_ms'] - before['p95_ms'] >= MIN_REGRESSION_MS:
+            found.append(f"{label}: p95 {before['p95_ms']:.2f} -> {route['p95_ms']:.2f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_argument_group('database')
+    target.add_argument('--ephemeral', action='store_true', help='Run against a throwaway pgserver instance')
+    target.add_argument('--db', default='bloodbank_load', help='Database to (re)create and seed')
+    target.add_argument('--no-seed', action='store_true', help='Reuse an already seeded --db')
+    target.add_argument('--seed-only', action='store_true', help='Seed --db and exit (for a separate server)')
+    volumes = parser.add_argument_group('seed volumes')
+    volumes.add_argument('--users', type=int, default=20000)
+    volumes.add_argument('--donations', type=int, default=100000)
+    volumes.add_argument('--requests', type=int, default=50000)
+    volumes.add_argument('--appointments', type=int, default=20000)
+    volumes.add_argument('--units', type=int, default=5000, help='Available units per blood type')
+    load = parser.add_argument_group('load')
+    load.add_argument('--url', help='Drive a running server instead of the in-process test client')
+    load.add_argument('--donors', type=int, default=8, help='Concurrent donor clients')
+    load.add_argument('--recipients', type=int, default=4, help='Concurrent recipient clients')
+    load.add_argument('--admins', type=int, default=4, help='Concurrent admin clients')
+    load.add_argument('--duration', type=float, default=30, help='Measured seconds')
+    load.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds first')
+    report = parser.add_argument_group('report')
+    report.add_argument('--save', help='Write the report as JSON')
+    report.add_argument('--baseline', help='Compare p95s with a report saved earlier')
+    report.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 increase over the baseline')
+    args = parser.parse_args()
+
+    app_database = os.environ.get('DB_NAME', 'Bloodbank')
+    server = None
+    if args.ephemeral:
+        server = start_ephemeral(tempfile.mkdtemp(prefix='bloodbank-load-'))
+    elif not args.no_seed and args.db == app_database:
+        sys.exit(f"Refusing to drop {args.db}: it is the app's database (DB_NAME); pick another --db")
+    # db_config reads DB_* at import, so nothing touching the database is imported before this
+    os.environ['DB_NAME'] = args.db
+    from db_config import get_db_connection
+
+    try:
+        if not args.no_seed:
+            create_database(args.db)
+            conn = get_db_connection()
+            started = time.perf_counter()
+            seed(conn, args.users, args.donations, args.requests, args.appointments, args.units)
+            conn.close()
+            print(f"Seeded {args.db} in {time.perf_counter() - started:.1f}s: {args.users} users, "
+                  f"{args.donations} donations, {args.requests} requests, {args.appointments} appointments")
+        if args.seed_only:
+            return
+        conn = get_db_connection()
+        workload = Workload(*load_ids(conn))
+        conn.close()
+
+        if args.url:
+            def make_client():
+                return HttpClient(args.url)
+        else:
+            from app import app
+
+            def make_client():
+                return TestClient(app)
+        clients = {'donor': args.donors, 'recipient': args.recipients, 'admin': args.admins}
+        result, failures = run(make_client, workload, {role: n for role, n in clients.items() if n > 0},
+                               args.duration, args.warmup)
+    finally:
+        if server is not None:
+            server.cleanup()
+
+    print_report(result)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    failed = False
+    if failures:
+        failed = True
+        print(f"\n{len(failures)} failed requests, e.g.:")
+        for label, path, detail in failures[:5]:
+            print(f"  {label} ({path}): {detail}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        if found:
+            failed = True
+            print(f"\np95 regressions beyond {args.tolerance:.0%}:")
+            for line in found:
+                print(f"  {line}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Login throughput with concurrent clients, per password-hashing executor.
+
+Drives POST /login through the Flask test client from N threads against the database configured via
+the DB_* env vars (a throwaway user is created and removed). Also times a cheap request (/inventory)
+issued while the logins run, to show whether hashing starves other endpoints.
+    python benchmarks/login_throughput.py --clients 16 --logins 200 --rounds 12
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords  # noqa: E402
+from app import app  # noqa: E402
+from db_config import get_db_connection  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[max(0, int(len(values) * pct) - 1)] if values else 0
+
+
+def create_user(email, password):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (name, contact_no, blood_group, role, email, password, region)
+        VALUES ('Bench User', '0', 'O+', 'Donor', %s, %s, 'North');
+    """, (email, passwords.hash_password(password)))
+    conn.commit()
+    conn.close()
+
+
+def delete_user(email):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM users WHERE email = %s;", (email,))
+    conn.commit()
+    conn.close()
+
+
+def run(clients, logins, email, password):
+    latencies = []
+    probe_latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def client(count):
+        c = app.test_client()
+        for _ in range(count):
+            started = time.perf_counter()
+            r = c.post('/login', json={'email': email, 'password': password})
+            assert r.status_code == 200, r.get_data(as_text=True)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    def probe():
+        c = app.test_client()
+        while not done.is_set():
+            started = time.perf_counter()
+            c.get('/inventory')
+            probe_latencies.append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=client, args=(logins // clients,)) for _ in range(clients)]
+    prober = threading.Thread(target=probe)
+    started = time.perf_counter()
+    prober.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    prober.join()
+    return len(latencies) / elapsed, percentile(latencies, 0.95) * 1000, percentile(probe_latencies, 0.95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=160)
+    parser.add_argument('--rounds', type=int, default=passwords.BCRYPT_ROUNDS)
+    parser.add_argument('--workers', type=int, default=passwords.HASH_WORKERS)
+    parser.add_argument('--executors', default='inline,thread,process')
+    args = parser.parse_args()
+
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    password = 'bench-password'
+    passwords.configure(executor='inline', rounds=args.rounds)
+    create_user(email, password)
+    try:
+        print(f"{'executor':<9} {'logins/s':>9} {'p95 ms':>8} {'/inventory p95 ms':>18}")
+        for executor in args.executors.split(','):
+            passwords.configure(executor=executor, workers=args.workers, rounds=args.rounds)
+            throughput, p95, probe_p95 = run(args.clients, args.logins, email, password)
+            print(f"{executor:<9} {throughput:>9.1f} {p95:>8.1f} {probe_p95:>18.1f}")
+    finally:
+        passwords.shutdown()
+        delete_user(email)
+
+
+if __name__ == '__main__':
+    main()
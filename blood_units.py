@@ -0,0 +1,230 @@
+"""Unit-level blood stock: one row per bag, allocated first-expiring-first-out (FEFO).
+
+inventory_master.units stays the per-blood-type aggregate that /inventory serves; statement-level
+triggers on blood_units keep it equal to the number of Available units, so nothing counts bags per
+call. Anything that allocates stock locks the blood type's inventory_master row first (that row is
+the per-type mutex), sweeps its expired units, then takes bags in (expires_on, unit_id) order.
+
+Set up once (creates the table, index and triggers and adopts the current counts as units). That
+is migration 0003, so this applies the pending migrations, like `python migrate.py up`:
+    python blood_units.py init
+Expire stale units by hand (the app also runs this periodically, see ExpiryJob):
+    python blood_units.py expire
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import zlib
+
+import migrate
+from db_config import get_db_connection, get_pool
+from logs import get_logger
+from metrics import lock_wait
+
+# Days from collection to expiry per component
+SHELF_LIFE_DAYS = {'Whole Blood': 35, 'Red Cells': 42, 'Platelets': 5, 'Plasma': 365}
+DEFAULT_COMPONENT = 'Whole Blood'
+UNIT_STATUSES = ['Available', 'Allocated', 'Expired', 'Discarded']
+# Seconds between expiry sweeps in each worker (only one worker sweeps at a time); 0 disables
+EXPIRY_INTERVAL = float(os.environ.get('UNIT_EXPIRY_INTERVAL', '600'))
+EXPIRY_LOCK_ID = zlib.crc32(b'blood_units_expiry')  # pg_try_advisory_xact_lock key
+# Most units one call may receive or set a type's stock to: every unit is a row inserted in one statement
+MAX_UNITS_PER_CALL = 10000
+
+log = get_logger('blood_units')
+
+class UnitError(ValueError):
+    pass
+
+
+def receive_units(cur, blood_type, count, component=DEFAULT_COMPONENT, collected_on=None, donation_id=None):
+    # Adds `count` Available units; the trigger bumps inventory_master. Returns the new unit_ids.
+    if count > MAX_UNITS_PER_CALL:
+        raise UnitError(f"At most {MAX_UNITS_PER_CALL} units per call")
+    if component not in SHELF_LIFE_DAYS:
+        raise UnitError(f"Unknown component '{component}' (expected one of: {', '.join(SHELF_LIFE_DAYS)})")
+    cur.execute("""
+        INSERT INTO blood_units (blood_type, component, collected_on, expires_on, donation_id)
+        SELECT %(blood_type)s, %(component)s, c.day, c.day + %(shelf_life)s, %(donation_id)s
+        FROM (SELECT COALESCE(%(collected_on)s::date, CURRENT_DATE) AS day) c, generate_series(1, %(count)s)
+        RETURNING unit_id;
+    """, {"blood_type": blood_type, "component": component, "shelf_life": SHELF_LIFE_DAYS[component],
+          "collected_on": collected_on, "donation_id": donation_id, "count": count})
+    return [row[0] for row in cur.fetchall()]
+
+
+# Allocation statements, shared with the async twins in aio.py
+LOCK_ALL_STOCK_SQL = "SELECT blood_type FROM inventory_master ORDER BY blood_type FOR UPDATE;"
+LOCK_STOCK_SQL = "SELECT blood_type FROM inventory_master WHERE blood_type = ANY(%s) ORDER BY blood_type FOR UPDATE;"
+EXPIRE_STOCK_SQL = """
+    UPDATE blood_units SET status = 'Expired'
+    WHERE status = 'Available' AND blood_type = ANY(%s) AND expires_on < CURRENT_DATE;
+"""
+STOCK_SQL = "SELECT blood_type, units FROM inventory_master WHERE blood_type = ANY(%s);"
+# A demand takes its type's FEFO-ranked units numbered upto - units + 1 .. upto, where upto is
+# the running total of that type's demands so far (an equi-join on (blood_type, n), not a range join)
+ALLOCATE_UNITS_SQL = """
+    WITH demand AS (
+        SELECT request_id, blood_type, units,
+               SUM(units) OVER (PARTITION BY blood_type ORDER BY seq) AS upto
+        FROM unnest(%s::int[], %s::varchar[], %s::int[]) WITH ORDINALITY AS d(request_id, blood_type, units, seq)
+    ), ranked AS (
+        SELECT unit_id, blood_type,
+               row_number() OVER (PARTITION BY blood_type ORDER BY expires_on, unit_id) AS n
+        FROM blood_units
+        WHERE status = 'Available' AND expires_on >= CURRENT_DATE
+          AND blood_type = ANY(%s)
+    ), slots AS (
+        SELECT request_id, blood_type, generate_series(upto - units + 1, upto) AS n FROM demand
+    ), picked AS (
+        SELECT r.unit_id, s.request_id FROM ranked r JOIN slots s USING (blood_type, n)
+    )
+    UPDATE blood_units b SET status = 'Allocated', request_id = picked.request_id,
+                             allocated_at = CURRENT_TIMESTAMP
+    FROM picked WHERE b.unit_id = picked.unit_id AND b.status = 'Available'
+    RETURNING b.blood_type;
+"""
+
+
+def lock_stock(cur, blood_types=None):
+    # Locks inventory_master rows (in blood_type order, like every other writer), expires their
+    # stale units and returns {blood_type: available units}; held until the caller commits.
+    with lock_wait('inventory'):
+        if blood_types is None:
+            cur.execute(LOCK_ALL_STOCK_SQL)
+        else:
+            cur.execute(LOCK_STOCK_SQL, (list(blood_types),))
+    locked = [row[0] for row in cur.fetchall()]
+    if locked:
+        cur.execute(EXPIRE_STOCK_SQL, (locked,))
+    cur.execute(STOCK_SQL, (locked,))
+    return dict(cur.fetchall())
+
+
+def allocate_units(cur, demands):
+    # demands: (request_id, blood_type, units) in priority order, for blood types the caller locked
+    # with lock_stock(). Earlier demands get the earlier-expiring bags. Returns {blood_type: units taken}.
+    if not demands:
+        return {}
+    request_ids, blood_types, units = zip(*demands)
+    cur.execute(ALLOCATE_UNITS_SQL, (list(request_ids), list(blood_types), list(units), sorted(set(blood_types))))
+    taken = {}
+    for (blood_type,) in cur.fetchall():
+        taken[blood_type] = taken.get(blood_type, 0) + 1
+    return taken
+
+
+def set_stock(cur, blood_type, units):
+    # Manual stock correction to an absolute count: adds units collected today, or discards the
+    # first-expiring ones. Returns the new count.
+    if units > MAX_UNITS_PER_CALL:
+        raise UnitError(f"Stock can be set to at most {MAX_UNITS_PER_CALL} units")
+    current = lock_stock(cur, [blood_type]).get(blood_type, 0)
+    if units > current:
+        receive_units(cur, blood_type, units - current)
+    elif units < current:
+        cur.execute("""
+            UPDATE blood_units SET status = 'Discarded' WHERE unit_id IN (
+                SELECT unit_id FROM blood_units WHERE status = 'Available' AND blood_type = %s
+                ORDER BY expires_on, unit_id LIMIT %s
+            );
+        """, (blood_type, current - units))
+    return units
+
+
+def expire_units(cur):
+    # Marks every Available unit past its expiry date as Expired. Returns {blood_type: units left}
+    # for the blood types that changed.
+    cur.execute("SELECT DISTINCT blood_type FROM blood_units WHERE status = 'Available' AND expires_on < CURRENT_DATE;")
+    due = [row[0] for row in cur.fetchall()]
+    if not due:
+        return {}
+    return lock_stock(cur, due)
+
+
+class ExpiryJob:
+    # Background sweep per worker process; an advisory lock keeps concurrent workers from
+    # doing the same work. Started lazily like the cache bus.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.on_expired = None  # Callback({blood_type: units left}) after a sweep that changed stock
+        self.runs = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_changed = []
+
+    def start(self):
+        if EXPIRY_INTERVAL <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='unit-expiry', daemon=True).start()
+
+    def run_once(self):
+        with get_pool().connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (EXPIRY_LOCK_ID,))
+                changed = expire_units(cur) if cur.fetchone()[0] else {}
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_changed = sorted(changed)
+        if changed and self.on_expired is not None:
+            self.on_expired(changed)
+        return changed
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                log.warning("Unit expiry sweep failed", extra={"error": str(e)})
+            time.sleep(EXPIRY_INTERVAL)
+
+    def stats(self):
+        return {
+            "interval": EXPIRY_INTERVAL,
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_run": self.last_run,
+            "last_changed": self.last_changed,
+        }
+
+
+expiry_job = ExpiryJob()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['init', 'expire'])
+    args = parser.parse_args()
+    conn = get_db_connection()
+    try:
+        if args.command == 'init':
+            applied = migrate.upgrade(conn)
+            print("blood_units ready" + (f" (applied {', '.join(applied)})" if applied else ""))
+        else:
+            cur = conn.cursor()
+            changed = expire_units(cur)
+            conn.commit()
+            print(f"Expired units in: {', '.join(changed) or 'none'}")
+    except migrate.MigrationError as e:
+        sys.exit(f"Migration failed: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
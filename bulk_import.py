@@ -0,0 +1,251 @@
+"""Bulk import of users, donations and inventory via COPY FROM STDIN.
+
+Rows are streamed (CSV with a header row, or NDJSON) into a temporary staging table, validated with
+set-based SQL, and the valid ones merged into the real table in the same transaction. Used by
+POST /admin/import/<kind> and from the command line:
+    python bulk_import.py donations donations.csv [--dry-run]
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+
+from psycopg2 import sql
+
+from allocation import BLOOD_GROUPS
+from blood_units import MAX_UNITS_PER_CALL, set_stock
+
+MAX_REPORTED_REJECTS = 1000
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+def _merge_inventory(cur):
+    # Stock is tracked per unit, so absolute counts go through set_stock (at most 8 rows here)
+    cur.execute("SELECT blood_type, units::int FROM import_stage WHERE error IS NULL ORDER BY blood_type;")
+    for blood_type, units in cur.fetchall():
+        set_stock(cur, blood_type, units)
+
+
+def _too_long(column, max_length):
+    # Check for a VARCHAR(max_length) column, so the row is rejected instead of aborting the merge
+    return (f"{column} is longer than {max_length} characters", f"length({column}) > {max_length}")
+
+
+# Per kind: staging columns, required columns (as checked by add_user/add_donation), validation
+# checks as (reason, SQL condition that is true for bad rows), and the merge statement (or function).
+KINDS = {
+    'users': {
+        'columns': ['name', 'contact_no', 'blood_group', 'role', 'email', 'password', 'region'],
+        'required': ['name', 'contact_no', 'blood_group', 'role', 'email', 'password'],
+        'checks': [
+            _too_long('name', 100),
+            _too_long('contact_no', 20),
+            _too_long('email', 255),
+            _too_long('role', 20),
+            _too_long('region', 10),
+            ("Invalid blood_group", "blood_group <> ALL(%(blood_groups)s)"),
+            ("Invalid role", "role NOT IN ('Donor', 'Recipient', 'Admin')"),
+            ("Invalid region", "COALESCE(NULLIF(region, ''), 'North') NOT IN ('North', 'South')"),
+            ("password must be a bcrypt hash", "password !~ '^\\$2[aby]\\$[0-9]{2}\\$.{53}$'"),
+            ("Duplicate email in file", "row_no IN (SELECT row_no FROM (SELECT row_no, row_number() OVER "
+                                        "(PARTITION BY lower(email) ORDER BY row_no) AS n FROM import_stage) d WHERE n > 1)"),
+            ("Email already registered", "lower(email) IN (SELECT lower(email) FROM users)"),
+        ],
+        'merge': """
+            INSERT INTO users (name, contact_no, blood_group, role, email, password, region)
+            SELECT name, contact_no, blood_group, role, email, password, COALESCE(NULLIF(region, ''), 'North')
+            FROM import_stage WHERE error IS NULL ORDER BY row_no;
+        """,
+    },
+    'donations': {
+        'columns': ['date', 'quantity', 'status', 'donor_id'],
+        'required': ['date', 'quantity', 'status', 'donor_id'],
+        'checks': [
+            _too_long('status', 20),
+            ("Invalid date", "NOT pg_temp.is_date(date)"),
+            ("quantity must be a positive integer", "quantity !~ '^[0-9]{1,9}$' OR quantity ~ '^0+$'"),
+            ("donor_id must be an integer", "donor_id !~ '^[0-9]{1,9}$'"),
+            # CASE guards the cast: Postgres doesn't promise to evaluate "error IS NULL" first
+            ("Unknown donor_id", "CASE WHEN donor_id ~ '^[0-9]{1,9}$' THEN donor_id::int END "
+                                 "NOT IN (SELECT user_id FROM users)"),
+        ],
+        'merge': """
+            INSERT INTO donations (date, quantity, status, donor_id)
+            SELECT date::date, quantity::int, status, donor_id::int
+            FROM import_stage WHERE error IS NULL ORDER BY row_no;
+        """,
+    },
+    'inventory': {
+        'columns': ['blood_type', 'units'],
+        'required': ['blood_type', 'units'],
+        'checks': [
+            ("Invalid blood_type", "blood_type <> ALL(%(blood_groups)s)"),
+            ("units must be a non-negative integer", "units !~ '^[0-9]{1,9}$'"),
+            (f"units must be at most {MAX_UNITS_PER_CALL}",
+             "CASE WHEN units ~ '^[0-9]{1,9}$' THEN units::int END > %(max_units)s"),
+            ("Superseded by a later row for the same blood_type",
+             "row_no IN (SELECT row_no FROM (SELECT row_no, row_number() OVER "
+             "(PARTITION BY blood_type ORDER BY row_no DESC) AS n FROM import_stage) d WHERE n > 1)"),
+        ],
+        # Same semantics as admin_update_inventory (see _merge_inventory)
+        'merge': _merge_inventory,
+    },
+}
+
+
+class _NdjsonAsCsv(io.RawIOBase):
+    # File-like adapter for COPY: reads NDJSON lines from `source`, yields CSV text for `columns`
+    def __init__(self, source, columns):
+        self._lines = iter(source)
+        self._columns = columns
+        self._buffer = b''
+        self.line_no = 0
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for line in self._lines:
+            self.line_no += 1
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise BulkImportError(f"Line {self.line_no} is not valid JSON")
+            if not isinstance(record, dict):
+                raise BulkImportError(f"Line {self.line_no} is not a JSON object")
+            writer.writerow(['' if record.get(c) is None else str(record.get(c)) for c in self._columns])
+            if out.tell() >= 65536:
+                break
+        return out.getvalue().encode('utf-8')
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = self._next_chunk()
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _csv_header(stream):
+    line = stream.readline()
+    if isinstance(line, bytes):
+        line = line.decode('utf-8-sig')
+    header = next(csv.reader([line]), [])
+    return [c.strip().lower() for c in header]
+
+
+def run_import(conn, kind, stream, fmt='csv', dry_run=False):
+    # Streams rows from `stream` (binary file-like) into Postgres; commits unless dry_run.
+    # Returns {"received", "imported", "rejected", "rejects": [{"row", "error"}...]}
+    spec = KINDS.get(kind)
+    if spec is None:
+        raise BulkImportError(f"Unknown import kind '{kind}' (expected one of: {', '.join(KINDS)})")
+
+    if fmt == 'csv':
+        columns = _csv_header(stream)
+        unknown = [c for c in columns if c not in spec['columns']]
+        if unknown:
+            raise BulkImportError(f"Unknown column(s): {', '.join(unknown)}")
+        source = stream
+    elif fmt == 'ndjson':
+        columns = spec['columns']
+        source = _NdjsonAsCsv(stream, columns)
+    else:
+        raise BulkImportError("format must be csv or ndjson")
+    missing = [c for c in spec['required'] if c not in columns]
+    if missing:
+        raise BulkImportError(f"Missing required column(s): {', '.join(missing)}")
+
+    cur = conn.cursor()
+    try:
+        cur.execute(sql.SQL("""
+            CREATE TEMP TABLE import_stage (row_no BIGSERIAL, {columns}, error TEXT) ON COMMIT DROP;
+        """).format(columns=sql.SQL(', ').join(sql.SQL("{} TEXT").format(sql.Identifier(c)) for c in spec['columns'])))
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION pg_temp.is_date(value TEXT) RETURNS BOOLEAN AS $$
+            BEGIN
+                PERFORM value::date;
+                RETURN TRUE;
+            EXCEPTION WHEN others THEN
+                RETURN FALSE;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+        cur.copy_expert(sql.SQL("COPY import_stage ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.SQL(', ').join(sql.Identifier(c) for c in columns)).as_string(conn), source)
+
+        # Set-based validation: first failing check wins for each row
+        missing_any = " OR ".join(f"COALESCE(TRIM({c}), '') = ''" for c in spec['required'])
+        cur.execute(f"UPDATE import_stage SET error = 'Missing required field(s)' WHERE {missing_any};")
+        for reason, condition in spec['checks']:
+            cur.execute(f"UPDATE import_stage SET error = %(reason)s WHERE error IS NULL AND ({condition});",
+                        {"reason": reason, "blood_groups": BLOOD_GROUPS,
+                         "max_units": MAX_UNITS_PER_CALL})
+
+        cur.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE error IS NOT NULL) FROM import_stage;")
+        received, rejected = cur.fetchone()
+        cur.execute("SELECT row_no, error FROM import_stage WHERE error IS NOT NULL ORDER BY row_no LIMIT %s;",
+                    (MAX_REPORTED_REJECTS,))
+        rejects = [{"row": row_no, "error": error} for row_no, error in cur.fetchall()]
+
+        imported = 0
+        if not dry_run and received > rejected:
+            if callable(spec['merge']):
+                spec['merge'](cur)
+            else:
+                cur.execute(spec['merge'])
+            imported = received - rejected
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+        return {"received": received, "imported": imported, "rejected": rejected, "rejects": rejects,
+                "dry_run": dry_run}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=sorted(KINDS))
+    parser.add_argument('path', help="CSV (with header) or NDJSON file; '-' for stdin")
+    parser.add_argument('--format', choices=['csv', 'ndjson'],
+                        help="Defaults to ndjson for .ndjson/.jsonl files, csv otherwise")
+    parser.add_argument('--dry-run', action='store_true', help="Validate only, don't write anything")
+    args = parser.parse_args()
+
+    from db_config import get_db_connection
+
+    fmt = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+    conn = get_db_connection()
+    try:
+        result = run_import(conn, args.kind, stream, fmt=fmt, dry_run=args.dry_run)
+    except BulkImportError as e:
+        sys.exit(f"Import failed: {e}")
+    finally:
+        conn.close()
+        stream.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
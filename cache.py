@@ -0,0 +1,98 @@
+import threading
+import time
+
+# Registry of named in-process caches, so write routes can invalidate by name
+caches = {}
+# Callbacks told about every invalidation (e.g. to broadcast it to other worker processes)
+publishers = []
+# Upper bound on every cache's TTL while cross-process invalidation is unavailable (None = no bound)
+fallback_ttl = None
+
+
+class TTLCache:
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (value, expires_at)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        caches[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return default
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        ttl = self.ttl if fallback_ttl is None else min(self.ttl, fallback_ttl)
+        with self._lock:
+            # Don't store a value loaded before an invalidation that raced with it
+            if generation == self._generation:
+                self._entries[key] = (value, time.monotonic() + ttl)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        # Same as get_or_load for a coroutine loader (asgi.py); the shared entries serve both modes
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+        value = await loader()
+        ttl = self.ttl if fallback_ttl is None else min(self.ttl, fallback_ttl)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (value, time.monotonic() + ttl)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+def invalidate_local(*names):
+    for name in names or list(caches):
+        cache = caches.get(name)
+        if cache is not None:
+            cache.invalidate()
+
+
+def invalidate(*names, cur=None):
+    # With cur, call it before the write commits: the other workers are told in the same
+    # transaction, so on commit and never on rollback. This worker drops its entries now and
+    # again when that notification comes back, so nothing loaded in between outlives the commit.
+    invalidate_local(*names)
+    for publish in publishers:
+        publish(names, cur)
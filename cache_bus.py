@@ -0,0 +1,143 @@
+import os
+import select
+import threading
+import time
+
+import cache
+from db_config import get_db_connection, get_pool
+from logs import get_logger
+
+# Cross-worker cache invalidation over Postgres LISTEN/NOTIFY.
+# Each gunicorn worker runs one listener thread on a dedicated connection; invalidate() in any
+# worker NOTIFYs the others, on the writer's own connection when it passes its cursor. While the
+# listener is down, caches fall back to a short TTL.
+# Other modules can add channels of their own with bus.listen() (e.g. the /events feed).
+CHANNEL = 'cache_invalidate'
+ENABLED = os.environ.get('CACHE_BUS', '1').lower() not in ('0', 'false', 'no')
+FALLBACK_TTL = float(os.environ.get('CACHE_BUS_FALLBACK_TTL', '2'))
+POLL_INTERVAL = 15.0  # Seconds between liveness checks on an idle listener connection
+RECONNECT_DELAY = 1.0
+
+log = get_logger('cache_bus')
+
+
+class InvalidationBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self.reconnects = 0
+        self.errors = 0
+        self._channels = {CHANNEL: self._handle}
+
+    @property
+    def running(self):
+        return ENABLED and self._pid == os.getpid()
+
+    def listen(self, channel, handler):
+        # Register before the first request; handler(payload) runs on the listener thread
+        self._channels[channel] = handler
+
+    def start(self):
+        # Idempotent per process; a forked worker starts its own thread
+        if not ENABLED or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.connected = False
+            cache.fallback_ttl = FALLBACK_TTL  # Until the first LISTEN succeeds
+            if self.publish not in cache.publishers:
+                cache.publishers.append(self.publish)
+            thread = threading.Thread(target=self._run, name='cache-invalidation-listener', daemon=True)
+            thread.start()
+
+    def notify(self, channel, payload, cur=None):
+        if cur is not None:
+            # In the caller's transaction: delivered on commit, dropped on rollback. Errors
+            # propagate, so a write and its notification succeed or fail together.
+            cur.execute("SELECT pg_notify(%s, %s);", (channel, payload))
+            self.published += 1
+            return True
+        try:
+            with get_pool().connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT pg_notify(%s, %s);", (channel, payload))
+                cur.close()
+                conn.commit()
+            self.published += 1
+            return True
+        except Exception as e:
+            self.errors += 1
+            log.warning("NOTIFY failed", extra={"channel": channel, "error": str(e)})
+            return False
+
+    def publish(self, names, cur=None):
+        if not self.running:
+            return
+        # On failure other workers still converge through the fallback TTL
+        self.notify(CHANNEL, self.payload(names), cur)
+
+    def payload(self, names):
+        return f"{os.getpid()}:{','.join(names)}"
+
+    def _handle(self, payload):
+        # Our own notifications too: sent in a transaction, they arrive after its commit
+        _, _, names = payload.partition(':')
+        cache.invalidate_local(*[name for name in names.split(',') if name])
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.autocommit = True
+                cur = conn.cursor()
+                for channel in self._channels:
+                    cur.execute(f"LISTEN {channel};")
+                # Anything may have changed while we weren't listening
+                cache.invalidate_local()
+                cache.fallback_ttl = None
+                self.connected = True
+                while True:
+                    if select.select([conn], [], [], POLL_INTERVAL) == ([], [], []):
+                        cur.execute("SELECT 1;")  # Detect dead connections on quiet channels
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        self.received += 1
+                        self._channels[notification.channel](notification.payload)
+            except Exception as e:
+                if self.connected:
+                    log.warning("Cache invalidation listener lost its connection", extra={"error": str(e)})
+                self.errors += 1
+            finally:
+                if self.connected:
+                    self.reconnects += 1
+                self.connected = False
+                cache.fallback_ttl = FALLBACK_TTL
+                cache.invalidate_local()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(RECONNECT_DELAY)
+
+    def stats(self):
+        return {
+            "enabled": ENABLED,
+            "connected": self.connected,
+            "published": self.published,
+            "received": self.received,
+            "reconnects": self.reconnects,
+            "errors": self.errors,
+            "fallback_ttl": cache.fallback_ttl,
+        }
+
+
+bus = InvalidationBus()
@@ -1,10 +1,48 @@
+import os
+import threading
+
 import psycopg2
 
+from db_pool import ConnectionPool
+from metrics import InstrumentedConnection
+
+# Connection settings (override via environment variables in prod)
+DB_SETTINGS = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "port": int(os.environ.get("DB_PORT", "5432")),
+    "database": os.environ.get("DB_NAME", "Bloodbank"),
+    "user": os.environ.get("DB_USER", "postgres"),
+    "password": os.environ.get("DB_PASSWORD", "root"),
+    "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", "5")),
+}
+# Read replicas for read-only routes: libpq DSNs or URIs separated by ';' (empty = primary only)
+DB_REPLICAS = [dsn.strip() for dsn in os.environ.get("DB_REPLICAS", "").split(";") if dsn.strip()]
+
+# Pool sizing is per gunicorn worker process
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+POOL_CHECK_IDLE = float(os.environ.get("DB_POOL_CHECK_IDLE", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
 def get_db_connection():
-    conn = psycopg2.connect(
-        host="localhost",
-        database="Bloodbank",     # change if your DB name is different
-        user="postgres",
-        password="root"   # replace with your PostgreSQL password
-    )
+    # Opens a new, unpooled connection (the caller must close it); its cursors feed /metrics
+    conn = psycopg2.connect(**DB_SETTINGS, connection_factory=InstrumentedConnection)
     return conn
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(get_db_connection, minconn=POOL_MIN, maxconn=POOL_MAX,
+                                       timeout=POOL_TIMEOUT, check_idle=POOL_CHECK_IDLE)
+    try:
+        _pool.prefill()  # DB_POOL_MIN connections, once per worker process
+    except psycopg2.Error:
+        pass  # Database unreachable: getconn() reports it to the caller
+    return _pool
@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+# Thread-safe psycopg2 connection pool (one per gunicorn worker process)
+class ConnectionPool:
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=10.0, check_idle=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (minconn, maxconn))
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle  # Ping connections idle longer than this (seconds)
+        self._cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._prefilled = False
+        self._idle = []  # (conn, returned_at) stack, most recently used last
+        self._in_use = set()
+        self._size = 0
+        self._closed = False
+        self._metrics = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+        }
+
+    def _check_fork(self):
+        # Connections inherited from a parent process share its sockets; drop them, never close them
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _new_conn(self):
+        conn = self._connect()
+        self._metrics["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._size -= 1
+        self._metrics["connections_discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def prefill(self):
+        # Opens minconn connections once per process (get_pool() calls this on every use)
+        if self._prefilled and self._pid == os.getpid():
+            return
+        with self._cond:
+            self._check_fork()
+            if self._prefilled or self._closed:
+                return
+            missing = max(self.minconn - self._size, 0)
+            self._size += missing
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self._new_conn())  # Outside the lock, like getconn
+        finally:
+            with self._cond:
+                self._size -= missing - len(opened)
+                self._idle.extend((conn, time.monotonic()) for conn in opened)
+                self._prefilled = len(opened) == missing
+                self._cond.notify_all()
+
+    def getconn(self):
+        deadline = None
+        waited_since = None
+        while True:
+            conn = None
+            with self._cond:
+                self._check_fork()
+                if self._closed:
+                    raise psycopg2.InterfaceError("Connection pool is closed")
+                while True:
+                    if self._idle:
+                        conn, returned_at = self._idle.pop()
+                        self._in_use.add(conn)  # Reserved while it is checked below
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    # Pool exhausted: wait for a connection to be returned
+                    now = time.monotonic()
+                    if waited_since is None:
+                        waited_since = now
+                        deadline = now + self.timeout
+                        self._metrics["waits"] += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        self._metrics["wait_time"] += now - waited_since
+                        raise PoolTimeout("Timed out after %.1fs waiting for a database connection" % self.timeout)
+                    self._cond.wait(remaining)
+            if conn is not None:
+                # Ping outside the lock: a dead socket can take up to the connect timeout
+                if self._healthy(conn, returned_at):
+                    with self._cond:
+                        return self._checkout(conn, waited_since)
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._discard(conn)
+                    self._cond.notify()
+                continue
+            # Open the new connection outside the lock so slow handshakes don't block other threads
+            try:
+                conn = self._new_conn()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                return self._checkout(conn, waited_since)
+
+    def _checkout(self, conn, waited_since):
+        self._in_use.add(conn)
+        self._metrics["checkouts"] += 1
+        if waited_since is not None:
+            self._metrics["wait_time"] += time.monotonic() - waited_since
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            if conn not in self._in_use:
+                # Stale connection from before a fork, or returned twice
+                return
+            self._in_use.discard(conn)  # Still counted in _size while it is reset below
+        # Roll back outside the lock, like the ping in getconn: a slow connection stalls only its owner
+        reusable = not discard and self._reset(conn)
+        with self._cond:
+            if not reusable or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _reset(self, conn):
+        # Leave the connection as a fresh one would be: no open or aborted transaction
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            return False
+        return True
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._check_fork()
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            self._check_fork()
+            stats = dict(self._metrics)
+            stats["wait_time"] = round(stats["wait_time"], 6)
+            stats.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "pid": self._pid,
+            })
+            return stats
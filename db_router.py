@@ -0,0 +1,169 @@
+import itertools
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+from db_config import DB_REPLICAS, DB_SETTINGS, POOL_CHECK_IDLE, POOL_MAX, POOL_TIMEOUT, get_pool
+from db_pool import ConnectionPool, PoolTimeout
+from logs import get_logger
+from metrics import InstrumentedConnection
+
+# Read/write routing: read-only routes go to a healthy replica (round-robin), everything else to
+# the primary. A background thread per worker tracks each replica's health, lag and replayed WAL
+# position; a session that has written reads from the primary until a replica has replayed its
+# last write (read-your-writes).
+MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))  # Seconds; lagging replicas get no reads
+CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '2'))
+
+log = get_logger('db_router')
+
+
+def parse_lsn(lsn):
+    # '16/B374D848' -> int, so WAL positions compare numerically
+    if not lsn:
+        return None
+    high, _, low = lsn.partition('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Replica:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        params = parse_dsn(dsn)
+        # For logs and /admin/db_pool; never includes the password
+        self.name = f"{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+        self.pool = ConnectionPool(self.connect, minconn=0, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                                   check_idle=POOL_CHECK_IDLE)
+        self.healthy = False  # Until the first check passes
+        self.lag = None
+        self.replay_lsn = None
+        self.checked_at = None
+        self.reads = 0
+        self.errors = 0
+
+    def connect(self):
+        return psycopg2.connect(self.dsn, connect_timeout=DB_SETTINGS['connect_timeout'],
+                                connection_factory=InstrumentedConnection)
+
+    def check(self):
+        try:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                # Not in recovery means a plain server (e.g. a stub DSN in testing): no lag
+                cur.execute("""
+                    SELECT pg_is_in_recovery(),
+                           COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn())::text,
+                           CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                                THEN 0
+                                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END;
+                """)
+                _, replay_lsn, lag = cur.fetchone()
+                cur.close()
+                conn.rollback()
+            self.replay_lsn = parse_lsn(replay_lsn)
+            self.lag = float(lag) if lag is not None else None
+            self.healthy = self.lag is not None and self.lag <= MAX_LAG
+        except Exception as e:
+            if self.healthy:
+                log.warning("Replica failed its health check", extra={"replica": self.name, "error": str(e)})
+            self.errors += 1
+            self.healthy = False
+        self.checked_at = time.time()
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "checked_at": self.checked_at,
+            "reads": self.reads,
+            "errors": self.errors,
+            "pool": self.pool.stats(),
+        }
+
+
+class ReplicaRouter:
+    def __init__(self, dsns):
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.primary_reads = 0
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    def start(self):
+        # Idempotent per process, like the cache bus
+        if not self.replicas or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='replica-health', daemon=True).start()
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check()
+
+    def _run(self):
+        # Replicas get no reads until their first check passes (the primary serves them meanwhile)
+        while True:
+            self.check()
+            time.sleep(CHECK_INTERVAL)
+
+    def choose(self, min_lsn=None):
+        # A healthy replica that has replayed min_lsn (round-robin), or None for the primary
+        candidates = [r for r in self.replicas
+                      if r.healthy and (min_lsn is None or (r.replay_lsn or 0) >= min_lsn)]
+        if not candidates:
+            self.primary_reads += 1
+            return None
+        replica = candidates[next(self._next) % len(candidates)]
+        replica.reads += 1
+        return replica
+
+    def getconn(self, min_lsn=None):
+        # (pool, conn) for a read-only query; the caller returns conn to that pool
+        replica = self.choose(min_lsn)
+        if replica is not None:
+            try:
+                return replica.pool, replica.pool.getconn()
+            except PoolTimeout:
+                pass  # Busy, not down
+            except psycopg2.OperationalError:
+                # Unreachable: no more reads until the next health check passes
+                replica.healthy = False
+                replica.errors += 1
+            self.primary_reads += 1
+        pool = get_pool()
+        return pool, pool.getconn()
+
+    def read_pool(self, min_lsn=None):
+        # For code that manages its own connections (e.g. exports streaming on another thread)
+        replica = self.choose(min_lsn)
+        return replica.pool if replica is not None else get_pool()
+
+    def current_lsn(self, conn):
+        # Primary's WAL position after a write, for read-your-writes
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_current_wal_lsn()::text;")
+            return parse_lsn(cur.fetchone()[0])
+        finally:
+            cur.close()
+            conn.rollback()
+
+    def stats(self):
+        return {
+            "max_lag": MAX_LAG,
+            "primary_reads": self.primary_reads,
+            "replicas": {replica.name: replica.stats() for replica in self.replicas},
+        }
+
+
+router = ReplicaRouter(DB_REPLICAS)
@@ -0,0 +1,127 @@
+"""Eligible-donor index for shortage outreach.
+
+donor_eligibility has one row per donor (role Donor with a blood group): region, blood group and
+the date of their last Completed donation, '-infinity' if they never gave (a Pending booking
+doesn't count, so it doesn't take the donor off the outreach list). Statement-level triggers on users
+and donations keep it current, so nothing joins users against donations per query. Indexed on
+(region, blood_group, last_donation, donor_id), the donors who may give again (last donation on or
+before today - DONATION_INTERVAL_DAYS) are one contiguous range per region and group, longest-rested
+first; a page is a LIMITed scan of each compatible group's range, merged.
+
+Set up once (creates the table, index and triggers and fills it from users/donations). That is
+migrations 0005 and 0006 (which hold the schema), so this applies the pending migrations, like
+`python migrate.py up`:
+    python donor_eligibility.py init
+Refill from scratch (e.g. after the triggers were disabled for a bulk load):
+    python donor_eligibility.py rebuild
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+import migrate
+from allocation import DONORS_FOR
+from db_config import get_db_connection
+
+# Minimum days between (whole blood) donations
+DONATION_INTERVAL_DAYS = int(os.environ.get('DONATION_INTERVAL_DAYS', '56'))
+
+# One region and donor group's eligible range, in index order; the page is these merged
+GROUP_PAGE_SQL = """
+    (SELECT donor_id, region, blood_group, last_donation FROM donor_eligibility
+     WHERE region = %s AND blood_group = %s AND last_donation <= %s{after}
+     ORDER BY last_donation, donor_id LIMIT %s)
+"""
+
+
+def rebuild(cur):
+    # Refills donor_eligibility from users and donations; returns the number of donors
+    cur.execute("LOCK TABLE donor_eligibility IN EXCLUSIVE MODE;")
+    cur.execute("DELETE FROM donor_eligibility;")
+    cur.execute("""
+        INSERT INTO donor_eligibility (donor_id, region, blood_group, last_donation)
+        SELECT u.user_id, u.region, u.blood_group, COALESCE(d.last_donation, '-infinity')
+        FROM users u
+        LEFT JOIN (SELECT donor_id, MAX(date) AS last_donation FROM donations
+                   WHERE status = 'Completed' GROUP BY donor_id) d
+            ON d.donor_id = u.user_id
+        WHERE u.role = 'Donor' AND u.blood_group IS NOT NULL;
+    """)
+    return cur.rowcount
+
+
+def eligible_since(today=None):
+    # Latest last-donation date that allows another donation today
+    return (today or date.today()) - timedelta(days=DONATION_INTERVAL_DAYS)
+
+
+def parse_cursor(after):
+    # after=<last donation date>,<donor_id> as returned in next_after (empty date: never donated)
+    try:
+        after_date, after_id = after.split(',')
+        return date.fromisoformat(after_date) if after_date else '-infinity', int(after_id)
+    except ValueError:
+        raise ValueError("after must look like YYYY-MM-DD,<donor_id>")
+
+
+def eligible_donors(cur, blood_group, regions, limit, cursor=None, count=False):
+    # Donors in `regions` whose blood can go to a `blood_group` recipient and who may donate again,
+    # longest-rested first (never donated first of all). Keyset-paged like the admin lists.
+    groups = DONORS_FOR[blood_group]
+    cutoff = eligible_since()
+    after = " AND (last_donation, donor_id) > (%s, %s)" if cursor else ""
+    parts, params = [], []
+    for region in regions:
+        for group in groups:
+            parts.append(GROUP_PAGE_SQL.format(after=after))
+            params.extend([region, group, cutoff] + (list(cursor) if cursor else []) + [limit + 1])
+    cur.execute(f"""
+        SELECT e.donor_id, u.name, u.email, u.contact_no, e.blood_group, e.region,
+               NULLIF(e.last_donation, '-infinity')::text
+        FROM (SELECT * FROM ({' UNION ALL '.join(parts)}) g ORDER BY last_donation, donor_id LIMIT %s) e
+        JOIN users u ON u.user_id = e.donor_id AND u.region = e.region
+        ORDER BY e.last_donation, e.donor_id;
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    total = None
+    if count:
+        cur.execute("""
+            SELECT COUNT(*) FROM donor_eligibility
+            WHERE region = ANY(%s) AND blood_group = ANY(%s) AND last_donation <= %s;
+        """, (list(regions), groups, cutoff))
+        total = cur.fetchone()[0]
+    return {
+        "blood_group": blood_group,
+        "donor_groups": groups,
+        "eligible_since": str(cutoff),
+        "items": [{"donor_id": r[0], "name": r[1], "email": r[2], "contact_no": r[3], "blood_group": r[4],
+                   "region": r[5], "last_donation": r[6]} for r in rows],
+        "next_after": f"{rows[-1][6] or ''},{rows[-1][0]}" if has_more else None,
+        "total": total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['init', 'rebuild'])
+    args = parser.parse_args()
+    conn = get_db_connection()
+    try:
+        if args.command == 'init':
+            applied = migrate.upgrade(conn)
+            print("donor_eligibility ready" + (f" (applied {', '.join(applied)})" if applied else ""))
+        else:
+            cur = conn.cursor()
+            print(f"Indexed {rebuild(cur)} donors")
+            conn.commit()
+    except migrate.MigrationError as e:
+        sys.exit(f"Migration failed: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import json
+import os
+import queue
+import threading
+
+from cache_bus import bus
+
+# Live change feed for the dashboards (served as Server-Sent Events at /events).
+# Events go out over Postgres NOTIFY so SSE clients on every gunicorn worker see them.
+CHANNEL = 'app_events'
+SUBSCRIBER_QUEUE_SIZE = 1000
+MAX_PAYLOAD = 7900  # Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFIES = 20  # Larger changes are announced as a single 'resync' instead
+# Open streams per worker. Under gthread each one holds a worker thread for as long as it is
+# open, so keep this well below --threads or the dashboards starve every other request.
+MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', '8'))
+
+_subscribers = set()
+_lock = threading.Lock()
+
+
+def publish(events, cur=None):
+    # events: list of {"type": ..., "data": {...}}, sent in as few NOTIFYs as fit the payload limit.
+    # With cur, call it before the write commits; clients hear about it once it has.
+    for payload in payloads(events):
+        if not (bus.running and bus.notify(CHANNEL, payload, cur)):
+            _dispatch(payload)  # Bus disabled or down: at least this worker's clients hear about it
+
+
+def payloads(events):
+    if not events:
+        return []
+    encoded = _payloads(events)
+    if len(encoded) > MAX_NOTIFIES:
+        return [json.dumps([{"type": "resync", "data": {}}])]  # Cheaper for clients to reload
+    return encoded
+
+
+def _payloads(events):
+    payloads = []
+    batch = []
+    size = 2
+    for event in events:
+        encoded = json.dumps(event, default=str)
+        if batch and size + len(encoded) + 1 > MAX_PAYLOAD:
+            payloads.append(f"[{','.join(batch)}]")
+            batch = []
+            size = 2
+        batch.append(encoded)
+        size += len(encoded) + 1
+    payloads.append(f"[{','.join(batch)}]")
+    return payloads
+
+
+def publish_event(event_type, data, cur=None):
+    publish([{"type": event_type, "data": data}], cur)
+
+
+def _dispatch(payload):
+    events = json.loads(payload)
+    with _lock:
+        subscribers = list(_subscribers)
+    for q in subscribers:
+        try:
+            q.put_nowait(events)
+        except queue.Full:
+            # Client too slow; tell it to reload instead of buffering forever
+            unsubscribe(q)
+            with q.mutex:
+                q.queue.clear()
+            q.put_nowait([{"type": "resync", "data": {}}])
+
+
+def subscribe():
+    # None when this worker already streams to MAX_SUBSCRIBERS clients
+    q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    with _lock:
+        if len(_subscribers) >= MAX_SUBSCRIBERS:
+            return None
+        _subscribers.add(q)
+    return q
+
+
+def unsubscribe(q):
+    with _lock:
+        _subscribers.discard(q)
+
+
+def subscriber_count():
+    with _lock:
+        return len(_subscribers)
+
+
+bus.listen(CHANNEL, _dispatch)
@@ -0,0 +1,170 @@
+"""Bulk exports for audit reports: CSV straight from COPY ... TO STDOUT, or Parquet (needs pyarrow).
+
+Rows never pass through per-row Python dicts: CSV bytes go from Postgres to the HTTP response as
+COPY produces them, Parquet is built from column batches fetched with a server-side cursor.
+
+A CSV response has already started (status 200) when its COPY can still fail. If it fails midway,
+the last line of the body is ERROR_MARKER and the reason, and the connection is then dropped
+without finishing the transfer. A complete export never ends with that line.
+"""
+import queue
+import tempfile
+import threading
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: only needed for format=parquet
+    pa = pq = None
+
+# Exportable tables: columns (in output order) and the date column used by ?from=&to=
+EXPORTS = {
+    'transactions': {
+        'columns': ['transaction_id', 'date', 'units_allocated', 'method', 'request_id', 'donation_id'],
+        'order': 'date, transaction_id',
+    },
+    'donations': {
+        'columns': ['donation_id', 'date', 'quantity', 'status', 'donor_id'],
+        'order': 'date, donation_id',
+    },
+    'requests': {
+        'columns': ['request_id', 'date', 'required_units', 'status', 'recipient_id', 'recipient_region',
+                    'request_type', 'blood_group'],
+        'order': 'date, request_id',
+    },
+}
+# Postgres type OID -> Arrow type name for Parquet columns (anything else is written as a string)
+ARROW_TYPES = {20: 'int64', 21: 'int16', 23: 'int32', 700: 'float32', 701: 'float64', 1082: 'date32',
+               1114: 'timestamp', 16: 'bool'}
+CHUNK_QUEUE_SIZE = 64  # COPY chunks buffered between the DB thread and the response
+CHUNK_PUT_TIMEOUT = 1  # Seconds between checks for a cancelled export while the queue is full
+ERROR_MARKER = '#EXPORT FAILED:'
+PARQUET_BATCH_ROWS = 50000
+
+
+class ExportError(ValueError):
+    pass
+
+
+def export_spec(table):
+    spec = EXPORTS.get(table)
+    if spec is None:
+        raise ExportError(f"Unknown export '{table}' (expected one of: {', '.join(EXPORTS)})")
+    return spec
+
+
+def build_query(cur, table, date_from=None, date_to=None):
+    spec = export_spec(table)
+    query = f"SELECT {', '.join(spec['columns'])} FROM {table} WHERE 1=1"
+    params = []
+    if date_from:
+        query += " AND date >= %s"
+        params.append(date_from)
+    if date_to:
+        query += " AND date <= %s"  # Inclusive, like the report's month range
+        params.append(date_to)
+    query += f" ORDER BY {spec['order']}"
+    return cur.mogrify(query, params).decode('utf-8')
+
+
+class _QueueWriter:
+    # File-like target for copy_expert that hands chunks to the response generator
+    def __init__(self):
+        self.chunks = queue.Queue(maxsize=CHUNK_QUEUE_SIZE)
+        self.cancelled = threading.Event()
+
+    def write(self, data):
+        if not self.put(data):
+            raise IOError("Export cancelled by client")  # Aborts the COPY
+        return len(data)
+
+    def put(self, item):
+        # False once the response has gone away, instead of blocking on a queue nobody reads
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=CHUNK_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+def stream_csv(pool, table, date_from=None, date_to=None):
+    # Returns a generator of CSV chunks (with header); the COPY runs on its own thread so the
+    # response can start sending while Postgres is still producing rows. The connection and the
+    # thread are only taken on the first next(), so an unsent response holds neither.
+    export_spec(table)  # An unknown table is a 400 before any response starts
+    writer = _QueueWriter()
+    done = object()
+
+    def copy(conn, cur, query):
+        try:
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", writer)
+            writer.put(done)
+        except Exception as e:
+            writer.put(e)
+        finally:
+            cur.close()
+            pool.putconn(conn)
+
+    def generate():
+        conn = pool.getconn()
+        try:
+            cur = conn.cursor()
+            query = build_query(cur, table, date_from, date_to)
+        except Exception:
+            pool.putconn(conn)
+            raise
+        threading.Thread(target=copy, args=(conn, cur, query), name=f'export-{table}', daemon=True).start()
+        sent = False
+        try:
+            while True:
+                chunk = writer.chunks.get()
+                if chunk is done:
+                    return
+                if isinstance(chunk, Exception):
+                    if sent:
+                        yield f"\n{ERROR_MARKER} {' '.join(str(chunk).split())}\n".encode('utf-8')
+                    raise chunk
+                sent = True
+                yield chunk
+        finally:
+            writer.cancelled.set()
+            # Unblock the COPY thread if it's waiting on a full queue
+            while not writer.chunks.empty():
+                writer.chunks.get_nowait()
+
+    return generate()
+
+
+def _arrow_type(oid):
+    name = ARROW_TYPES.get(oid, 'string')
+    if name == 'timestamp':
+        return pa.timestamp('us')
+    return getattr(pa, name)()
+
+
+def write_parquet(pool, table, date_from=None, date_to=None):
+    # Returns a temporary file holding the Parquet export (caller streams and closes it)
+    if pq is None:
+        raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+    out = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+    with pool.connection() as conn:
+        query = build_query(conn.cursor(), table, date_from, date_to)
+        cur = conn.cursor(name=f'parquet_{table}')
+        cur.itersize = PARQUET_BATCH_ROWS
+        try:
+            cur.execute(query)
+            rows = cur.fetchmany(PARQUET_BATCH_ROWS)
+            schema = pa.schema([(col.name, _arrow_type(col.type_code)) for col in cur.description])
+            with pq.ParquetWriter(out, schema) as writer:
+                while rows:
+                    # Column-wise conversion, one Arrow array per column per batch
+                    arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                    writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                    rows = cur.fetchmany(PARQUET_BATCH_ROWS)
+        finally:
+            cur.close()
+            conn.rollback()
+    out.seek(0)
+    return out
@@ -0,0 +1,277 @@
+"""Demand/supply forecasting per blood type and region, and the dynamic low-stock thresholds.
+
+Units requested (all_requests) and units collected (Completed donations, by the donor's blood
+group and region) per day over the last 2 * FORECAST_WINDOW_DAYS full days come from two grouped
+queries as (blood type, region, day, units) index rows, and are laid out as NumPy arrays of shape
+(blood types, regions, days). Rolling rates are differences of cumulative sums, so the work is a
+few array operations however long the history. Stock is national, so per blood type:
+    reorder_threshold = ceil(rate * lead + z * std * sqrt(lead))
+expected demand over FORECAST_LEAD_DAYS plus safety stock for its day-to-day variation; a type is
+low on stock below it. Types without demand in the window keep the fixed LOW_STOCK_UNITS.
+
+forecast_job runs in a background thread every FORECAST_INTERVAL seconds in each worker. The
+snapshot is shared through the forecast_snapshot table (migration 0007): a worker recomputes it
+only when the stored one is older than FORECAST_INTERVAL and it holds the advisory lock, so one
+worker computes per interval and the others load its result. Requests only read the loaded snapshot
+and never compute one. Until a worker has loaded one (and with FORECAST_INTERVAL=0, always) every
+type keeps LOW_STOCK_UNITS.
+Print the current forecast:
+    python forecast.py
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+
+import numpy as np
+
+from allocation import BLOOD_GROUPS
+from db_config import get_db_connection, get_pool
+from db_router import router
+from logs import get_logger
+from regions import REGIONS
+
+FORECAST_WINDOW_DAYS = int(os.environ.get('FORECAST_WINDOW_DAYS', '28'))  # Rolling-rate window
+FORECAST_LEAD_DAYS = float(os.environ.get('FORECAST_LEAD_DAYS', '3'))  # Days to restock a type
+FORECAST_SERVICE_Z = float(os.environ.get('FORECAST_SERVICE_Z', '1.65'))  # ~95% of lead times covered
+FORECAST_INTERVAL = float(os.environ.get('FORECAST_INTERVAL', '300'))  # Seconds between recomputes; 0 disables
+LOW_STOCK_UNITS = 10  # Threshold without demand history (the old fixed rule)
+FORECAST_LOCK_ID = zlib.crc32(b'forecast')  # pg_try_advisory_xact_lock key
+
+if FORECAST_WINDOW_DAYS < 2:
+    # The safety stock uses the sample standard deviation of the window's daily demand
+    raise ValueError(f"FORECAST_WINDOW_DAYS must be at least 2, not {FORECAST_WINDOW_DAYS}")
+
+log = get_logger('forecast')
+
+# Index rows: blood type and region positions in BLOOD_GROUPS/REGIONS, day offset from start
+DEMAND_SQL = """
+    SELECT array_position(%(groups)s::text[], blood_group::text) - 1,
+           array_position(%(regions)s::text[], recipient_region::text) - 1,
+           date - %(start)s::date, SUM(required_units)
+    FROM all_requests
+    WHERE date >= %(start)s AND date < %(end)s
+      AND blood_group = ANY(%(groups)s) AND recipient_region = ANY(%(regions)s)
+    GROUP BY 1, 2, 3;
+"""
+SUPPLY_SQL = """
+    SELECT array_position(%(groups)s::text[], u.blood_group::text) - 1,
+           array_position(%(regions)s::text[], u.region::text) - 1,
+           d.date - %(start)s::date, SUM(d.quantity)
+    FROM donations d JOIN all_users u ON u.user_id = d.donor_id
+    WHERE d.status = 'Completed' AND d.date >= %(start)s AND d.date < %(end)s
+      AND u.blood_group = ANY(%(groups)s) AND u.region = ANY(%(regions)s)
+    GROUP BY 1, 2, 3;
+"""
+
+
+# The stored snapshot and whether it is younger than the given number of seconds
+LOAD_SNAPSHOT_SQL = """
+    SELECT snapshot, computed_at > CURRENT_TIMESTAMP - make_interval(secs => %s) FROM forecast_snapshot;
+"""
+STORE_SNAPSHOT_SQL = """
+    INSERT INTO forecast_snapshot (id, snapshot, computed_at) VALUES (1, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (id) DO UPDATE SET snapshot = EXCLUDED.snapshot, computed_at = EXCLUDED.computed_at;
+"""
+
+
+def daily_units(cur, query, start, days):
+    # (blood type, region, day) array of units from one of the index-row queries
+    cur.execute(query, {"groups": BLOOD_GROUPS, "regions": REGIONS, "start": start,
+                        "end": start + timedelta(days=days)})
+    rows = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 4)
+    daily = np.zeros((len(BLOOD_GROUPS), len(REGIONS), days))
+    np.add.at(daily, (rows[:, 0], rows[:, 1], rows[:, 2]), rows[:, 3])
+    return daily
+
+
+def rolling_mean(daily, window):
+    # Trailing `window`-day means along the last axis, one per day from the window-th on
+    totals = np.cumsum(daily, axis=-1)
+    totals = np.concatenate([np.zeros(daily.shape[:-1] + (1,)), totals], axis=-1)
+    return (totals[..., window:] - totals[..., :-window]) / window
+
+
+def compute(cur, today=None):
+    # Forecast snapshot from the last two windows of full days (today is still partial)
+    window = FORECAST_WINDOW_DAYS
+    end = today or date.today()
+    start = end - timedelta(days=2 * window)
+    demand = daily_units(cur, DEMAND_SQL, start, 2 * window)
+    supply = daily_units(cur, SUPPLY_SQL, start, 2 * window)
+
+    demand_rates = rolling_mean(demand, window)  # (blood types, regions, window + 1)
+    supply_rates = rolling_mean(supply, window)
+    rate = demand_rates[:, :, -1].sum(axis=1)
+    previous_rate = demand_rates[:, :, 0].sum(axis=1)  # The window before
+    std = demand[:, :, -window:].sum(axis=1).std(axis=-1, ddof=1)
+    threshold = np.ceil(rate * FORECAST_LEAD_DAYS + FORECAST_SERVICE_Z * std * math.sqrt(FORECAST_LEAD_DAYS))
+    threshold = np.where(rate > 0, np.maximum(threshold, 1), LOW_STOCK_UNITS).astype(int)
+    trend = np.divide(rate - previous_rate, previous_rate, out=np.full_like(rate, np.nan),
+                      where=previous_rate > 0)
+
+    regional_demand = np.round(demand_rates[:, :, -1], 3).tolist()
+    regional_supply = np.round(supply_rates[:, :, -1], 3).tolist()
+    return {
+        "generated_at": time.time(),
+        "from": str(start),
+        "to": str(end - timedelta(days=1)),
+        "window_days": window,
+        "lead_days": FORECAST_LEAD_DAYS,
+        "service_z": FORECAST_SERVICE_Z,
+        "blood_types": {
+            blood_type: {
+                "demand_rate": round(float(rate[i]), 3),
+                "supply_rate": round(float(supply_rates[i, :, -1].sum()), 3),
+                "demand_std": round(float(std[i]), 3),
+                "trend": None if np.isnan(trend[i]) else round(float(trend[i]), 3),
+                "reorder_threshold": int(threshold[i]),
+                "regions": {region: {"demand_rate": regional_demand[i][j], "supply_rate": regional_supply[i][j]}
+                            for j, region in enumerate(REGIONS)},
+            }
+            for i, blood_type in enumerate(BLOOD_GROUPS)
+        },
+    }
+
+
+def with_stock(snapshot, stock):
+    # Snapshot plus current units, days of supply and low flags; stock: {blood_type: units}
+    blood_types = list(snapshot["blood_types"])
+    units = np.array([stock.get(blood_type, 0) for blood_type in blood_types], dtype=float)
+    rate = np.array([snapshot["blood_types"][blood_type]["demand_rate"] for blood_type in blood_types])
+    days_of_supply = np.divide(units, rate, out=np.full_like(units, np.inf), where=rate > 0)
+    items = []
+    for i, blood_type in enumerate(blood_types):
+        forecast = snapshot["blood_types"][blood_type]
+        items.append(dict({"blood_type": blood_type, "units": int(units[i])}, **forecast,
+                          net_rate=round(forecast["supply_rate"] - forecast["demand_rate"], 3),
+                          days_of_supply=None if np.isinf(days_of_supply[i]) else round(float(days_of_supply[i]), 1),
+                          low=bool(units[i] < forecast["reorder_threshold"])))
+    result = {key: value for key, value in snapshot.items() if key != "blood_types"}
+    result["blood_types"] = items
+    result["low_stock"] = sum(item["low"] for item in items)
+    return result
+
+
+class ForecastJob:
+    # Background refresh per worker process, started lazily like the expiry sweep; an advisory
+    # lock and the stored snapshot's age keep it to one computation per interval across workers
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+        self._pid = None
+        self._snapshot = None
+        self.on_refresh = None  # Callback(snapshot) after loading one that changed a threshold
+        self.runs = 0
+        self.computed = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_duration = None
+
+    def start(self):
+        if FORECAST_INTERVAL <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='forecast', daemon=True).start()
+
+    def _compute(self):
+        # The history is read from a replica when there is one
+        with router.read_pool().connection() as conn:
+            cur = conn.cursor()
+            try:
+                return compute(cur)
+            finally:
+                cur.close()
+                conn.rollback()
+
+    def run_once(self):
+        # Loads the stored snapshot, recomputing and storing it first when it is due and no other
+        # worker is at it. Returns the snapshot, None while none has been stored yet.
+        with self._compute_lock:
+            started = time.perf_counter()
+            with get_pool().connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (FORECAST_LOCK_ID,))
+                    locked = cur.fetchone()[0]
+                    cur.execute(LOAD_SNAPSHOT_SQL, (FORECAST_INTERVAL,))
+                    stored = cur.fetchone()
+                    snapshot = stored[0] if stored else None
+                    if locked and not (stored and stored[1]):
+                        snapshot = self._compute()
+                        cur.execute(STORE_SNAPSHOT_SQL, (json.dumps(snapshot),))
+                        self.computed += 1
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cur.close()
+            previous = self.thresholds()
+            if snapshot is not None:
+                self._snapshot = snapshot
+            self.runs += 1
+            self.last_run = time.time()
+            self.last_duration = time.perf_counter() - started
+        if snapshot is not None and previous != self.thresholds(snapshot) and self.on_refresh is not None:
+            self.on_refresh(snapshot)
+        return snapshot
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                log.warning("Forecast failed", extra={"error": str(e)})
+            time.sleep(FORECAST_INTERVAL)
+
+    def latest(self):
+        # The loaded snapshot, None until a background run has loaded one
+        return self._snapshot
+
+    def thresholds(self, snapshot=None):
+        # ([blood type], [reorder threshold]) for the low-stock count in SQL, from the latest
+        # snapshot by default; LOW_STOCK_UNITS for every type while there is none
+        snapshot = snapshot or self._snapshot
+        if snapshot is None:
+            return list(BLOOD_GROUPS), [LOW_STOCK_UNITS] * len(BLOOD_GROUPS)
+        blood_types = snapshot["blood_types"]
+        return list(blood_types), [forecast["reorder_threshold"] for forecast in blood_types.values()]
+
+    def stats(self):
+        return {
+            "interval": FORECAST_INTERVAL,
+            "runs": self.runs,
+            "computed": self.computed,
+            "errors": self.errors,
+            "last_run": self.last_run,
+            "last_duration_ms": None if self.last_duration is None else round(self.last_duration * 1000, 3),
+        }
+
+
+forecast_job = ForecastJob()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        snapshot = compute(cur)
+        cur.execute("SELECT blood_type, units FROM inventory_replica;")
+        print(json.dumps(with_stock(snapshot, dict(cur.fetchall())), indent=2))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import random
+import time
+
+from psycopg2 import errors
+from psycopg2.extras import execute_values
+
+from blood_units import allocate_units, lock_stock
+from metrics import lock_wait
+
+# Errors that mean "another transaction got in the way", safe to retry from scratch
+RETRYABLE_ERRORS = (errors.SerializationFailure, errors.DeadlockDetected)
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.02  # Seconds, doubled per attempt (with jitter)
+
+
+# Shared with the async twins in aio.py
+LOCK_REQUEST_SQL = """
+    SELECT blood_group, required_units, status, recipient_id FROM requests
+    WHERE request_id = %s FOR UPDATE;
+"""
+MARK_FULFILLED_SQL = "UPDATE requests SET status = 'Fulfilled' WHERE request_id = %s;"
+
+
+class FulfillmentError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def run_in_transaction(conn, work, retries=MAX_RETRIES):
+    # Runs work(cur) and commits; rolls back on error and retries on serialization failures/deadlocks
+    for attempt in range(retries + 1):
+        cur = conn.cursor()
+        try:
+            result = work(cur)
+            conn.commit()
+            return result
+        except RETRYABLE_ERRORS:
+            conn.rollback()
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def units_for(allocated_units, required_units):
+    # Units to take for a request: all it asked for unless the admin allocates part of it
+    if not allocated_units:
+        return required_units
+    if not isinstance(allocated_units, int) or isinstance(allocated_units, bool) \
+            or not 0 < allocated_units <= required_units:
+        raise FulfillmentError(f"allocated_units must be an integer from 1 to {required_units}")
+    return allocated_units
+
+
+def fulfill_request(cur, request_id, allocated_units=0):
+    # Lock order is always: request row, then inventory row. Only these two rows are locked,
+    # so fulfillments for other requests/blood types run in parallel.
+    with lock_wait('request'):
+        cur.execute(LOCK_REQUEST_SQL, (request_id,))
+    req = cur.fetchone()
+    if not req:
+        raise FulfillmentError("Request not found", 404)
+    blood_group, required_units, status, recipient_id = req
+    if status != 'Pending':
+        raise FulfillmentError(f"Request {request_id} is already {status}", 409)
+
+    units_to_deduct = units_for(allocated_units, required_units)
+    remaining = deduct_stock(cur, blood_group, units_to_deduct, request_id)
+
+    cur.execute(MARK_FULFILLED_SQL, (request_id,))
+    return {"request_id": request_id, "recipient_id": recipient_id, "blood_group": blood_group,
+            "units": units_to_deduct, "remaining": remaining}
+
+
+def deduct_stock(cur, blood_type, units, request_id=None):
+    # Takes the first-expiring units; the locked inventory_master row makes check + take atomic
+    available = lock_stock(cur, [blood_type]).get(blood_type, 0)
+    if available < units:
+        raise FulfillmentError("Insufficient stock")
+    allocate_units(cur, [(request_id, blood_type, units)])
+    return available - units
+
+
+MAX_BATCH_SIZE = 500
+
+
+def fulfill_batch(cur, request_ids=None, blood_group=None, region=None, method='Batch Allocation',
+                  limit=MAX_BATCH_SIZE):
+    # Allocates stock to many requests in the caller's transaction.
+    # Priority: Emergency requests first, then oldest date, then lowest request_id.
+    # Each request is all-or-nothing; one that doesn't fit is skipped and later ones still get a chance.
+    # Returns (results, units deducted per type, units left per type, truncated): with filters, at
+    # most `limit` of the matching requests are taken, the first in priority order, and truncated
+    # says whether more were left pending.
+    truncated = False
+    by_filter = request_ids is None
+    if by_filter:
+        # Pick the candidates by priority first, so urgent requests beyond the first `limit` by
+        # age still get in; they are locked below in request_id order like everywhere else
+        query = """
+            SELECT request_id FROM requests
+            WHERE status = 'Pending'
+        """
+        params = []
+        if blood_group:
+            query += " AND blood_group = %s"
+            params.append(blood_group)
+        if region:
+            query += " AND recipient_region = %s"
+            params.append(region)
+        query += " ORDER BY (request_type <> 'Emergency'), date, request_id LIMIT %s;"
+        params.append(limit + 1)
+        cur.execute(query, params)
+        request_ids = [row[0] for row in cur.fetchall()]
+        truncated = len(request_ids) > limit
+        request_ids = request_ids[:limit]
+    with lock_wait('request'):
+        cur.execute("""
+            SELECT request_id, date, required_units, status, request_type, blood_group, recipient_id FROM requests
+            WHERE request_id = ANY(%s) ORDER BY request_id FOR UPDATE;
+        """, (list(request_ids),))
+    rows = cur.fetchall()  # Locked in request_id order, same as fulfill_request
+
+    results = {}
+    if by_filter:
+        rows = [row for row in rows if row[3] == 'Pending']  # Taken by someone else since it was picked
+    else:
+        found = {row[0] for row in rows}
+        for request_id in request_ids:
+            if request_id not in found:
+                results[request_id] = {"request_id": request_id, "status": "skipped", "reason": "Request not found"}
+    # Without a blood group there is no stock to match (blood_group is nullable)
+    for row in rows:
+        if row[3] == 'Pending' and row[5] is None:
+            results[row[0]] = {"request_id": row[0], "status": "skipped", "reason": "Request has no blood group"}
+    rows = [row for row in rows if row[3] != 'Pending' or row[5] is not None]
+
+    # Lock the inventory rows involved, always in blood_type order
+    stock = lock_stock(cur, {row[5] for row in rows if row[3] == 'Pending'})
+
+    pending = [row for row in rows if row[3] == 'Pending']
+    pending.sort(key=lambda row: (row[4] != 'Emergency', row[1] is None, row[1] or 0, row[0]))
+    fulfilled = []
+    deducted = {}
+    for request_id, _, required_units, _, _, group, recipient_id in pending:
+        if stock.get(group, 0) >= required_units:
+            stock[group] -= required_units
+            deducted[group] = deducted.get(group, 0) + required_units
+            fulfilled.append((request_id, group, required_units))
+            results[request_id] = {"request_id": request_id, "status": "fulfilled", "blood_group": group,
+                                   "units": required_units, "recipient_id": recipient_id}
+        else:
+            results[request_id] = {"request_id": request_id, "status": "skipped",
+                                   "blood_group": group, "reason": "Insufficient stock"}
+    for request_id, _, _, status, _, _, _ in rows:
+        if status != 'Pending':
+            results[request_id] = {"request_id": request_id, "status": "skipped",
+                                   "reason": f"Request is already {status}"}
+
+    if fulfilled:
+        allocate_units(cur, fulfilled)  # In priority order, so urgent requests get the oldest bags
+        cur.execute("UPDATE requests SET status = 'Fulfilled' WHERE request_id = ANY(%s);",
+                    ([request_id for request_id, _, _ in fulfilled],))
+        execute_values(cur, """
+            INSERT INTO transactions (date, units_allocated, method, request_id, donation_id) VALUES %s;
+        """, [(units, method, request_id) for request_id, _, units in fulfilled],
+            template="(CURRENT_DATE, %s, %s, %s, NULL)")
+    remaining = {blood_type: stock[blood_type] for blood_type in deducted}
+    return [results[request_id] for request_id in sorted(results)], deducted, remaining, truncated
@@ -0,0 +1,67 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Structured (JSON lines) logging. Handlers only enqueue records; a listener thread formats them and
+# writes to stdout, so request threads never block on terminal/pipe I/O. Pass fields via `extra`:
+#     log.info("Request created", extra={"request_id": 7})
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _configure():
+    global _listener
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flush what's queued on shutdown
+    os.register_at_fork(after_in_child=_restart_listener)  # e.g. gunicorn --preload workers
+
+    root = logging.getLogger('bloodbank')
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.propagate = False
+
+
+def _restart_listener():
+    # The listener thread doesn't survive fork(); the child needs its own
+    _listener._thread = None
+    _listener.start()
+
+
+def get_logger(name):
+    # Loggers are children of 'bloodbank', e.g. get_logger('app') -> 'bloodbank.app'
+    if _listener is None:
+        _configure()
+    return logging.getLogger(f'bloodbank.{name}')
+
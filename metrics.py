@@ -0,0 +1,197 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2 import extensions
+
+from slow_queries import SLOW_QUERY_MS, slow_log
+
+# Request-level instrumentation, exposed in Prometheus text format at /metrics. Like /admin/db_pool
+# these are per worker process: scrape each worker, or run one worker with threads.
+# Every connection from get_db_connection() hands out timed cursors; while a request is being served
+# their query count, time and rows add up into that request's RequestStats, and statements slower
+# than SLOW_QUERY_MS go to the slow-query log whether or not there is a request.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1  # i == len(buckets) is the +Inf bucket
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            sep = ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            braces = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_count{braces} {cumulative}')
+            lines.append(f'{self.name}_sum{braces} {values[-1]}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_duration = Histogram('bloodbank_request_duration_seconds', 'Request latency, start to last byte sent',
+                             ['method', 'route', 'status'])
+request_db_time = Histogram('bloodbank_request_db_seconds', 'Time per request spent in database calls',
+                            ['method', 'route'])
+request_python_time = Histogram('bloodbank_request_python_seconds',
+                                'Time per request outside database calls', ['method', 'route'])
+request_queries = Histogram('bloodbank_request_queries', 'Queries run per request', ['method', 'route'],
+                            buckets=COUNT_BUCKETS)
+request_rows = Histogram('bloodbank_request_rows', 'Rows returned by queries per request', ['method', 'route'],
+                         buckets=ROW_BUCKETS)
+lock_wait_time = Histogram('bloodbank_lock_wait_seconds', 'Time spent acquiring row locks', ['lock'])
+HISTOGRAMS = [request_duration, request_db_time, request_python_time, request_queries, request_rows, lock_wait_time]
+
+
+class RequestStats:
+    def __init__(self, method, route):
+        self.method = method
+        self.route = route
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0.0
+        self.lock_wait = 0.0
+        self._lock = threading.Lock()  # Region fan-out runs a request's queries on several threads
+
+    def add_query(self, elapsed, rows):
+        with self._lock:
+            self.queries += 1
+            self.rows += rows
+            self.db_time += elapsed
+
+    def finish(self, status):
+        duration = time.perf_counter() - self.started
+        request_duration.observe(duration, self.method, self.route, str(status))
+        request_db_time.observe(self.db_time, self.method, self.route)
+        # Fanned-out queries overlap, so their summed DB time can exceed the wall-clock time
+        request_python_time.observe(max(duration - self.db_time, 0.0), self.method, self.route)
+        request_queries.observe(self.queries, self.method, self.route)
+        request_rows.observe(self.rows, self.method, self.route)
+        return duration
+
+
+def start_request(method, route):
+    stats = RequestStats(method, route)
+    _current.set(stats)
+    return stats
+
+
+def end_request():
+    _current.set(None)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def lock_wait(name):
+    # Times a SELECT ... FOR UPDATE; for a handful of indexed rows that is almost all waiting
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        lock_wait_time.observe(elapsed, name)
+        stats = _current.get()
+        if stats is not None:
+            stats.lock_wait += elapsed
+
+
+class TimedCursorMixin:
+    # For client-side cursors execute() includes fetching the result, so fetch*() needs no timing.
+    # Named (server-side) cursors are timed for the DECLARE only.
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._observe(query, vars, time.perf_counter() - started,
+                          self.rowcount if self.description is not None else 0)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._observe(query, None, time.perf_counter() - started, 0)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._observe(sql, None, time.perf_counter() - started, self.rowcount)
+
+    def _observe(self, query, vars, elapsed, rows):
+        stats = _current.get()
+        if stats is not None:
+            stats.add_query(elapsed, max(rows, 0))
+        if 0 < SLOW_QUERY_MS <= elapsed * 1000:
+            slow_log.record(self, query, vars, elapsed, stats.route if stats is not None else None)
+
+
+_timed_factories = {}
+
+
+def timed_cursor_factory(base):
+    factory = _timed_factories.get(base)
+    if factory is None:
+        factory = _timed_factories[base] = type(f'Timed{base.__name__}', (TimedCursorMixin, base), {})
+    return factory
+
+
+class InstrumentedConnection(extensions.connection):
+    # psycopg2 connection_factory: every cursor (RealDictCursor etc. included) becomes a timed one
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_factory(base)
+        return super().cursor(*args, **kwargs)
+
+
+def samples(name, help, kind, values):
+    # Text-format lines for a gauge/counter; values: [({label: value}, number)]
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in values:
+        labels = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    return lines
+
+
+def render(extra_lines=()):
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
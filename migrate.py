@@ -0,0 +1,247 @@
+"""Versioned schema migrations.
+
+Migrations live in migrations/ as NNNN_name.sql, or NNNN_name.py defining upgrade(cur). Each one
+runs in its own transaction and is recorded in schema_migrations; an advisory lock keeps several
+workers starting at once from racing. The app runs `up` on startup when DB_MIGRATE_ON_START=1.
+A migration carries its own SQL rather than importing the app's modules, so it keeps doing what
+it did when it was written however those modules change later.
+    python migrate.py status    # applied / pending
+    python migrate.py up        # apply pending migrations
+    python migrate.py check     # EXPLAIN the hot queries, fail if one doesn't use its index
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import zlib
+
+from db_config import get_db_connection
+from logs import get_logger
+from slow_queries import skip_explain
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.(sql|py)$')
+LOCK_ID = zlib.crc32(b'schema_migrations')
+
+log = get_logger('migrate')
+
+# (access path, query as the app runs it, params, acceptable index names[, the only tables it may
+# scan, for queries that rely on partition pruning])
+CHECKS = [
+    ("/donations?donor_id=",
+     "SELECT donation_id, date, quantity, status, donor_id FROM donations WHERE 1=1 AND donor_id = %s "
+     "ORDER BY date DESC;", (1,), ['donations_donor_date_idx']),
+    ("/requests?recipient_id=",
+     "SELECT request_id, date, required_units, status, recipient_id, request_type, blood_group "
+     "FROM requests WHERE 1=1 AND recipient_id = %s AND recipient_region = %s ORDER BY date DESC;",
+     (1, 'North'), ['requests_recipient_date_idx'], ['requests_north']),
+    ("/admin/stats pending count",
+     "SELECT COUNT(*) FROM all_requests WHERE status = 'Pending';", (),
+     ['requests_pending_idx', 'requests_pending_date_idx']),
+    ("/admin/requests?status=Pending",
+     "SELECT request_id, date, blood_group, required_units, status, request_type, recipient_id, recipient_region "
+     "FROM all_requests WHERE recipient_region = %s AND status = %s ORDER BY date DESC, request_id DESC LIMIT %s;",
+     ('North', 'Pending', 51), ['requests_pending_date_idx']),
+    ("/admin/requests",
+     "SELECT request_id, date, blood_group, required_units, status, request_type, recipient_id, recipient_region "
+     "FROM all_requests WHERE recipient_region = %s ORDER BY date DESC, request_id DESC LIMIT %s;",
+     ('North', 51), ['requests_date_idx']),
+    ("batch fulfillment candidates",
+     "SELECT request_id FROM requests WHERE status = 'Pending' AND blood_group = %s "
+     "ORDER BY (request_type <> 'Emergency'), date, request_id LIMIT %s;", ('O-', 501),
+     ['requests_pending_idx', 'requests_pending_date_idx']),
+    ("allocation backlog",
+     "SELECT request_id, date, required_units, status, request_type, blood_group, recipient_id FROM requests "
+     "WHERE status = 'Pending' ORDER BY request_id LIMIT %s;", (500,),
+     ['requests_pending_idx', 'requests_pending_date_idx']),
+    ("/appointments?user_id=",
+     "SELECT appointment_id, date, time_slot, status, user_id FROM appointments WHERE 1=1 AND user_id = %s "
+     "ORDER BY date DESC, time_slot ASC;", (1,), ['appointments_user_date_idx']),
+    ("/login",
+     "SELECT user_id, name, contact_no, blood_group, role, email, password, region FROM users WHERE email = %s;",
+     ('someone@example.com',), ['users_email_idx']),
+    ("/appointments/availability",
+     "SELECT date, time_slot, booked FROM appointment_slot_counts "
+     "WHERE center_id = %s AND date BETWEEN %s AND %s;", (1, '2024-01-01', '2024-01-14'),
+     ['appointment_slot_counts_pkey']),
+    ("/admin/eligible_donors",
+     "SELECT donor_id, region, blood_group, last_donation FROM donor_eligibility "
+     "WHERE region = %s AND blood_group = %s AND last_donation <= %s ORDER BY last_donation, donor_id LIMIT %s;",
+     ('North', 'O-', '2024-01-01', 51), ['donor_eligibility_idx']),
+    ("FEFO unit allocation",
+     "SELECT unit_id FROM blood_units WHERE status = 'Available' AND blood_type = %s "
+     "ORDER BY expires_on, unit_id LIMIT %s;", ('O-', 2), ['blood_units_fefo']),
+]
+
+
+class MigrationError(Exception):
+    pass
+
+
+def discover():
+    # [(version, name, path)] sorted by version
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), filename, os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError("Two migrations share a version number")
+    return migrations
+
+
+def _checksum(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _applied(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            checksum VARCHAR(40) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cur.execute("SELECT version, name, checksum, applied_at FROM schema_migrations ORDER BY version;")
+    return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+def _run(cur, path):
+    if path.endswith('.sql'):
+        with open(path) as f:
+            cur.execute(f.read())
+    else:
+        spec = importlib.util.spec_from_file_location(f"migration_{os.path.basename(path)[:-3]}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(cur)
+
+
+def upgrade(conn):
+    # Applies pending migrations in order; returns the file names applied
+    skip_explain(conn)  # Its slow statements take the advisory lock or change the schema
+    cur = conn.cursor()
+    applied_now = []
+    try:
+        cur.execute("SELECT pg_advisory_lock(%s);", (LOCK_ID,))
+        try:
+            applied = _applied(cur)
+            conn.commit()
+            for version, filename, path in discover():
+                if version in applied:
+                    if applied[version][1] != _checksum(path):
+                        log.warning("Migration changed after it was applied", extra={"migration": filename})
+                    continue
+                try:
+                    _run(cur, path)
+                    cur.execute("INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+                                (version, filename, _checksum(path)))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    raise MigrationError(f"{filename} failed: {e}")
+                applied_now.append(filename)
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s);", (LOCK_ID,))
+            conn.commit()
+    finally:
+        cur.close()
+    return applied_now
+
+
+def status(conn):
+    cur = conn.cursor()
+    try:
+        applied = _applied(cur)
+        conn.commit()
+    finally:
+        cur.close()
+    return [{"version": version, "name": filename, "applied_at": str(applied[version][2]) if version in applied else None}
+            for version, filename, _ in discover()]
+
+
+def _plan_names(plan, key):
+    # Every value of `key` ('Index Name', 'Relation Name') in the plan tree
+    names = []
+    if key in plan:
+        names.append(plan[key])
+    for child in plan.get('Plans', []):
+        names.extend(_plan_names(child, key))
+    return names
+
+
+def check(conn):
+    # With sequential scans and sorts disabled the planner uses an index whenever one can serve the
+    # query's filter and order, so this checks the indexes match the query shapes independent of how
+    # much data there is.
+    # Partition indexes are reported under their parent's name.
+    cur = conn.cursor()
+    results = []
+    try:
+        for route, query, params, expected, *partitions in CHECKS:
+            cur.execute("SET LOCAL enable_seqscan = off; SET LOCAL enable_sort = off;")
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = _plan_names(plan[0]['Plan'], 'Index Name')
+            scanned = sorted(set(_plan_names(plan[0]['Plan'], 'Relation Name')))
+            cur.execute("""
+                WITH RECURSIVE up (oid) AS (
+                    SELECT oid FROM pg_class WHERE relname = ANY(%s)
+                    UNION
+                    SELECT i.inhparent FROM up JOIN pg_inherits i ON i.inhrelid = up.oid
+                )
+                SELECT c.relname FROM up JOIN pg_class c ON c.oid = up.oid
+                WHERE NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = up.oid);
+            """, (used,))
+            names = sorted(row[0] for row in cur.fetchall())
+            ok = bool(set(names) & set(expected))
+            result = {"route": route, "ok": ok, "expected": expected, "used": names}
+            if partitions:
+                result.update(ok=ok and set(scanned) <= set(partitions[0]), scanned=scanned)
+            results.append(result)
+            conn.rollback()
+    finally:
+        conn.rollback()
+        cur.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['status', 'up', 'check'])
+    args = parser.parse_args()
+    conn = get_db_connection()
+    try:
+        if args.command == 'up':
+            applied = upgrade(conn)
+            print("Applied: " + (", ".join(applied) if applied else "nothing (up to date)"))
+        elif args.command == 'status':
+            for migration in status(conn):
+                print(f"{migration['name']:<40} {migration['applied_at'] or 'pending'}")
+        else:
+            results = check(conn)
+            for result in results:
+                detail = ", ".join(result['used']) or "no index"
+                if 'scanned' in result:
+                    detail += f" (scans {', '.join(result['scanned'])})"
+                print(f"{'ok  ' if result['ok'] else 'FAIL'} {result['route']:<40} {detail}")
+            if not all(result['ok'] for result in results):
+                sys.exit(1)
+    except MigrationError as e:
+        sys.exit(f"Migration failed: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+-- Tables and views app.py expects. IF NOT EXISTS throughout, so this is a no-op on databases
+-- that were set up by hand before migrations existed.
+
+-- users and requests are list-partitioned by region (see regions.py)
+CREATE TABLE IF NOT EXISTS users (
+    user_id SERIAL,
+    name VARCHAR(100) NOT NULL,
+    contact_no VARCHAR(20),
+    blood_group VARCHAR(3),
+    role VARCHAR(20) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    region VARCHAR(10) NOT NULL DEFAULT 'North',
+    PRIMARY KEY (user_id, region)
+) PARTITION BY LIST (region);
+CREATE TABLE IF NOT EXISTS users_north PARTITION OF users FOR VALUES IN ('North');
+CREATE TABLE IF NOT EXISTS users_south PARTITION OF users FOR VALUES IN ('South');
+
+CREATE TABLE IF NOT EXISTS requests (
+    request_id SERIAL,
+    date DATE DEFAULT CURRENT_DATE,
+    required_units INT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'Pending',
+    recipient_id INT,
+    recipient_region VARCHAR(10) NOT NULL DEFAULT 'North',
+    request_type VARCHAR(20),
+    blood_group VARCHAR(3),
+    PRIMARY KEY (request_id, recipient_region)
+) PARTITION BY LIST (recipient_region);
+CREATE TABLE IF NOT EXISTS requests_north PARTITION OF requests FOR VALUES IN ('North');
+CREATE TABLE IF NOT EXISTS requests_south PARTITION OF requests FOR VALUES IN ('South');
+
+CREATE TABLE IF NOT EXISTS donations (
+    donation_id SERIAL PRIMARY KEY,
+    date DATE DEFAULT CURRENT_DATE,
+    quantity INT NOT NULL,
+    status VARCHAR(20),
+    donor_id INT
+);
+
+CREATE TABLE IF NOT EXISTS hospitals (
+    org_id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    contact VARCHAR(50),
+    location VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS appointments (
+    appointment_id SERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    time_slot TIME NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'Pending',
+    user_id INT
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id SERIAL PRIMARY KEY,
+    date DATE DEFAULT CURRENT_DATE,
+    units_allocated INT,
+    method VARCHAR(100),
+    request_id INT,
+    donation_id INT
+);
+
+-- Writes go to inventory_master, reads through inventory_replica
+CREATE TABLE IF NOT EXISTS inventory_master (
+    blood_type VARCHAR(3) PRIMARY KEY,
+    units INT NOT NULL DEFAULT 0,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO inventory_master (blood_type, units)
+SELECT blood_type, 0 FROM unnest(ARRAY['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']) AS blood_type
+ON CONFLICT (blood_type) DO NOTHING;
+
+-- Views are only created when missing, so hand-built ones (e.g. over fragment tables) are kept
+DO $$
+BEGIN
+    IF to_regclass('all_users') IS NULL THEN
+        CREATE VIEW all_users AS SELECT * FROM users;
+    END IF;
+    IF to_regclass('all_requests') IS NULL THEN
+        CREATE VIEW all_requests AS SELECT * FROM requests;
+    END IF;
+    IF to_regclass('inventory_replica') IS NULL THEN
+        CREATE VIEW inventory_replica AS SELECT * FROM inventory_master;
+    END IF;
+END;
+$$;
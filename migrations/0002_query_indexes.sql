@@ -0,0 +1,28 @@
+-- Indexes for the app's hot access paths; `python migrate.py check` EXPLAINs the matching queries.
+-- Indexes on the partitioned tables are created on every partition.
+
+-- /donations?donor_id= ORDER BY date DESC (donor dashboard)
+CREATE INDEX IF NOT EXISTS donations_donor_date_idx ON donations (donor_id, date DESC);
+-- /export/donations?from=&to=
+CREATE INDEX IF NOT EXISTS donations_date_idx ON donations (date, donation_id);
+
+-- /requests?recipient_id= ORDER BY date DESC (recipient dashboard)
+CREATE INDEX IF NOT EXISTS requests_recipient_date_idx ON requests (recipient_id, date DESC);
+-- Pending backlog: stats count, batch fulfillment / allocation (ORDER BY request_id), and the
+-- admin list filtered on status=Pending (ORDER BY date DESC, request_id DESC); small, since
+-- fulfilled requests drop out of it
+CREATE INDEX IF NOT EXISTS requests_pending_idx ON requests (request_id) WHERE status = 'Pending';
+CREATE INDEX IF NOT EXISTS requests_pending_date_idx ON requests (date DESC, request_id DESC)
+    WHERE status = 'Pending';
+-- Unfiltered /admin/requests keyset paging
+CREATE INDEX IF NOT EXISTS requests_date_idx ON requests (date DESC, request_id DESC);
+
+-- /appointments?user_id= ORDER BY date DESC, time_slot
+CREATE INDEX IF NOT EXISTS appointments_user_date_idx ON appointments (user_id, date DESC, time_slot);
+
+-- Login: WHERE email = %s (can't be UNIQUE: unique indexes on users must include region)
+CREATE INDEX IF NOT EXISTS users_email_idx ON users (email);
+
+-- /export/transactions?from=&to=, and looking up what a request was given
+CREATE INDEX IF NOT EXISTS transactions_date_idx ON transactions (date, transaction_id);
+CREATE INDEX IF NOT EXISTS transactions_request_idx ON transactions (request_id);
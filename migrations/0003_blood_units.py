@@ -0,0 +1,78 @@
+# Unit-level stock (see blood_units.py); adopts the current inventory counts as units.
+# Frozen as of this migration: later changes to blood_units.py don't alter what it does.
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS blood_units (
+        unit_id SERIAL PRIMARY KEY,
+        blood_type VARCHAR(3) NOT NULL,
+        component VARCHAR(20) NOT NULL DEFAULT 'Whole Blood',
+        collected_on DATE NOT NULL DEFAULT CURRENT_DATE,
+        expires_on DATE NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'Available',
+        donation_id INT,
+        request_id INT,
+        allocated_at TIMESTAMP
+    );
+    -- FEFO lookups and the expiry sweep only ever look at available units
+    CREATE INDEX IF NOT EXISTS blood_units_fefo ON blood_units (blood_type, expires_on, unit_id)
+        WHERE status = 'Available';
+    CREATE INDEX IF NOT EXISTS blood_units_request ON blood_units (request_id) WHERE request_id IS NOT NULL;
+
+    -- Keeps inventory_master.units = COUNT(*) of Available units, one UPDATE per statement and type
+    CREATE OR REPLACE FUNCTION blood_units_sync_inventory() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO inventory_master (blood_type, units)
+            SELECT blood_type, COUNT(*) FROM new_units WHERE status = 'Available'
+            GROUP BY blood_type ORDER BY blood_type
+            ON CONFLICT (blood_type) DO UPDATE
+                SET units = inventory_master.units + EXCLUDED.units, last_updated = CURRENT_TIMESTAMP;
+        ELSIF TG_OP = 'UPDATE' THEN
+            UPDATE inventory_master i SET units = i.units + d.change, last_updated = CURRENT_TIMESTAMP
+            FROM (
+                SELECT blood_type, SUM(change) AS change FROM (
+                    SELECT blood_type, -1 AS change FROM old_units WHERE status = 'Available'
+                    UNION ALL
+                    SELECT blood_type, 1 FROM new_units WHERE status = 'Available'
+                ) c GROUP BY blood_type
+            ) d
+            WHERE i.blood_type = d.blood_type AND d.change <> 0;
+        ELSE
+            UPDATE inventory_master i SET units = i.units - d.change, last_updated = CURRENT_TIMESTAMP
+            FROM (SELECT blood_type, COUNT(*) AS change FROM old_units WHERE status = 'Available' GROUP BY blood_type) d
+            WHERE i.blood_type = d.blood_type;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS blood_units_insert ON blood_units;
+    CREATE TRIGGER blood_units_insert AFTER INSERT ON blood_units
+        REFERENCING NEW TABLE AS new_units FOR EACH STATEMENT EXECUTE FUNCTION blood_units_sync_inventory();
+    DROP TRIGGER IF EXISTS blood_units_update ON blood_units;
+    CREATE TRIGGER blood_units_update AFTER UPDATE ON blood_units
+        REFERENCING OLD TABLE AS old_units NEW TABLE AS new_units
+        FOR EACH STATEMENT EXECUTE FUNCTION blood_units_sync_inventory();
+    DROP TRIGGER IF EXISTS blood_units_delete ON blood_units;
+    CREATE TRIGGER blood_units_delete AFTER DELETE ON blood_units
+        REFERENCING OLD TABLE AS old_units FOR EACH STATEMENT EXECUTE FUNCTION blood_units_sync_inventory();
+"""
+
+ADOPT_SQL = """
+    INSERT INTO blood_units (blood_type, component, collected_on, expires_on)
+    SELECT %s, 'Whole Blood', CURRENT_DATE, CURRENT_DATE + 35 FROM generate_series(1, %s);
+"""
+
+
+def upgrade(cur):
+    # Existing inventory_master counts become Whole Blood units collected today, unless
+    # blood_units already existed (set up before migrations); the insert trigger restores the counts
+    cur.execute("SELECT to_regclass('blood_units') IS NULL;")
+    adopt = cur.fetchone()[0]
+    cur.execute(SCHEMA_SQL)
+    if adopt:
+        cur.execute("SELECT blood_type, units FROM inventory_master ORDER BY blood_type FOR UPDATE;")
+        counts = [(blood_type, units) for blood_type, units in cur.fetchall() if units > 0]
+        cur.execute("UPDATE inventory_master SET units = 0;")
+        for blood_type, units in counts:
+            cur.execute(ADOPT_SQL, (blood_type, units))
@@ -0,0 +1,37 @@
+# Appointment slot capacities and per-slot booking counts (see appointment_slots.py).
+# Frozen as of this migration: later changes to appointment_slots.py don't alter what it does.
+import os
+
+SCHEMA_SQL = """
+    ALTER TABLE appointments ADD COLUMN IF NOT EXISTS center_id INT;
+    CREATE TABLE IF NOT EXISTS appointment_capacity (
+        center_id INT NOT NULL,
+        time_slot TIME NOT NULL,
+        capacity INT NOT NULL CHECK (capacity >= 0),
+        PRIMARY KEY (center_id, time_slot)
+    );
+    -- Live bookings per slot, maintained by book(); booked can exceed a capacity lowered later
+    CREATE TABLE IF NOT EXISTS appointment_slot_counts (
+        center_id INT NOT NULL,
+        date DATE NOT NULL,
+        time_slot TIME NOT NULL,
+        booked INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (center_id, date, time_slot)
+    );
+"""
+
+# Existing appointments, counted per slot; those without a center go to the default one
+COUNT_SQL = """
+    INSERT INTO appointment_slot_counts (center_id, date, time_slot, booked)
+    SELECT COALESCE(center_id, %s), date, time_slot, COUNT(*) FROM appointments
+    WHERE status <> 'Cancelled'
+    GROUP BY 1, 2, 3;
+"""
+
+
+def upgrade(cur):
+    cur.execute("SELECT to_regclass('appointment_slot_counts') IS NULL;")
+    new = cur.fetchone()[0]
+    cur.execute(SCHEMA_SQL)
+    if new:
+        cur.execute(COUNT_SQL, (int(os.environ.get('APPOINTMENT_DEFAULT_CENTER', '1')),))
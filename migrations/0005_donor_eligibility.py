@@ -0,0 +1,100 @@
+# Eligible-donor index for shortage outreach, kept current by triggers (see donor_eligibility.py).
+# Frozen as of this migration: later changes to donor_eligibility.py don't alter what it does.
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS donor_eligibility (
+        donor_id INT PRIMARY KEY,
+        region VARCHAR(10) NOT NULL,
+        blood_group VARCHAR(3) NOT NULL,
+        last_donation DATE NOT NULL DEFAULT '-infinity'  -- Never donated sorts first
+    );
+    CREATE INDEX IF NOT EXISTS donor_eligibility_idx
+        ON donor_eligibility (region, blood_group, last_donation, donor_id);
+
+    CREATE OR REPLACE FUNCTION donor_eligibility_sync_users() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM donor_eligibility e USING old_users o WHERE e.donor_id = o.user_id;
+        ELSIF TG_OP = 'INSERT' THEN
+            INSERT INTO donor_eligibility (donor_id, region, blood_group, last_donation)
+            SELECT n.user_id, n.region, n.blood_group,
+                   COALESCE((SELECT MAX(date) FROM donations d WHERE d.donor_id = n.user_id), '-infinity')
+            FROM new_users n WHERE n.role = 'Donor' AND n.blood_group IS NOT NULL
+            ON CONFLICT (donor_id) DO UPDATE SET region = EXCLUDED.region, blood_group = EXCLUDED.blood_group;
+        ELSE
+            -- Only rows whose role, region or blood group changed (logins rehash passwords, for one)
+            DELETE FROM donor_eligibility e USING old_users o JOIN new_users n ON n.user_id = o.user_id
+            WHERE e.donor_id = n.user_id
+              AND (n.role, n.region, n.blood_group) IS DISTINCT FROM (o.role, o.region, o.blood_group)
+              AND (n.role <> 'Donor' OR n.blood_group IS NULL);
+            INSERT INTO donor_eligibility (donor_id, region, blood_group, last_donation)
+            SELECT n.user_id, n.region, n.blood_group,
+                   COALESCE((SELECT MAX(date) FROM donations d WHERE d.donor_id = n.user_id), '-infinity')
+            FROM new_users n JOIN old_users o ON o.user_id = n.user_id
+            WHERE (n.role, n.region, n.blood_group) IS DISTINCT FROM (o.role, o.region, o.blood_group)
+              AND n.role = 'Donor' AND n.blood_group IS NOT NULL
+            ON CONFLICT (donor_id) DO UPDATE SET region = EXCLUDED.region, blood_group = EXCLUDED.blood_group;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION donor_eligibility_sync_donations() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE donor_eligibility e SET last_donation = n.last_donation
+            FROM (SELECT donor_id, MAX(date) AS last_donation FROM new_donations GROUP BY donor_id) n
+            WHERE e.donor_id = n.donor_id AND e.last_donation < n.last_donation;
+        ELSE
+            -- Changed or deleted donations: re-read those donors' latest (an index probe each)
+            UPDATE donor_eligibility e
+            SET last_donation = COALESCE((SELECT MAX(date) FROM donations d WHERE d.donor_id = e.donor_id), '-infinity')
+            WHERE e.donor_id IN (SELECT donor_id FROM old_donations);
+            IF TG_OP = 'UPDATE' THEN
+                UPDATE donor_eligibility e SET last_donation = n.last_donation
+                FROM (SELECT donor_id, MAX(date) AS last_donation FROM new_donations GROUP BY donor_id) n
+                WHERE e.donor_id = n.donor_id AND e.last_donation < n.last_donation;
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS donor_eligibility_users_insert ON users;
+    CREATE TRIGGER donor_eligibility_users_insert AFTER INSERT ON users
+        REFERENCING NEW TABLE AS new_users FOR EACH STATEMENT EXECUTE FUNCTION donor_eligibility_sync_users();
+    DROP TRIGGER IF EXISTS donor_eligibility_users_update ON users;
+    CREATE TRIGGER donor_eligibility_users_update AFTER UPDATE ON users
+        REFERENCING OLD TABLE AS old_users NEW TABLE AS new_users
+        FOR EACH STATEMENT EXECUTE FUNCTION donor_eligibility_sync_users();
+    DROP TRIGGER IF EXISTS donor_eligibility_users_delete ON users;
+    CREATE TRIGGER donor_eligibility_users_delete AFTER DELETE ON users
+        REFERENCING OLD TABLE AS old_users FOR EACH STATEMENT EXECUTE FUNCTION donor_eligibility_sync_users();
+    DROP TRIGGER IF EXISTS donor_eligibility_donations_insert ON donations;
+    CREATE TRIGGER donor_eligibility_donations_insert AFTER INSERT ON donations
+        REFERENCING NEW TABLE AS new_donations FOR EACH STATEMENT EXECUTE FUNCTION donor_eligibility_sync_donations();
+    DROP TRIGGER IF EXISTS donor_eligibility_donations_update ON donations;
+    CREATE TRIGGER donor_eligibility_donations_update AFTER UPDATE ON donations
+        REFERENCING OLD TABLE AS old_donations NEW TABLE AS new_donations
+        FOR EACH STATEMENT EXECUTE FUNCTION donor_eligibility_sync_donations();
+    DROP TRIGGER IF EXISTS donor_eligibility_donations_delete ON donations;
+    CREATE TRIGGER donor_eligibility_donations_delete AFTER DELETE ON donations
+        REFERENCING OLD TABLE AS old_donations FOR EACH STATEMENT EXECUTE FUNCTION donor_eligibility_sync_donations();
+"""
+
+FILL_SQL = """
+    INSERT INTO donor_eligibility (donor_id, region, blood_group, last_donation)
+    SELECT u.user_id, u.region, u.blood_group, COALESCE(d.last_donation, '-infinity')
+    FROM users u
+    LEFT JOIN (SELECT donor_id, MAX(date) AS last_donation FROM donations GROUP BY donor_id) d
+        ON d.donor_id = u.user_id
+    WHERE u.role = 'Donor' AND u.blood_group IS NOT NULL;
+"""
+
+
+def upgrade(cur):
+    cur.execute("SELECT to_regclass('donor_eligibility') IS NULL;")
+    new = cur.fetchone()[0]
+    cur.execute(SCHEMA_SQL)
+    if new:
+        cur.execute(FILL_SQL)
@@ -0,0 +1,73 @@
+# donor_eligibility.last_donation counts Completed donations only: a Pending booking no longer
+# takes a donor off the outreach list. Replaces 0005's trigger functions and refills the column.
+# Frozen as of this migration: later changes to donor_eligibility.py don't alter what it does.
+
+SCHEMA_SQL = """
+    CREATE OR REPLACE FUNCTION donor_eligibility_sync_users() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM donor_eligibility e USING old_users o WHERE e.donor_id = o.user_id;
+        ELSIF TG_OP = 'INSERT' THEN
+            INSERT INTO donor_eligibility (donor_id, region, blood_group, last_donation)
+            SELECT n.user_id, n.region, n.blood_group,
+                   COALESCE((SELECT MAX(date) FROM donations d
+                             WHERE d.donor_id = n.user_id AND d.status = 'Completed'), '-infinity')
+            FROM new_users n WHERE n.role = 'Donor' AND n.blood_group IS NOT NULL
+            ON CONFLICT (donor_id) DO UPDATE SET region = EXCLUDED.region, blood_group = EXCLUDED.blood_group;
+        ELSE
+            -- Only rows whose role, region or blood group changed (logins rehash passwords, for one)
+            DELETE FROM donor_eligibility e USING old_users o JOIN new_users n ON n.user_id = o.user_id
+            WHERE e.donor_id = n.user_id
+              AND (n.role, n.region, n.blood_group) IS DISTINCT FROM (o.role, o.region, o.blood_group)
+              AND (n.role <> 'Donor' OR n.blood_group IS NULL);
+            INSERT INTO donor_eligibility (donor_id, region, blood_group, last_donation)
+            SELECT n.user_id, n.region, n.blood_group,
+                   COALESCE((SELECT MAX(date) FROM donations d
+                             WHERE d.donor_id = n.user_id AND d.status = 'Completed'), '-infinity')
+            FROM new_users n JOIN old_users o ON o.user_id = n.user_id
+            WHERE (n.role, n.region, n.blood_group) IS DISTINCT FROM (o.role, o.region, o.blood_group)
+              AND n.role = 'Donor' AND n.blood_group IS NOT NULL
+            ON CONFLICT (donor_id) DO UPDATE SET region = EXCLUDED.region, blood_group = EXCLUDED.blood_group;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION donor_eligibility_sync_donations() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE donor_eligibility e SET last_donation = n.last_donation
+            FROM (SELECT donor_id, MAX(date) AS last_donation FROM new_donations
+                  WHERE status = 'Completed' GROUP BY donor_id) n
+            WHERE e.donor_id = n.donor_id AND e.last_donation < n.last_donation;
+        ELSE
+            -- Changed or deleted donations (e.g. Pending -> Completed): re-read those donors' latest
+            UPDATE donor_eligibility e
+            SET last_donation = COALESCE((SELECT MAX(date) FROM donations d
+                                          WHERE d.donor_id = e.donor_id AND d.status = 'Completed'), '-infinity')
+            WHERE e.donor_id IN (SELECT donor_id FROM old_donations);
+            IF TG_OP = 'UPDATE' THEN
+                UPDATE donor_eligibility e SET last_donation = n.last_donation
+                FROM (SELECT donor_id, MAX(date) AS last_donation FROM new_donations
+                      WHERE status = 'Completed' GROUP BY donor_id) n
+                WHERE e.donor_id = n.donor_id AND e.last_donation < n.last_donation;
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+REFILL_SQL = """
+    UPDATE donor_eligibility e SET last_donation = COALESCE(d.last_donation, '-infinity')
+    FROM donor_eligibility c
+    LEFT JOIN (SELECT donor_id, MAX(date) AS last_donation FROM donations
+               WHERE status = 'Completed' GROUP BY donor_id) d ON d.donor_id = c.donor_id
+    WHERE e.donor_id = c.donor_id AND e.last_donation <> COALESCE(d.last_donation, '-infinity');
+"""
+
+
+def upgrade(cur):
+    cur.execute("LOCK TABLE donor_eligibility IN EXCLUSIVE MODE;")  # No trigger writes in between
+    cur.execute(SCHEMA_SQL)
+    cur.execute(REFILL_SQL)
@@ -0,0 +1,7 @@
+-- The latest demand forecast (see forecast.py): one worker computes it, every worker reads it.
+-- A single row; JSON rather than JSONB so the blood types keep their order.
+CREATE TABLE IF NOT EXISTS forecast_snapshot (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    snapshot JSON NOT NULL,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+# bcrypt work factor for new hashes; stored hashes with a different cost are re-hashed on login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+# 'process' (default), 'thread' or 'inline' (hash on the request thread, the old behaviour)
+HASH_EXECUTOR = os.environ.get('HASH_EXECUTOR', 'process')
+# Concurrent hashes per worker process; bounds how much CPU password hashing can take
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', str(os.cpu_count() or 1)))
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def configure(executor=None, workers=None, rounds=None):
+    # Used by benchmarks; the app itself is configured through environment variables
+    global HASH_EXECUTOR, HASH_WORKERS, BCRYPT_ROUNDS
+    shutdown()
+    if executor is not None:
+        HASH_EXECUTOR = executor
+    if workers is not None:
+        HASH_WORKERS = workers
+    if rounds is not None:
+        BCRYPT_ROUNDS = rounds
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if HASH_EXECUTOR == 'inline':
+        return None
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                if HASH_EXECUTOR == 'thread':
+                    _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+                else:
+                    # forkserver: never fork the (multi-threaded) gunicorn worker itself
+                    _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                                    mp_context=multiprocessing.get_context('forkserver'))
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _run(fn, *args):
+    executor = _get_executor()
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+def hash_password(password):
+    return _run(_hashpw, password.encode('utf-8'), BCRYPT_ROUNDS)
+
+
+def check_password(password, hashed):
+    return _run(_checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def needs_rehash(hashed):
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+def shutdown():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=True)
+        _executor = None
+        _executor_pid = None
@@ -0,0 +1,46 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# users and requests are list-partitioned by region (users.region, requests.recipient_region).
+# Queries for one region carry a region predicate so Postgres only touches that partition; admin
+# views run one such query per region in parallel (own connection each) and merge the sorted results.
+REGIONS = ['North', 'South']
+DEFAULT_REGION = 'North'  # Same default as the users.region column
+FANOUT_WORKERS = int(os.environ.get('REGION_FANOUT_WORKERS', str(2 * len(REGIONS))))
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='region-fanout')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def fan_out(pool, regions, query):
+    # Runs query(conn, region) for every region concurrently, each on its own connection from pool.
+    # Returns the results in `regions` order; the first exception is re-raised. Each task runs in a
+    # copy of the caller's context, so its queries count towards the request's metrics.
+    def run(region):
+        with pool.connection() as conn:
+            return query(conn, region)
+
+    if len(regions) == 1:
+        return [run(regions[0])]  # Nothing to overlap; skip the thread hop
+    contexts = [contextvars.copy_context() for _ in regions]
+    return list(_get_executor().map(lambda ctx, region: ctx.run(run, region), contexts, regions))
+
+
+def merge_sorted(results, key, reverse=False, limit=None):
+    # Merges per-region lists that are each already sorted by key
+    return list(itertools.islice(heapq.merge(*results, key=key, reverse=reverse), limit))
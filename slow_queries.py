@@ -0,0 +1,200 @@
+import collections
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from logs import get_logger
+
+# Slow-query capture. Every timed cursor (see metrics.TimedCursorMixin) reports statements slower
+# than SLOW_QUERY_MS here. Statements are grouped by normalized text (literals and placeholders
+# become '?', VALUES lists collapse), the most recent samples are kept in a ring buffer, and a
+# read-only SELECT is re-run once per EXPLAIN_INTERVAL under EXPLAIN (ANALYZE, BUFFERS) on a
+# background thread so the plan is in the report. Per worker process, like the other admin stats.
+# A SELECT that calls a function with side effects (advisory locks, NOTIFY, sequences, ...) is never
+# re-run, and neither is anything on a connection passed to skip_explain() (the migrator's).
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))  # 0 disables capture
+RECENT_SIZE = int(os.environ.get('SLOW_QUERY_RECENT', '100'))
+MAX_STATEMENTS = int(os.environ.get('SLOW_QUERY_STATEMENTS', '200'))
+EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', '300'))  # Per statement; 0 disables
+EXPLAIN_TIMEOUT_MS = int(os.environ.get('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', '10000'))
+
+log = get_logger('slow_queries')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%(?:\(\w+\))?s")
+_ROW = r"\(\s*\?(?:\s*,\s*\?)*\s*\)"
+_ROWS = re.compile(rf"({_ROW})(?:\s*,\s*{_ROW})+")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_LOCKING = re.compile(r"\bFOR\s+(UPDATE|SHARE|NO KEY UPDATE|KEY SHARE)\b|\b(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+_SIDE_EFFECTS = re.compile(
+    r"\b(pg_(try_)?advisory\w*|pg_notify|nextval|setval|setseed|set_config|"
+    r"pg_(terminate|cancel)_backend|pg_reload_conf|pg_switch_wal|pg_stat_reset\w*|pg_logical_emit_message|"
+    r"txid_current|pg_current_xact_id|lo_\w+|dblink\w*)\s*\(", re.IGNORECASE)
+
+
+def normalize(query, cursor=None):
+    if hasattr(query, 'as_string'):
+        query = query.as_string(cursor)  # psycopg2.sql.Composed
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = _STRING.sub('?', query)
+    query = _PLACEHOLDER.sub('?', query)
+    query = _NUMBER.sub('?', query)
+    query = _ROWS.sub(r'\1, ...', query)
+    query = _IN_LIST.sub('IN (?, ...)', query)
+    return _WHITESPACE.sub(' ', query).strip()
+
+
+def params_shape(params):
+    # Types only, never values: [int, str, list[3]] / {name: type}
+    def shape(value):
+        if isinstance(value, (list, tuple)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: shape(value) for key, value in params.items()}
+    return [shape(value) for value in params]
+
+
+def skip_explain(conn):
+    # Slow statements on conn are still captured, just never re-run (conn: metrics.InstrumentedConnection)
+    conn.explain_slow_queries = False
+
+
+class SlowQueryLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self.recent = collections.deque(maxlen=RECENT_SIZE)
+        self.statements = {}  # normalized text -> aggregate
+        self._explaining = set()
+        self._executor = None
+        self.captured = 0
+        self.explains = 0
+        self.explain_errors = 0
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def record(self, cursor, query, params, elapsed, route=None):
+        # Called by the cursor after a statement that took >= SLOW_QUERY_MS
+        text = normalize(query, cursor)
+        if text.upper().startswith('EXPLAIN'):
+            return
+        ms = round(elapsed * 1000, 3)
+        sample = {"statement": text, "params": params_shape(params), "ms": ms, "route": route,
+                  "at": round(time.time(), 3)}
+        with self._lock:
+            self._check_fork()
+            self.captured += 1
+            self.recent.append(sample)
+            stats = self.statements.get(text)
+            if stats is None:
+                if len(self.statements) >= MAX_STATEMENTS:
+                    # Make room by dropping the statement that has cost the least overall
+                    del self.statements[min(self.statements, key=lambda t: self.statements[t]['total_ms'])]
+                stats = self.statements[text] = {"statement": text, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                 "last_ms": 0.0, "last_at": None, "routes": set(),
+                                                 "explain": None, "explained_at": None}
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['last_ms'] = ms
+            stats['last_at'] = sample['at']
+            if route:
+                stats['routes'].add(route)
+            explain = self._should_explain(text, stats, cursor)
+            if explain:
+                self._explaining.add(text)
+        log.info("Slow query", extra=sample)
+        if explain:
+            try:
+                # Bind the parameters here, on the connection that ran the statement
+                bound = cursor.mogrify(query, params)
+            except Exception:
+                with self._lock:
+                    self._explaining.discard(text)
+                return
+            self._get_executor().submit(self._explain, text, bound)
+
+    def _should_explain(self, text, stats, cursor=None):
+        if EXPLAIN_INTERVAL <= 0 or text in self._explaining:
+            return False
+        if cursor is not None and not getattr(cursor.connection, 'explain_slow_queries', True):
+            return False
+        # EXPLAIN ANALYZE runs the statement again, so only plain reads qualify
+        if not _EXPLAINABLE.match(text) or _LOCKING.search(text) or _SIDE_EFFECTS.search(text):
+            return False
+        return stats['explained_at'] is None or time.time() - stats['explained_at'] >= EXPLAIN_INTERVAL
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+            return self._executor
+
+    def _explain(self, text, bound):
+        # db_config imports this module (through metrics), so the pool is looked up lazily
+        from db_config import get_pool
+        plan = None
+        try:
+            with get_pool().connection() as conn:
+                cur = conn.cursor()
+                try:
+                    # Read-only and time-boxed: a sampled plan must never write or hang around
+                    cur.execute("SET TRANSACTION READ ONLY;")
+                    cur.execute("SET LOCAL statement_timeout = %s;", (EXPLAIN_TIMEOUT_MS,))
+                    cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + bound)
+                    plan = '\n'.join(row[0] for row in cur.fetchall())
+                finally:
+                    cur.close()
+                    conn.rollback()
+        except Exception as e:
+            log.warning("EXPLAIN of slow query failed", extra={"statement": text, "error": str(e)})
+        with self._lock:
+            self._explaining.discard(text)
+            if plan is None:
+                self.explain_errors += 1
+            else:
+                self.explains += 1
+            stats = self.statements.get(text)
+            if stats is not None:
+                # A failed EXPLAIN also waits out the interval rather than retrying on every slow run
+                stats['explained_at'] = round(time.time(), 3)
+                if plan is not None:
+                    stats['explain'] = plan
+
+    def report(self, limit=None):
+        with self._lock:
+            self._check_fork()
+            statements = sorted(self.statements.values(), key=lambda s: s['total_ms'], reverse=True)[:limit]
+            return {
+                "threshold_ms": SLOW_QUERY_MS,
+                "explain_interval": EXPLAIN_INTERVAL,
+                "captured": self.captured,
+                "explains": self.explains,
+                "explain_errors": self.explain_errors,
+                "statements": [dict(s, total_ms=round(s['total_ms'], 3), routes=sorted(s['routes']),
+                                    mean_ms=round(s['total_ms'] / s['count'], 3)) for s in statements],
+                "recent": list(reversed(self.recent))[:limit],
+            }
+
+    def clear(self):
+        with self._lock:
+            self.recent.clear()
+            self.statements.clear()
+
+
+slow_log = SlowQueryLog()